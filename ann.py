@@ -0,0 +1,121 @@
+# ann.py
+# RU: Бэкенды поиска ближайших соседей для RAG: точный перебор (эталон) и IVF на numpy.
+import logging
+import math
+
+import numpy as np
+
+from vecstore import VecStore
+
+
+def topk(S: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """RU: Top-k по строкам матрицы сходств через argpartition (без полной сортировки)."""
+    n = S.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        empty = np.empty((len(S), 0))
+        return empty.astype("int64"), empty.astype("float32")
+    if k < n:
+        idx = np.argpartition(-S, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.tile(np.arange(n), (len(S), 1))
+    part = np.take_along_axis(S, idx, axis=1)
+    order = np.argsort(-part, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+class BruteForceIndex:
+    """RU: Точный поиск по всей матрице — эталонная реализация."""
+
+    name = "brute"
+
+    def __init__(self, store: VecStore):
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def search(self, Q: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """RU: Возвращает (индексы, сходства) формы (nq, k) для нормированных запросов."""
+        return topk(self.store.scores(Q), k)
+
+
+class IVFIndex:
+    """RU: Инвертированный индекс по кластерам (IVF-Flat).
+
+    Векторы разбиваются сферическим k-means на nlist кластеров; запрос
+    просматривает только nprobe ближайших кластеров. Больше nprobe — выше
+    recall и ниже скорость; nprobe == nlist эквивалентно полному перебору.
+    """
+
+    name = "ivf"
+
+    def __init__(self, store: VecStore, nlist: int = 0, nprobe: int = 16, iters: int = 10, seed: int = 0):
+        self.store = store
+        n = len(store)
+        self.nlist = max(1, min(n, nlist or int(4 * math.sqrt(n))))
+        self.nprobe = max(1, min(nprobe, self.nlist))
+        self._build(iters, seed)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def _assign(self, C: np.ndarray, block: int = 16384) -> np.ndarray:
+        """RU: Номер ближайшего центроида для каждой строки хранилища (поблочно)."""
+        n = len(self.store)
+        out = np.empty(n, dtype="int64")
+        for start in range(0, n, block):
+            rows = self.store.rows(slice(start, start + block))
+            out[start:start + block] = np.argmax(rows @ C.T, axis=1)
+        return out
+
+    def _build(self, iters: int, seed: int) -> None:
+        """RU: Обучает центроиды на выборке и раскладывает все строки по спискам."""
+        rng = np.random.default_rng(seed)
+        n = len(self.store)
+        sample_size = min(n, self.nlist * 64)
+        sample = np.sort(rng.choice(n, sample_size, replace=False))
+        X = self.store.rows(sample)
+        X /= np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+        C = X[rng.choice(sample_size, self.nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(X @ C.T, axis=1)
+            sums = np.zeros_like(C)
+            np.add.at(sums, assign, X)
+            counts = np.bincount(assign, minlength=self.nlist)
+            empty = counts == 0
+            if empty.any():
+                # RU: Пустые кластеры переинициализируем случайными точками выборки
+                sums[empty] = X[rng.choice(sample_size, int(empty.sum()))]
+            C = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        self.centroids = C.astype("float32")
+        assign = self._assign(self.centroids)
+        self.order = np.argsort(assign, kind="stable")
+        self.offsets = np.searchsorted(assign[self.order], np.arange(self.nlist + 1))
+        logging.info("ANN: IVF built with nlist=%d nprobe=%d over %d vectors", self.nlist, self.nprobe, n)
+
+    def search(self, Q: np.ndarray, k: int, nprobe: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """RU: Приближённый top-k: перебор только строк из nprobe ближайших кластеров."""
+        Q = np.asarray(Q, dtype="float32")
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        probes, _ = topk(Q @ self.centroids.T, nprobe)
+        out_idx = np.full((len(Q), k), -1, dtype="int64")
+        out_sc = np.full((len(Q), k), -np.inf, dtype="float32")
+        for qi, (q, lists) in enumerate(zip(Q, probes)):
+            cand = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+            if len(cand) == 0:
+                continue
+            sims = self.store.rows(cand) @ q
+            idx, sc = topk(sims[None, :], k)
+            out_idx[qi, :idx.shape[1]] = cand[idx[0]]
+            out_sc[qi, :sc.shape[1]] = sc[0]
+        return out_idx, out_sc
+
+
+def make_index(store: VecStore, backend: str = "auto", min_chunks: int = 20000, nlist: int = 0, nprobe: int = 16):
+    """RU: Создаёт бэкенд поиска: brute | ivf | auto (IVF начиная с min_chunks векторов)."""
+    if backend == "ivf" or (backend == "auto" and len(store) >= min_chunks):
+        return IVFIndex(store, nlist=nlist, nprobe=nprobe)
+    if backend not in ("brute", "auto"):
+        logging.warning("ANN: unknown backend %r, using brute force", backend)
+    return BruteForceIndex(store)
@@ -0,0 +1,97 @@
+# answer_cache.py
+# RU: Семантический кэш готовых ответов: похожий вопрос (по косинусу эмбеддингов)
+# при той же версии системного промпта и индекса базы знаний получает прошлый ответ.
+# Ответ пишется с учётом истории диалога и обращается к автору по имени, поэтому
+# переиспользуется только в том же чате для того же пользователя.
+import hashlib
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+import config
+
+
+class CachedAnswer(NamedTuple):
+    """RU: Запись кэша ответов."""
+    vec: np.ndarray        # RU: нормированный эмбеддинг вопроса
+    prompt_ver: str
+    kb_version: int
+    scope: tuple           # RU: (чат, пользователь), для которых написан ответ
+    question: str
+    answer: str
+    created: float
+
+
+# RU: LRU: номер записи -> запись (в конце — самые свежие по использованию)
+_ENTRIES: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+_NEXT_ID = 0
+_STATS = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evicted": 0}
+
+
+def prompt_version(sys_prompt: str) -> str:
+    """RU: Короткий отпечаток системного промпта — смена промпта инвалидирует ответы."""
+    return hashlib.sha1((sys_prompt or "").encode("utf-8")).hexdigest()[:12]
+
+
+def _normalize(vec) -> np.ndarray:
+    """RU: float32-вектор единичной длины."""
+    v = np.asarray(vec, dtype="float32")
+    return v / max(float(np.linalg.norm(v)), 1e-12)
+
+
+def _expire(now: float) -> None:
+    """RU: Удаляет записи старше ANSWER_CACHE_TTL."""
+    for key in [key for key, e in _ENTRIES.items() if now - e.created > config.ANSWER_CACHE_TTL]:
+        del _ENTRIES[key]
+        _STATS["expired"] += 1
+
+
+def lookup(q_emb, prompt_ver: str, kb_version: int, scope: tuple) -> CachedAnswer | None:
+    """RU: Самый похожий ответ того же чата и пользователя с косинусом не ниже ANSWER_CACHE_SIM."""
+    if not config.ANSWER_CACHE_ENABLED or q_emb is None:
+        return None
+    _expire(time.time())
+    keys = [key for key, e in _ENTRIES.items()
+            if e.prompt_ver == prompt_ver and e.kb_version == kb_version and e.scope == scope]
+    if keys:
+        sims = np.stack([_ENTRIES[key].vec for key in keys]) @ _normalize(q_emb)
+        best = int(np.argmax(sims))
+        if float(sims[best]) >= config.ANSWER_CACHE_SIM:
+            _ENTRIES.move_to_end(keys[best])
+            _STATS["hits"] += 1
+            return _ENTRIES[keys[best]]
+    _STATS["misses"] += 1
+    return None
+
+
+def store(q_emb, prompt_ver: str, kb_version: int, scope: tuple, question: str, answer: str) -> None:
+    """RU: Кладёт ответ в кэш; сверх ANSWER_CACHE_MAX вытесняются давно не использованные."""
+    global _NEXT_ID
+    if not config.ANSWER_CACHE_ENABLED or q_emb is None or not answer:
+        return
+    _ENTRIES[_NEXT_ID] = CachedAnswer(_normalize(q_emb), prompt_ver, kb_version, scope, question, answer, time.time())
+    _NEXT_ID += 1
+    _STATS["stores"] += 1
+    while len(_ENTRIES) > config.ANSWER_CACHE_MAX:
+        _ENTRIES.popitem(last=False)
+        _STATS["evicted"] += 1
+
+
+def flush() -> int:
+    """RU: Очищает кэш, возвращает число удалённых записей."""
+    n = len(_ENTRIES)
+    _ENTRIES.clear()
+    return n
+
+
+def stats() -> dict:
+    """RU: Размер кэша и счётчики попаданий/промахов/вытеснений."""
+    total = _STATS["hits"] + _STATS["misses"]
+    return {"size": len(_ENTRIES), **_STATS, "hit_rate": _STATS["hits"] / total if total else 0.0}
+
+
+def recent(n: int = 5) -> list[CachedAnswer]:
+    """RU: Последние использованные записи (для команды администратора)."""
+    return list(_ENTRIES.values())[-n:][::-1]
@@ -0,0 +1,83 @@
+# bench_html.py
+# RU: Ручной бенчмарк санитайзера HTML (не входит в работу бота).
+#   python bench_html.py [--sizes 4000,40000,400000] [--repeat 20] [--chunk 24]
+import argparse
+import html
+import random
+import time
+
+import html_edit
+
+_WORDS = "проходка мостики сервер игрок сезон звёзды магазин карта хаб выживание промокод скидка".split()
+
+
+def _answer(size: int, seed: int = 0) -> str:
+    """RU: Синтетический ответ модели: текст с тегами, ссылками, сущностями и мусором."""
+    rng = random.Random(seed)
+    parts: list[str] = []
+    total = 0
+    while total < size:
+        kind = rng.random()
+        words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 12)))
+        if kind < 0.25:
+            piece = f"<b>{words}</b> "
+        elif kind < 0.4:
+            piece = f"<i>{words}</i> &amp; "
+        elif kind < 0.5:
+            piece = f'<a href="https://майнбридж.рф/shop?x=1&amp;y=2">{words}</a> '
+        elif kind < 0.55:
+            piece = f"<code>/hub {words}</code>\n"
+        elif kind < 0.6:
+            piece = f"<span class='x'>{words}</span> <tg-spoiler>{words}</tg-spoiler> <br> "
+        elif kind < 0.65:
+            piece = f"{words} 5 < 6 &copy; "
+        else:
+            piece = f"{words}.\n"
+        parts.append(piece)
+        total += len(piece)
+    return "".join(parts)
+
+
+def _legacy_remove(text: str) -> str:
+    """RU: Прежняя реализация html_edit.remove: unescape + HTMLParser (эталон для сравнения)."""
+    parser = html_edit.WhitelistHTMLSanitizer()
+    parser.feed(html.unescape(text))
+    return parser.get_html().strip()
+
+
+def _streamed(text: str, chunk: int) -> str:
+    """RU: Новый санитайзер в потоковом режиме: куски по chunk символов."""
+    s = html_edit.TelegramHTMLSanitizer()
+    out = [s.feed(text[i:i + chunk]) for i in range(0, len(text), chunk)]
+    out.append(s.flush())
+    return "".join(out).strip()
+
+
+def _best(fn, repeat: int) -> float:
+    """RU: Лучшее время из repeat запусков, мс."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1e3
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="HTML sanitizer benchmark")
+    ap.add_argument("--sizes", default="4000,40000,400000")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--chunk", type=int, default=24, help="символов на кусок в потоковом режиме (~токен-чанк модели)")
+    args = ap.parse_args()
+    print(f"{'chars':>8}{'legacy ms':>11}{'remove ms':>11}{'speedup':>9}{'stream ms':>11}{'same':>6}")
+    for size in (int(x) for x in args.sizes.split(",")):
+        text = _answer(size)
+        legacy = _best(lambda: _legacy_remove(text), args.repeat)
+        new = _best(lambda: html_edit.remove(text), args.repeat)
+        stream = _best(lambda: _streamed(text, args.chunk), args.repeat)
+        same = _streamed(text, args.chunk) == html_edit.remove(text)
+        print(f"{len(text):>8}{legacy:>11.2f}{new:>11.2f}{legacy / new:>9.2f}{stream:>11.2f}{str(same):>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# bench_rag.py
+# RU: Ручные бенчмарки RAG-индекса (не входят в работу бота).
+#   python bench_rag.py store [--n 100000] [--dim 1024] [--k 6]
+#   python bench_rag.py ann [--sizes 1000,100000,1000000] [--dim 256] [--nprobe 4,8,16]
+#   python bench_rag.py chunk [--kb kb] [--jina]   (--jina: настоящие эмбеддинги, нужен JINA_API_KEY)
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import ann
+import bm25
+import chunker
+import vecstore
+from vecstore import VecStore
+
+
+def _rss_mb() -> float:
+    """RU: Текущий RSS процесса в МБ (Linux, /proc)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except Exception:
+        return float("nan")
+
+
+def _synthetic(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """RU: Нормированные случайные векторы с кластерной структурой (ближе к реальным эмбеддингам)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 200), dim)).astype("float32")
+    V = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.standard_normal((n, dim)).astype("float32")
+    V /= np.linalg.norm(V, axis=1, keepdims=True)
+    return V
+
+
+def _queries(V: np.ndarray, nq: int, seed: int = 1) -> np.ndarray:
+    """RU: Запросы — зашумлённые строки индекса."""
+    rng = np.random.default_rng(seed)
+    Q = V[rng.integers(0, len(V), nq)] + 0.3 * rng.standard_normal((nq, V.shape[1])).astype("float32")
+    return Q / np.linalg.norm(Q, axis=1, keepdims=True)
+
+
+def _topk(S: np.ndarray, k: int) -> np.ndarray:
+    return ann.topk(S, k)[0]
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def _child_load(fmt: str, directory: str, qpath: str, k: int) -> None:
+    """RU: Выполняется в отдельном процессе: загрузка индекса, поиск, замер RSS."""
+    d = Path(directory)
+    Q = np.load(qpath)
+    rss0 = _rss_mb()
+    t0 = time.perf_counter()
+    if fmt == "float32-npy":
+        V = np.load(d / "vecs.npy")
+        load_s = time.perf_counter() - t0
+        t1 = time.perf_counter()
+        S = Q @ V.T
+    else:
+        store = VecStore.load(d / fmt, mmap=True)
+        load_s = time.perf_counter() - t0
+        t1 = time.perf_counter()
+        S = store.scores(Q)
+    search_s = time.perf_counter() - t1
+    found = _topk(S, k)
+    print(json.dumps({
+        "load_ms": load_s * 1e3,
+        "search_ms_per_q": search_s * 1e3 / len(Q),
+        "rss_mb": _rss_mb() - rss0,
+        "found": found.tolist(),
+    }))
+
+
+def bench_store(args) -> None:
+    """RU: Сравнивает float32 vecs.npy с float16/int8 mmap: загрузка, RSS, recall@k."""
+    V = _synthetic(args.n, args.dim)
+    Q = _queries(V, args.queries)
+    truth = _topk(Q @ V.T, args.k)
+    with tempfile.TemporaryDirectory() as tmp:
+        d = Path(tmp)
+        np.save(d / "vecs.npy", V)
+        np.save(d / "queries.npy", Q)
+        for dt in ("float16", "int8"):
+            (d / dt).mkdir()
+            VecStore.from_float32(V, dt).save(d / dt)
+        del V
+        print(f"n={args.n} dim={args.dim} k={args.k} queries={args.queries}")
+        print(f"{'format':<14}{'disk MB':>9}{'load ms':>10}{'RSS MB':>9}{'ms/query':>10}{'recall@k':>10}")
+        for fmt in ("float32-npy", "float16", "int8"):
+            if fmt == "float32-npy":
+                disk = (d / "vecs.npy").stat().st_size
+            else:
+                disk = sum((d / fmt / n).stat().st_size for n in (vecstore.CODES_FILE, vecstore.SCALES_FILE))
+            out = subprocess.run(
+                [sys.executable, __file__, "_child", fmt, str(d), str(d / "queries.npy"), str(args.k)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            r = json.loads(out)
+            rec = _recall(np.array(r["found"]), truth)
+            print(f"{fmt:<14}{disk / 1e6:>9.1f}{r['load_ms']:>10.2f}{r['rss_mb']:>9.1f}{r['search_ms_per_q']:>10.2f}{rec:>10.4f}")
+
+
+def bench_ann(args) -> None:
+    """RU: QPS и recall@k для brute force и IVF при разных размерах индекса."""
+    print(f"dim={args.dim} k={args.k} queries={args.queries} dtype={args.dtype}")
+    print(f"{'n':>9} {'backend':<16}{'build s':>9}{'QPS':>10}{'recall@k':>10}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        store = VecStore.from_float32(_synthetic(n, args.dim), args.dtype)
+        Q = _queries(store.rows(slice(None)), args.queries)
+        brute = ann.BruteForceIndex(store)
+        t0 = time.perf_counter()
+        truth, _ = brute.search(Q, args.k)
+        qps = len(Q) / (time.perf_counter() - t0)
+        print(f"{n:>9} {'brute':<16}{0.0:>9.2f}{qps:>10.1f}{1.0:>10.4f}")
+        t0 = time.perf_counter()
+        ivf = ann.IVFIndex(store, nlist=args.nlist)
+        build_s = time.perf_counter() - t0
+        for nprobe in (int(x) for x in args.nprobe.split(",")):
+            t0 = time.perf_counter()
+            found, _ = ivf.search(Q, args.k, nprobe=nprobe)
+            qps = len(Q) / (time.perf_counter() - t0)
+            label = f"ivf/{ivf.nlist}/p{nprobe}"
+            print(f"{n:>9} {label:<16}{build_s:>9.2f}{qps:>10.1f}{_recall(found, truth):>10.4f}")
+
+
+# RU: Контрольные вопросы -> файл базы знаний, где лежит ответ
+EVAL_QUERIES = [
+    ("как купить проходку", "buy_pass"),
+    ("сколько стоит проходка на месяц", "buy_pass"),
+    ("как пополнить мостики", "buy_mostiki"),
+    ("мостики не пришли после оплаты", "buy_mostiki"),
+    ("где ввести промокод", "discounts"),
+    ("как получить проходку бесплатно", "discounts"),
+    ("как поменять ник", "change"),
+    ("как зарегистрироваться на сайте", "howto_register"),
+    ("какие команды есть на сервере", "commands"),
+    ("как попасть в хаб", "commands"),
+    ("ссылка на карту сервера", "links"),
+    ("где почитать правила", "links"),
+    ("чем сервер отличается от других", "differences"),
+    ("что купить кроме проходки", "store_customization"),
+    ("можно заказать 3д модель", "art_3d"),
+    ("кто тебя создал", "creator"),
+    ("чем заняться на сервере", "activities_and_guides"),
+    ("какие режимы есть", "minecraft"),
+    ("сколько рублей стоит один мостик", "mostiki"),
+    ("какие стикеры можно кидать", "stickers"),
+]
+
+
+def _jina_embed(texts: list[str]) -> np.ndarray:
+    """RU: Эмбеддинги через Jina (синхронно, только для бенчмарка)."""
+    import httpx
+    out = []
+    for i in range(0, len(texts), 64):
+        r = httpx.post(
+            "https://api.jina.ai/v1/embeddings",
+            headers={"Authorization": f"Bearer {os.environ['JINA_API_KEY']}"},
+            json={"model": "jina-embeddings-v3", "input": texts[i:i + 64]},
+            timeout=60,
+        )
+        r.raise_for_status()
+        out.extend(item["embedding"] for item in r.json()["data"])
+    V = np.array(out, dtype="float32")
+    return V / np.linalg.norm(V, axis=1, keepdims=True)
+
+
+def bench_chunk(args) -> None:
+    """RU: Сравнивает фиксированную нарезку и markdown-чанкер: объём индекса и качество поиска."""
+    files = sorted(p for p in Path(args.kb).rglob("*") if p.suffix.lower() in {".md", ".txt"})
+    sources = {p.stem: p.read_text(encoding="utf-8").replace("\r\n", "\n") for p in files}
+    src_chars = sum(len(t.strip()) for t in sources.values())
+    splitters = {
+        "fixed 900/150": lambda t: chunker.split_fixed(t, 900, 150),
+        f"markdown {args.tokens}/{args.overlap}": lambda t: chunker.split_markdown(t, args.tokens, args.overlap),
+    }
+    q_vecs = _jina_embed([q for q, _ in EVAL_QUERIES]) if args.jina else None
+    print(f"kb: {len(files)} files, {src_chars} chars; eval: {len(EVAL_QUERIES)} queries, k={args.k}")
+    print(f"{'splitter':<18}{'chunks':>7}{'chars':>8}{'extra %':>9}{'tokens':>8}{'retriever':>10}{'hit@1':>7}{'hit@k':>7}{'MRR':>7}")
+    for name, split in splitters.items():
+        chunks = [(stem, c) for stem, t in sources.items() for c in split(t)]
+        chars = sum(len(c) for _, c in chunks)
+        tokens = sum(chunker.approx_tokens(c) for _, c in chunks)
+        retrievers = {"bm25": bm25.BM25Index([c for _, c in chunks])}
+        if q_vecs is not None:
+            retrievers["jina"] = _jina_embed([c for _, c in chunks])
+        for rname, r in retrievers.items():
+            h1 = hk = mrr = 0.0
+            for qi, (q, want) in enumerate(EVAL_QUERIES):
+                if rname == "bm25":
+                    ranked = [i for i, _ in r.search(q, len(chunks))]
+                else:
+                    ranked = list(np.argsort(-(r @ q_vecs[qi])))
+                stems = list(dict.fromkeys(chunks[i][0] for i in ranked))
+                if want in stems:
+                    rank = stems.index(want) + 1
+                    h1 += rank == 1
+                    hk += rank <= args.k
+                    mrr += 1.0 / rank
+            n = len(EVAL_QUERIES)
+            print(f"{name:<18}{len(chunks):>7}{chars:>8}{100 * (chars / src_chars - 1):>9.1f}{tokens:>8}"
+                  f"{rname:>10}{h1 / n:>7.2f}{hk / n:>7.2f}{mrr / n:>7.3f}")
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "_child":
+        _child_load(sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]))
+        return
+    ap = argparse.ArgumentParser(description="RAG benchmarks")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("store", help="float32 vecs.npy vs quantized mmap store")
+    p.add_argument("--n", type=int, default=100_000)
+    p.add_argument("--dim", type=int, default=1024)
+    p.add_argument("--k", type=int, default=6)
+    p.add_argument("--queries", type=int, default=64)
+    p.set_defaults(func=bench_store)
+    p = sub.add_parser("ann", help="brute force vs IVF: queries/sec and recall@k")
+    p.add_argument("--sizes", default="1000,100000,1000000")
+    p.add_argument("--dim", type=int, default=256)
+    p.add_argument("--k", type=int, default=6)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--nlist", type=int, default=0)
+    p.add_argument("--nprobe", default="4,8,16,32")
+    p.add_argument("--dtype", default="int8", choices=vecstore.VEC_DTYPES)
+    p.set_defaults(func=bench_ann)
+    p = sub.add_parser("chunk", help="fixed-size vs markdown chunker: index size and retrieval quality")
+    p.add_argument("--kb", default=str(Path(__file__).resolve().parent / "kb"))
+    p.add_argument("--tokens", type=int, default=300)
+    p.add_argument("--overlap", type=int, default=40)
+    p.add_argument("--k", type=int, default=3)
+    p.add_argument("--jina", action="store_true")
+    p.set_defaults(func=bench_chunk)
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# bm25.py
+# RU: Лексический поиск BM25 по чанкам базы знаний (русская токенизация и лёгкий стемминг).
+import math
+import re
+from collections import defaultdict
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+
+# RU: Частые слова без смысловой нагрузки для поиска
+STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне
+было вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до
+вас нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя
+их чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого
+какой совсем ним здесь этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда
+можно при наконец два об другой хоть после над больше тот через эти нас про всего них какая много
+разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более
+всегда конечно всю между это как the a an of to and or is in on for
+""".split())
+
+# RU: Окончания русских слов, от длинных к коротким; отрезается одно, стем не короче 3 букв
+_ENDINGS = sorted("""
+иями ями ами ией иям ием ого его ому ему ыми ими ешь ишь ить ать ять еть уть ость ости
+ая яя ое ее ые ие ый ий ой ей ую юю ом ем ам ям ах ях ов ев ть ет ют ут ит ат ят им ал ил ла ли ло
+а я о е ы и у ю ь й
+""".split(), key=len, reverse=True)
+
+
+def stem(word: str) -> str:
+    """RU: Лёгкий стемминг: отрезает самое длинное подходящее окончание."""
+    for end in _ENDINGS:
+        if word.endswith(end) and len(word) - len(end) >= 3:
+            return word[: -len(end)]
+    return word
+
+
+def fold(text: str) -> str:
+    """RU: Нижний регистр и ё→е — общее приведение текста для поиска, FAQ и правил."""
+    return (text or "").lower().replace("ё", "е")
+
+
+def tokenize(text: str) -> list[str]:
+    """RU: Токены для BM25: нижний регистр, ё→е, без стоп-слов, со стеммингом."""
+    return [stem(t) for t in _TOKEN_RE.findall(fold(text)) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """RU: Инвертированный индекс BM25; веса постингов считаются при построении."""
+
+    def __init__(self, texts, k1: float = 1.5, b: float = 0.75):
+        self.n = 0
+        postings: dict[str, dict[int, int]] = defaultdict(dict)
+        lengths: list[int] = []
+        for i, text in enumerate(texts):
+            toks = tokenize(text)
+            lengths.append(len(toks))
+            for t in toks:
+                postings[t][i] = postings[t].get(i, 0) + 1
+        self.n = len(lengths)
+        dl = np.array(lengths, dtype="float32")
+        avgdl = float(dl.mean()) if self.n else 1.0
+        norm = k1 * (1.0 - b + b * dl / max(avgdl, 1e-9))
+        self._post: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        for t, docs in postings.items():
+            ids = np.fromiter(docs.keys(), dtype="int64", count=len(docs))
+            tf = np.fromiter(docs.values(), dtype="float32", count=len(docs))
+            idf = math.log(1.0 + (self.n - len(docs) + 0.5) / (len(docs) + 0.5))
+            self._post[t] = (ids, (idf * tf * (k1 + 1.0) / (tf + norm[ids])).astype("float32"))
+
+    def __len__(self) -> int:
+        return self.n
+
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        """RU: Top-k документов по BM25: [(номер чанка, вес)], только с ненулевым весом."""
+        scores = np.zeros(self.n, dtype="float32")
+        hit = False
+        for t in set(tokenize(query)):
+            row = self._post.get(t)
+            if row is not None:
+                scores[row[0]] += row[1]
+                hit = True
+        if not hit or k <= 0:
+            return []
+        k = min(k, self.n)
+        idx = np.argpartition(-scores, k - 1)[:k] if k < self.n else np.arange(self.n)
+        idx = idx[np.argsort(-scores[idx])]
+        return [(int(i), float(scores[i])) for i in idx if scores[i] > 0]
+
+
+def rrf(rankings: list[list[int]], k: int, c: int = 60) -> list[tuple[int, float]]:
+    """RU: Reciprocal-rank fusion нескольких ранжированных списков номеров чанков."""
+    fused: dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, i in enumerate(ranking):
+            fused[i] += 1.0 / (c + rank + 1)
+    return sorted(fused.items(), key=lambda x: -x[1])[:k]
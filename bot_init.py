@@ -11,7 +11,12 @@ logging.basicConfig(level=logging.INFO)
 
 bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
-openai_client = AsyncOpenAI(api_key=config.OPENAI_API_KEY, base_url="https://openrouter.ai/api/v1")
+openai_client = AsyncOpenAI(
+    api_key=config.OPENAI_API_KEY,
+    base_url="https://openrouter.ai/api/v1",
+    timeout=config.OPENROUTER_TIMEOUT,
+    max_retries=0,  # RU: повторы и предохранитель — в resilience.call("openrouter", ...)
+)
 
 # RU: username будет установлен при запуске (on_startup)
 bot_username: str = "minebridge52bot"
@@ -0,0 +1,144 @@
+# chunker.py
+# RU: Нарезка текстов базы знаний на чанки для RAG-индекса.
+import re
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_LIST_ITEM_RE = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+_FRONT_MATTER_RE = re.compile(r"\A---[ \t]*\n(.*?)\n---[ \t]*(?:\n|\Z)", re.S)
+_FM_ITEM_RE = re.compile(r"^\s*-\s+(.*)$")
+
+
+def approx_tokens(text: str) -> int:
+    """RU: Грубая оценка числа токенов (~3 символа на токен для русского текста)."""
+    return (len(text or "") + 2) // 3
+
+
+def split_front_matter(text: str) -> tuple[dict, str]:
+    """RU: Отделяет front-matter (--- ... ---) в начале файла базы знаний.
+
+    Поддерживаются строки "ключ: значение" и списки "ключ:" + "- элемент".
+    Возвращает (метаданные, текст без front-matter).
+    """
+    m = _FRONT_MATTER_RE.match(text or "")
+    if not m:
+        return {}, text
+    meta: dict = {}
+    key = None
+    for line in m.group(1).split("\n"):
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        item = _FM_ITEM_RE.match(line)
+        if item and key is not None and isinstance(meta.get(key), list):
+            meta[key].append(item.group(1).strip().strip("\"'"))
+        elif ":" in line:
+            key, _, value = line.partition(":")
+            key, value = key.strip(), value.strip().strip("\"'")
+            meta[key] = value if value else []
+    return meta, text[m.end():]
+
+
+def split_fixed(text: str, size: int, ov: int) -> list[str]:
+    """RU: Делит исходный текст на перекрывающиеся фрагменты фиксированной длины."""
+    text = text.strip()
+    if not text:
+        return []
+    out, i = [], 0
+    while i < len(text):
+        out.append(text[i:i+size])
+        i += max(1, size - ov)
+    return [c for c in out if c.strip()]
+
+
+def _parse_blocks(text: str) -> list[tuple[tuple[str, ...], str]]:
+    """RU: Разбирает markdown на блоки (путь заголовков, текст): абзацы и пункты списков."""
+    blocks: list[tuple[tuple[str, ...], str]] = []
+    path: tuple[str, ...] = ()
+    cur: list[str] = []
+
+    def close():
+        if cur:
+            body = "\n".join(cur).strip()
+            if body:
+                blocks.append((path, body))
+            cur.clear()
+
+    for line in text.split("\n"):
+        m = _HEADING_RE.match(line)
+        if m:
+            close()
+            level = len(m.group(1))
+            path = path[:level - 1] + (m.group(2),)
+            continue
+        if not line.strip():
+            close()
+            continue
+        if _LIST_ITEM_RE.match(line):
+            close()
+        cur.append(line.rstrip())
+    close()
+    return blocks
+
+
+def _split_long(body: str, max_tokens: int) -> list[str]:
+    """RU: Режет блок, не влезающий в бюджет, по предложениям, а затем по словам."""
+    pieces: list[str] = []
+    cur = ""
+    for sent in _SENTENCE_RE.split(body):
+        for word in (sent.split(" ") if approx_tokens(sent) > max_tokens else [sent]):
+            cand = f"{cur} {word}" if cur else word
+            if cur and approx_tokens(cand) > max_tokens:
+                pieces.append(cur)
+                cand = word
+            cur = cand
+    if cur:
+        pieces.append(cur)
+    return pieces
+
+
+def _render(blocks: list[tuple[tuple[str, ...], str]]) -> str:
+    """RU: Собирает чанк, вставляя путь заголовков перед каждой сменой раздела."""
+    lines: list[str] = []
+    path = None
+    for p, body in blocks:
+        if p != path and p:
+            lines.append("# " + " > ".join(p))
+        path = p
+        lines.append(body)
+    return "\n".join(lines)
+
+
+def split_markdown(text: str, max_tokens: int = 300, overlap_tokens: int = 40) -> list[str]:
+    """RU: Делит markdown по заголовкам, абзацам и пунктам списков в пределах бюджета токенов.
+
+    Каждый чанк начинается с пути заголовков ("# Раздел > Подраздел"). Соседние
+    небольшие разделы склеиваются; перекрытие (хвостовые блоки до overlap_tokens)
+    добавляется, только если один раздел не уместился в чанк.
+    """
+    blocks: list[tuple[tuple[str, ...], str]] = []
+    for p, body in _parse_blocks(text.strip()):
+        budget = max(1, max_tokens - approx_tokens("# " + " > ".join(p)) - 1)
+        if approx_tokens(body) > budget:
+            blocks.extend((p, piece) for piece in _split_long(body, budget))
+        else:
+            blocks.append((p, body))
+
+    chunks: list[str] = []
+    cur: list[tuple[tuple[str, ...], str]] = []
+    for block in blocks:
+        if cur and approx_tokens(_render(cur + [block])) > max_tokens:
+            chunks.append(_render(cur))
+            tail: list[tuple[tuple[str, ...], str]] = []
+            if cur[-1][0] == block[0]:
+                # RU: Раздел продолжается в следующем чанке — переносим хвост для связности
+                for prev in reversed(cur):
+                    if prev[0] != block[0] or approx_tokens(_render([prev] + tail)) > overlap_tokens:
+                        break
+                    tail.insert(0, prev)
+                if approx_tokens(_render(tail + [block])) > max_tokens:
+                    tail = []
+            cur = tail
+        cur.append(block)
+    if cur:
+        chunks.append(_render(cur))
+    return [c for c in chunks if c.strip()]
@@ -0,0 +1,81 @@
+# coalesce.py
+# RU: Склейка всплесков обращений к боту в группе: пока по чату идёт ответ модели,
+# новые обращения копятся в одну пачку, и на всю пачку делается один запрос.
+import asyncio
+import contextlib
+import logging
+
+from aiogram import types
+
+import config
+import utils
+
+_OPEN: dict[int, "Batch"] = {}
+_RUNNING: dict[int, "Batch"] = {}
+_STATS = {"triggers": 0, "batches": 0, "merged": 0}
+
+
+class Batch:
+    """RU: Пачка обращений одного чата; отвечает на неё обработчик первого (лидер)."""
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.items: list[tuple[types.Message, str]] = []
+        self.done = asyncio.Event()
+
+    def prompt(self) -> str:
+        """RU: Запрос к модели: текст единственного обращения или все обращения пачки с авторами.
+
+        Каждое обращение обрезается отдельно (utils._shorten), пачка целиком — нет.
+        """
+        if len(self.items) == 1:
+            return self.items[0][1]
+        lines = ["Несколько игроков обратились к тебе почти одновременно. Ответь всем одним сообщением, "
+                 "обращаясь к каждому по имени:"]
+        for message, text in self.items:
+            lines.append(f"{utils._author_from(message)}: {utils._shorten(text)}")
+        return "\n".join(lines)
+
+    def finish(self) -> None:
+        """RU: Ответ на пачку готов (или не удался) — следующая пачка чата может стартовать."""
+        self.done.set()
+        if _RUNNING.get(self.chat_id) is self:
+            del _RUNNING[self.chat_id]
+
+
+async def join(message: types.Message, prompt: str) -> tuple[Batch, bool]:
+    """RU: Добавляет обращение в пачку чата; возвращает (пачка, лидер ли этот обработчик).
+
+    Лидер получает пачку, когда должен ответить (после COALESCE_WINDOW, а пока по
+    чату идёт ответ — после его завершения, но не дольше COALESCE_MAX_WAIT).
+    Остальные возвращаются сразу: их обращение войдёт в ответ лидера, а дождаться
+    его можно по batch.done.
+    """
+    chat_id = message.chat.id
+    _STATS["triggers"] += 1
+    batch = _OPEN.get(chat_id)
+    if batch is not None and len(batch.items) < config.COALESCE_MAX_BATCH:
+        batch.items.append((message, prompt))
+        _STATS["merged"] += 1
+        logging.info("Coalesce: chat %s, trigger merged into batch of %d", chat_id, len(batch.items))
+        return batch, False
+    batch = _OPEN[chat_id] = Batch(chat_id)
+    batch.items.append((message, prompt))
+    running = _RUNNING.get(chat_id)
+    try:
+        if running is not None:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(running.done.wait(), config.COALESCE_MAX_WAIT)
+        elif config.COALESCE_WINDOW > 0:
+            await asyncio.sleep(config.COALESCE_WINDOW)
+    finally:
+        if _OPEN.get(chat_id) is batch:
+            del _OPEN[chat_id]
+    _RUNNING[chat_id] = batch
+    _STATS["batches"] += 1
+    return batch, True
+
+
+def stats() -> dict:
+    """RU: Обращений всего, запросов к модели по ним и сколько обращений склеено."""
+    return dict(_STATS)
@@ -15,6 +15,9 @@ PIXABAY_API_KEY = os.getenv("PIXABAY_API_KEY")
 CHANNEL = os.getenv("CHANNEL", "@MineBridgeOfficial")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# RU: Администраторы бота — Telegram user id через запятую (служебные команды)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x.isdigit()}
+
 # Память
 GROUP_MAX_MESSAGES = 12
 DM_MAX_MESSAGES = 5
@@ -29,11 +32,140 @@ KB_DIR = Path(__file__).resolve().parent / "kb"          # положите сю
 RAG_INDEX_DIR = Path(__file__).resolve().parent / ".rag_cache"
 PROMPTS_DIR = Path(__file__).resolve().parent / "prompts"
 RAG_ENABLED = True
-RAG_CHUNK_SIZE = 900
+RAG_CHUNKER = "markdown"         # markdown | fixed — способ нарезки kb/ на чанки
+RAG_CHUNK_TOKENS = 300           # бюджет токенов на чанк (markdown)
+RAG_CHUNK_OVERLAP_TOKENS = 40    # перекрытие внутри раздела, разрезанного на несколько чанков
+RAG_CHUNK_SIZE = 900             # символов на чанк (fixed)
 RAG_CHUNK_OVERLAP = 150
 RAG_TOP_K = 6
 RAG_EMB_MODEL = "jina-embeddings-v3"
 RAG_EMB_BATCH = 64
+RAG_EMB_CONCURRENCY = 4          # параллельных пакетов эмбеддингов при сборке индекса
+RAG_EMB_RETRIES = 5
+RAG_EMB_BACKOFF = 1.0            # сек, база экспоненциальной паузы между повторами
+RAG_EMB_BACKOFF_MAX = 30.0
+RAG_VEC_DTYPE = "int8"           # float32 | float16 | int8 — формат векторов индекса на диске
+RAG_ANN_BACKEND = "auto"         # brute | ivf | auto — бэкенд поиска (auto: IVF от RAG_ANN_MIN_CHUNKS)
+RAG_ANN_MIN_CHUNKS = 100000      # bench_rag.py ann (dim 1024, int8, nprobe 16): 20k — IVF 935 QPS против
+                                 # brute 1316 (медленнее, recall 0.96); 100k — 601 против 310 (x1.9, recall 0.977)
+RAG_IVF_NLIST = 0                # число кластеров IVF (0 — ~4*sqrt(N))
+RAG_IVF_NPROBE = 16              # сколько кластеров просматривать: больше — точнее, но медленнее (p8 — recall ~0.94)
+RAG_HYBRID = True                # BM25 + векторы (RRF); BM25 же — запасной путь без эмбеддингов
+RAG_HYBRID_DEPTH = 4             # глубина кандидатов каждого ранжирования: k * depth
+RAG_RRF_K = 60
+RAG_EMB_DEADLINE = 1.5           # сек на эмбеддинг запроса, дальше — только BM25
+RAG_MMR_FETCH = 3                # кандидатов для MMR: k * fetch
+RAG_MMR_LAMBDA = 0.7             # баланс MMR: 1 — только релевантность, 0 — только разнообразие
+RAG_CONTEXT_TOKENS_DM = 900      # бюджет токенов фрагментов базы знаний в личке
+RAG_CONTEXT_TOKENS_GROUP = 500   # ... и в группах (короче ответы, дешевле запросы)
+RAG_CONTEXT_BUDGET = 2.0         # сек, общий бюджет на сборку контекста перед вызовом модели
+RAG_SOURCE_DEADLINES = {         # сек от начала сборки для каждого источника (не больше бюджета)
+    "status": 1.0,               # mcsrvstat
+    "player": 1.0,               # MineBridge API
+    "kb": 2.0,                   # поиск по базе знаний (эмбеддинг запроса ждём RAG_EMB_DEADLINE)
+}
+RAG_INTENT_GATING = True         # статус/игрок — только для вопросов о них (правила intent.RULES)
+RAG_INTENT_EMBED = True          # если правила молчат — сравнить эмбеддинг запроса с intent.PROTOTYPES
+RAG_INTENT_SIM = 0.6             # порог косинуса для срабатывания по эмбеддингу
+RAG_QUERY_BATCH_WINDOW = 0.02    # сек, окно склейки поисковых эмбеддингов
+RAG_QUERY_CACHE_MAX_BYTES = 32 * 1024 * 1024  # лимит памяти LRU-кэша эмбеддингов запросов
+RAG_WATCH_INTERVAL = 5.0         # сек, период опроса kb/ без watchfiles
+RAG_WATCH_DEBOUNCE_MS = 1500     # мс, склейка событий watchfiles
+
+# RU: Семантический кэш ответов (answer_cache.py)
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_SIM = 0.95          # порог косинуса: выше — вопрос считается тем же самым
+ANSWER_CACHE_TTL = 6 * 3600      # сек жизни ответа
+ANSWER_CACHE_MAX = 512           # записей, сверх — вытеснение LRU
+
+# RU: Быстрые ответы на частые вопросы (faq.py, вопросы — во front-matter файлов kb/)
+FAQ_ENABLED = True
+FAQ_FUZZY_CUTOFF = 0.85          # порог difflib для опечатки в длинной основе слова (от 5 букв)
+FAQ_MAX_WORDS = 8                # нечётко сравниваем только короткие вопросы
+FAQ_ADDRESS_WORDS = ("бриджик", "бриджика", "бриджику", "бриджиком")  # обращения к боту, не часть вопроса
+
+# RU: Потоковый вывод ответа модели (правка заглушки по мере генерации)
+STREAM_REPLIES = True
+STREAM_EDIT_INTERVAL = 1.0       # сек между правками сообщения в личке
+STREAM_EDIT_INTERVAL_GROUP = 3.0 # ... и в группах (лимит Telegram ~20 сообщений в минуту на чат)
+
+# RU: Общие пулы HTTP-соединений по апстримам (http_pool.py); "default" — значения для всех
+HTTP_UPSTREAMS = {
+    "default": {
+        "timeout": 10.0,         # сек на чтение/запись/ожидание соединения из пула
+        "connect": 5.0,          # сек на установку соединения
+        "max_connections": 10,   # одновременных соединений к апстриму
+        "keepalive": 5,          # простаивающих соединений держим открытыми
+        "keepalive_expiry": 30.0,  # сек жизни простаивающего соединения
+        "http2": True,           # только если установлен пакет h2
+        "follow_redirects": False,
+    },
+    "jina": {"timeout": 60.0, "connect": 10.0},  # эмбеддинги (батчи при переиндексации)
+    "mcsrvstat": {},
+    "minebridge": {},
+    "telegram": {"timeout": 30.0, "connect": 10.0},  # скачивание файлов (голосовые, фото)
+    "pixabay": {"timeout": 15.0, "connect": 10.0},
+    "images": {"timeout": 15.0, "connect": 10.0, "max_connections": 4, "follow_redirects": True},
+}
+HTTP_LATENCY_WINDOW = 256        # последних запросов на апстрим для p50/p95
+
+# RU: Предохранители и повторы по апстримам (resilience.py); "default" — значения для всех
+CIRCUIT_BREAKERS = {
+    "default": {
+        "failures": 5,           # временных ошибок подряд до размыкания
+        "cooldown": 30.0,        # сек отказа без запросов, затем один пробный
+        "retries": 1,            # повторов временной ошибки (сеть, таймаут, 429, 5xx)
+        "backoff": 0.2,          # сек, база экспоненциальной паузы (с полным джиттером)
+        "backoff_max": 2.0,      # сек, потолок паузы; больший Retry-After — без повтора
+    },
+    "openrouter": {"failures": 3},  # свой предохранитель на каждую модель: "openrouter:<модель>"
+    "jina": {},
+    "gemini": {"failures": 3},
+    "mcsrvstat": {"retries": 0, "cooldown": 60.0},  # ждём не дольше RAG_SOURCE_DEADLINES
+    "minebridge": {"retries": 0},
+}
+OPENROUTER_TIMEOUT = 60.0        # сек на запрос к модели (повторы — в resilience, не в SDK)
+
+# RU: Модели OpenRouter (llm_router.py): основная и запасные по порядку (все — с поддержкой картинок)
+LLM_MODEL = "x-ai/grok-4-fast"
+LLM_FALLBACK_MODELS = ("google/gemini-2.5-flash", "openai/gpt-4.1-mini")
+LLM_HEDGE = True                 # дублировать запрос к следующей модели, если текущая медлит
+LLM_HEDGE_QUANTILE = 0.95        # порог ожидания — этот перцентиль задержек модели (поток: до первого текста)
+LLM_HEDGE_MIN_SAMPLES = 20       # замеров, после которых порог считается по перцентилю
+LLM_HEDGE_DEFAULT = 4.0          # сек, порог, пока замеров мало
+LLM_HEDGE_MIN_DELAY = 1.0        # сек, порог не ниже (чтобы не удваивать обычные запросы)
+LLM_MAX_PARALLEL = 2             # одновременных попыток на один ответ
+
+# RU: Планировщик запросов к модели (llm_scheduler.py)
+LLM_MAX_CONCURRENT = 4           # одновременных ответов модели на весь бот
+LLM_QUEUE_MAX = 40               # ожидающих в очереди всего, сверх — «занято»
+LLM_QUEUE_PER_CHAT = 3           # ожидающих от одного чата
+LLM_QUEUE_WAIT_DM = 30.0         # сек ожидания слота для лички
+LLM_QUEUE_WAIT_GROUP = 15.0      # ... и для группы (лички обслуживаются первыми)
+LLM_QUEUE_WAIT_WINDOW = 256      # последних ожиданий слота (по классу dm/group) для p50/p95
+LLM_BUSY_TEXT = "😵‍💫 Сейчас слишком много вопросов — спроси ещё раз через минутку"
+
+# RU: Склейка всплесков обращений в группах (coalesce.py)
+COALESCE_ENABLED = True
+COALESCE_WINDOW = 0.0            # сек ожидания попутчиков для первого обращения (0 — отвечаем сразу)
+COALESCE_MAX_WAIT = 30.0         # сек, дольше не ждём завершения предыдущего ответа в чате
+COALESCE_MAX_BATCH = 5           # обращений в одной пачке
+
+# RU: Лимиты частоты обращений к ИИ (ratelimit.py, token bucket)
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_USER_BURST = 5        # жетонов в ведре пользователя (подряд без паузы)
+RATE_LIMIT_USER_RATE = 6 / 60    # жетонов в секунду (6 вопросов в минуту)
+RATE_LIMIT_CHAT_BURST = 20       # жетонов в ведре чата
+RATE_LIMIT_CHAT_RATE = 30 / 60   # ... и пополнение (30 в минуту на чат)
+RATE_LIMIT_IMAGE_COST = 3        # жетонов за картинку (vision дороже текста)
+RATE_LIMIT_VOICE_COST = 2        # жетонов за голосовое (распознавание + ответ)
+RATE_LIMIT_IDLE_TTL = 600        # сек простоя, после которых ведро удаляется (оно уже полное)
+RATE_LIMIT_TEXT = "🐢 Не так быстро! Попробуй ещё раз через {seconds} с"
+
+# RU: Кэш проверки подписки на CHANNEL (handlers.is_subscribed); события chat_member обновляют его сразу
+SUB_CACHE_TTL = 6 * 3600         # сек, подписан
+SUB_CACHE_NEG_TTL = 60           # сек, не подписан (мог только что подписаться)
+SUB_CACHE_MAX = 50000            # пользователей в кэше
 
 # RU: Прочие параметры
 MC_CACHE_TTL = 20
@@ -0,0 +1,171 @@
+# faq.py
+# RU: Быстрые ответы на частые вопросы без вызова модели. Вопросы перечисляются
+# во front-matter файла базы знаний (faq: - вопрос ...), ответом служит сам файл,
+# переведённый из markdown в HTML Telegram.
+import asyncio
+import difflib
+import html
+import logging
+import re
+from pathlib import Path
+
+import bm25
+import config
+import chunker
+import rag
+
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.S)
+_HEADING_RE = re.compile(r"^#{1,6}\s+(.*?)\s*#*\s*$")
+_LINK_RE = re.compile(r"\[([^\[\]]+)\]\(([^()\s]+)\)")
+_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+_CODE_RE = re.compile(r"`([^`]+)`")
+_MENTION_RE = re.compile(r"@\w+")
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+
+# RU: Отрицания — в BM25 это стоп-слова, но для FAQ они меняют смысл вопроса
+_NEGATIONS = frozenset({"не", "нет", "ни", "без"})
+
+# RU: нормализованный вопрос -> HTML-ответ; точные формулировки (нижний регистр) -> ответ;
+# смысловые основы вопроса -> ответ (для нечёткого сравнения)
+_ANSWERS: dict[str, str] = {}
+_EXACT: dict[str, str] = {}
+_STEMS: list[tuple[list[str], str]] = []
+_FILES: dict | None = None  # RU: подпись базы из снимка RAG, по которой собран индекс FAQ
+_LOCK = asyncio.Lock()
+_STATS = {"exact": 0, "normalized": 0, "fuzzy": 0, "miss": 0}
+
+
+def normalize(text: str) -> str:
+    """RU: Ключ сравнения: регистр, ё, без пунктуации, упоминаний и обращений к боту."""
+    text = _MENTION_RE.sub(" ", bm25.fold(text))
+    words = _PUNCT_RE.sub(" ", text).split()
+    return " ".join(w for w in words if w not in config.FAQ_ADDRESS_WORDS)
+
+
+def content_stems(text: str) -> list[str]:
+    """RU: Основы значимых слов вопроса (bm25.stem), без стоп-слов, но с отрицаниями."""
+    return [bm25.stem(w) for w in normalize(text).split() if w in _NEGATIONS or w not in bm25.STOPWORDS]
+
+
+def _same_stem(a: str, b: str) -> bool:
+    """RU: Основы совпадают или отличаются опечаткой (только длинные: короткое слово — другое слово)."""
+    if a == b:
+        return True
+    return min(len(a), len(b)) >= 5 and \
+        difflib.SequenceMatcher(None, a, b).ratio() >= config.FAQ_FUZZY_CUTOFF
+
+
+def _stems_match(query: list[str], question: list[str]) -> bool:
+    """RU: Каждой основе запроса соответствует своя основа вопроса и наоборот."""
+    if len(query) != len(question):
+        return False
+    rest = list(question)
+    for q in query:
+        for i, w in enumerate(rest):
+            if _same_stem(q, w):
+                del rest[i]
+                break
+        else:
+            return False
+    return True
+
+
+def md_to_html(text: str) -> str:
+    """RU: Простой markdown базы знаний -> HTML Telegram (заголовки, жирный, код, ссылки).
+
+    HTML-комментарии — пометки для модели, пользователю они не показываются.
+    """
+    text = html.escape(_COMMENT_RE.sub("", text), quote=False)
+    lines = []
+    for line in text.strip().split("\n"):
+        m = _HEADING_RE.match(line)
+        lines.append(f"<b>{m.group(1)}</b>" if m else line.rstrip())
+
+    def link(m: re.Match) -> str:
+        url = m.group(2)
+        if not re.match(r"^[a-z]+://", url):
+            url = "https://" + url
+        return f'<a href="{html.escape(url)}">{m.group(1)}</a>'
+
+    out = "\n".join(lines)
+    out = _CODE_RE.sub(r"<code>\1</code>", out)
+    out = _BOLD_RE.sub(r"<b>\1</b>", out)
+    return _LINK_RE.sub(link, out)
+
+
+def _build(files: list[str]) -> tuple[dict, dict, list]:
+    """RU: Читает вопросы из front-matter файлов базы (блокирующее — вызывать в потоке)."""
+    answers: dict[str, str] = {}
+    exact: dict[str, str] = {}
+    stems: list[tuple[list[str], str]] = []
+    n_files = 0
+    for p in map(Path, files):
+        meta, body = chunker.split_front_matter(rag.read_text_file(p))
+        questions = meta.get("faq") or []
+        if isinstance(questions, str):
+            questions = [questions]
+        if not questions:
+            continue
+        answer = md_to_html(body)
+        n_files += 1
+        for q in questions:
+            exact[q.strip().lower()] = answer
+            key = normalize(q)
+            if key:
+                if key in answers and answers[key] != answer:
+                    logging.warning("FAQ: question %r is listed in several files, using %s", q, p.name)
+                answers[key] = answer
+                stems.append((content_stems(q), answer))
+    logging.info("FAQ: %d questions from %d files", len(answers), n_files)
+    return answers, exact, stems
+
+
+async def _ensure() -> None:
+    """RU: Перестраивает индекс FAQ, когда наблюдатель RAG опубликовал новый снимок базы."""
+    global _ANSWERS, _EXACT, _STEMS, _FILES
+    if rag.RAG_SNAPSHOT.files is _FILES:
+        return
+    async with _LOCK:
+        files = rag.RAG_SNAPSHOT.files
+        if files is _FILES:
+            return
+        _ANSWERS, _EXACT, _STEMS = await asyncio.to_thread(_build, sorted(files))
+        _FILES = files
+
+
+async def match(prompt: str) -> str | None:
+    """RU: Готовый HTML-ответ на вопрос: точное совпадение, нормализованное или нечёткое."""
+    if not config.FAQ_ENABLED or not prompt:
+        return None
+    try:
+        await _ensure()
+    except Exception:
+        logging.exception("FAQ: failed to load questions")
+        return None
+    raw = prompt.strip().lower()
+    if raw in _EXACT:
+        _STATS["exact"] += 1
+        return _EXACT[raw]
+    key = normalize(prompt)
+    if key in _ANSWERS:
+        _STATS["normalized"] += 1
+        return _ANSWERS[key]
+    # RU: Нечёткое сравнение — только для коротких вопросов, длинные уходят в модель.
+    # Сравниваются основы слов: другой порядок, падеж или опечатка в длинном слове
+    # допустимы, а другое или лишнее слово (в т.ч. «не») — уже другой вопрос
+    if key and len(key.split()) <= config.FAQ_MAX_WORDS:
+        query = content_stems(prompt)
+        if query:
+            for question, answer in _STEMS:
+                if _stems_match(query, question):
+                    _STATS["fuzzy"] += 1
+                    return answer
+    _STATS["miss"] += 1
+    return None
+
+
+def stats() -> dict:
+    """RU: Попадания по видам совпадения и доля сообщений, обошедшихся без модели."""
+    hits = _STATS["exact"] + _STATS["normalized"] + _STATS["fuzzy"]
+    total = hits + _STATS["miss"]
+    return {"questions": len(_ANSWERS), **_STATS, "hit_rate": hits / total if total else 0.0}
@@ -3,7 +3,8 @@ import logging
 import asyncio
 import time
 import re
-import httpx
+import html
+from collections import OrderedDict
 
 from aiogram import types
 from aiogram.filters import Command
@@ -14,18 +15,85 @@ import utils
 import mc
 import mb_api
 import rag
+import answer_cache
+import faq
+import coalesce
+import ratelimit
+import http_pool
+import llm_router
+import llm_scheduler
+import resilience
 import handlers_helpers
 import msgs
 
+_SUBSCRIBED_STATUSES = ("creator", "administrator", "member", "restricted")
+
+# RU: Кэш подписки: user_id -> (время проверки, подписан); в начале — самые давние записи
+_SUB_CACHE: "OrderedDict[int, tuple[float, bool]]" = OrderedDict()
+_SUB_STATS = {"hits": 0, "misses": 0, "updates": 0}
+
+
+def _sub_cache_set(id: int, subscribed: bool) -> None:
+    """RU: Запоминает статус подписки; сверх SUB_CACHE_MAX вытесняются самые давние записи."""
+    _SUB_CACHE[id] = (time.monotonic(), subscribed)
+    _SUB_CACHE.move_to_end(id)
+    while len(_SUB_CACHE) > config.SUB_CACHE_MAX:
+        _SUB_CACHE.popitem(last=False)
+
+
+def _cached_subscription(id: int) -> bool | None:
+    """RU: Статус подписки из кэша, если запись не устарела; иначе None."""
+    row = _SUB_CACHE.get(id)
+    if row is None:
+        return None
+    checked, subscribed = row
+    ttl = config.SUB_CACHE_TTL if subscribed else config.SUB_CACHE_NEG_TTL
+    return subscribed if time.monotonic() - checked < ttl else None
+
+
 # Проверка подписки пользователя на обязательный канал (использует объект bot)
-async def is_subscribed(id: int) -> bool:
-    """RU: Проверяет, подписан ли пользователь на обязательный канал."""
+async def is_subscribed(id: int, fresh: bool = False) -> bool:
+    """RU: Проверяет, подписан ли пользователь на обязательный канал.
+
+    Ответ кэшируется (SUB_CACHE_TTL для подписанных, SUB_CACHE_NEG_TTL для остальных)
+    и обновляется сразу по событиям chat_member канала; fresh=True — спросить Telegram.
+    """
+    if not fresh:
+        cached = _cached_subscription(id)
+        if cached is not None:
+            _SUB_STATS["hits"] += 1
+            return cached
+    _SUB_STATS["misses"] += 1
     try:
         member = await bot.get_chat_member(chat_id=config.CHANNEL, user_id=id)
-        return member.status in ("creator", "administrator", "member", "restricted")
     except Exception:
+        # RU: Ошибку не кэшируем — это не ответ «не подписан»
         logging.exception("Error checking subscription")
         return False
+    subscribed = member.status in _SUBSCRIBED_STATUSES
+    _sub_cache_set(id, subscribed)
+    return subscribed
+
+
+def _is_channel(chat: types.Chat) -> bool:
+    """RU: Чат — обязательный канал config.CHANNEL (задан как @username или числовой id)."""
+    if config.CHANNEL.startswith("@"):
+        return (chat.username or "").lower() == config.CHANNEL[1:].lower()
+    return str(chat.id) == config.CHANNEL
+
+
+@dp.chat_member()
+# RU: Подписка/отписка в канале — сразу обновляем кэш (бот должен быть админом канала)
+async def on_channel_member(event: types.ChatMemberUpdated):
+    if not _is_channel(event.chat):
+        return
+    member = event.new_chat_member
+    _sub_cache_set(member.user.id, member.status in _SUBSCRIBED_STATUSES)
+    _SUB_STATS["updates"] += 1
+
+def _is_admin(message: types.Message) -> bool:
+    """RU: Отправитель — администратор бота (config.ADMIN_IDS)."""
+    return bool(message.from_user) and message.from_user.id in config.ADMIN_IDS
 
 def _build_freeze_keyboard(id: int, hot: bool = True) -> types.InlineKeyboardMarkup:
     """RU: Формирует инлайн-клавиатуру для заморозки/разморозки автоответов."""
@@ -109,15 +177,38 @@ async def cmd_rag_reindex(message: types.Message):
     if not config.RAG_ENABLED:
         await message.reply("RAG отключён")
         return
-    msg = await message.reply("🔄 <b>Перестраиваю индекс</b>...")
+    if rag.RAG_LOCK.locked():
+        msg = await message.reply("⏳ Индекс уже перестраивается, дождусь окончания...")
+    else:
+        msg = await message.reply("🔄 <b>Перестраиваю индекс</b>...")
+
+    stages = {"scan": "читаю базу знаний", "embed": "эмбеддинги", "save": "сохраняю и подменяю индекс"}
+    last_edit = 0.0
+
+    async def progress(stage: str, done: int, total: int):
+        # RU: Не чаще раза в 2 секунды, чтобы не упереться в лимиты Telegram на правки
+        nonlocal last_edit
+        now = time.monotonic()
+        if stage == "embed" and done and now - last_edit < 2.0:
+            return
+        last_edit = now
+        text = stages.get(stage, stage)
+        if stage == "embed":
+            text += f" {done}/{total}"
+        try:
+            await msg.edit_text(f"🔄 <b>Перестраиваю индекс</b>: {text}...\nПоиск пока работает по старому индексу")
+        except Exception:
+            pass
+
     try:
-        global RAG_CHUNKS
-        rag.RAG_LOADED = False
-        await rag._ensure_rag_index()
-        await msg.edit_text(f"✅ <b>Готово</b>\nЧанков: {len(rag.RAG_CHUNKS)}")
+        stats = await rag._ensure_rag_index(force=True, progress=progress)
+        await msg.edit_text(
+            f"✅ <b>Готово</b>, версия индекса: {stats['version']}\nЧанков: {stats['chunks']}\n"
+            f"Переиспользовано: {stats['reused']}, добавлено: {stats['added']}, удалено: {stats['removed']}"
+        )
     except Exception as e:
         logging.exception("RAG reindex error")
-        await msg.edit_text(f"⚠️ Ошибка перестройки: {e}")
+        await msg.edit_text(f"⚠️ Ошибка перестройки, остаётся старый индекс: {e}")
 
 
 @dp.callback_query()
@@ -186,11 +277,188 @@ async def callback_any(query: types.CallbackQuery):
         await query.answer()
         return
 
-    if await is_subscribed(query.from_user.id):
+    if await is_subscribed(query.from_user.id, fresh=True):
         await query.message.reply(f"Привет, @{username}!\nМожешь писать мне свои вопросы\nОбращайся ко мне - бриджик")
     else:
         await query.message.reply("Подписка не найдена! Убедитесь, что подписаны на канал", show_alert=True)
 
+@dp.message(Command("answer_cache"))
+# RU: Просмотр и очистка кэша готовых ответов (/answer_cache [flush]) — только для администраторов
+async def cmd_answer_cache(message: types.Message):
+    if not _is_admin(message):
+        await message.reply("Команда доступна только администраторам бота")
+        return
+    args = (message.text or "").split()[1:]
+    if args and args[0].lower() == "flush":
+        n = answer_cache.flush()
+        await message.reply(f"🧹 Кэш ответов очищен: удалено <b>{n}</b>")
+        return
+    st = answer_cache.stats()
+    lines = [
+        "<b>Кэш ответов</b>",
+        f"Записей: <b>{st['size']}</b> / {config.ANSWER_CACHE_MAX}, TTL {config.ANSWER_CACHE_TTL // 60} мин, порог {config.ANSWER_CACHE_SIM}",
+        f"Попаданий: <b>{st['hits']}</b>, промахов: {st['misses']} ({st['hit_rate']:.0%})",
+        f"Сохранено: {st['stores']}, устарело: {st['expired']}, вытеснено: {st['evicted']}",
+        f"Версия индекса: {rag.RAG_SNAPSHOT.version}",
+    ]
+    recent = answer_cache.recent()
+    if recent:
+        lines.append("\nПоследние:")
+        lines.extend(f"• <code>{html.escape(utils._shorten(e.question, 80))}</code>" for e in recent)
+    await message.reply("\n".join(lines))
+
+@dp.message(Command("faq_stats"))
+# RU: Статистика быстрых ответов FAQ — сколько сообщений обошлось без модели
+async def cmd_faq_stats(message: types.Message):
+    if not _is_admin(message):
+        await message.reply("Команда доступна только администраторам бота")
+        return
+    st = faq.stats()
+    hits = st["exact"] + st["normalized"] + st["fuzzy"]
+    await message.reply(
+        "<b>FAQ</b>\n"
+        f"Вопросов в индексе: <b>{st['questions']}</b>\n"
+        f"Ответов без модели: <b>{hits}</b> из {hits + st['miss']} ({st['hit_rate']:.0%})\n"
+        f"Точных: {st['exact']}, нормализованных: {st['normalized']}, нечётких: {st['fuzzy']}"
+    )
+
+@dp.message(Command("http_stats"))
+# RU: Метрики HTTP-пулов по апстримам: запросы, ошибки, задержки
+async def cmd_http_stats(message: types.Message):
+    if not _is_admin(message):
+        await message.reply("Команда доступна только администраторам бота")
+        return
+    st = http_pool.stats()
+    if not st:
+        await message.reply("HTTP-запросов ещё не было")
+        return
+    lines = ["<b>HTTP</b>"]
+    for name, u in sorted(st.items()):
+        line = (
+            f"<b>{html.escape(name)}</b>: {u['requests']} запр., ошибок {u['errors']}+{u['http_errors']} HTTP, "
+            f"p50 {u['p50_ms']:.0f} мс, p95 {u['p95_ms']:.0f} мс, макс {u['max_ms']:.0f} мс"
+        )
+        if u["last_error"]:
+            line += f" (последняя: {html.escape(u['last_error'])})"
+        lines.append(line)
+    await message.reply("\n".join(lines))
+
+@dp.message(Command("health"))
+# RU: Состояние апстримов: предохранители (closed/open/half_open), ошибки, отказы
+async def cmd_health(message: types.Message):
+    if not _is_admin(message):
+        await message.reply("Команда доступна только администраторам бота")
+        return
+    st = resilience.health()
+    marks = {resilience.CLOSED: "🟢", resilience.HALF_OPEN: "🟡", resilience.OPEN: "🔴"}
+    lines = ["<b>Апстримы</b>"]
+    if not st:
+        lines.append("Запросов к апстримам ещё не было")
+    for name, h in sorted(st.items()):
+        line = (
+            f"{marks.get(h['state'], '')} <b>{html.escape(name)}</b>: {h['state']}, "
+            f"вызовов {h['calls']}, ошибок {h['failures']}, повторов {h['retries']}, отклонено {h['rejected']}"
+        )
+        if h["state"] == resilience.OPEN:
+            line += f", проба через {h['retry_in']:.0f} с"
+        if h["last_error"]:
+            line += f" (последняя: {html.escape(h['last_error'])})"
+        lines.append(line)
+    sub = _SUB_STATS
+    lines.append(
+        f"Подписка на канал: из кэша {sub['hits']}, запросов к Telegram {sub['misses']}, "
+        f"событий канала {sub['updates']}, записей {len(_SUB_CACHE)}"
+    )
+    qc = rag.query_cache_stats()
+    lines.append(
+        f"Кэш эмбеддингов запросов: записей {qc['size']} "
+        f"({qc['bytes'] / 2**20:.1f} из {config.RAG_QUERY_CACHE_MAX_BYTES / 2**20:.0f} МБ), "
+        f"попаданий {qc['hits']}, промахов {qc['misses']}, вытеснено {qc['evicted']}"
+    )
+    ctx = rag.context_stats()
+    if ctx:
+        lines.append("<b>Источники контекста</b>")
+        for name, c in sorted(ctx.items()):
+            lines.append(
+                f"<b>{html.escape(name)}</b>: успешно {c['ok']}, опоздали {c['late']}, ошибок {c['error']}, "
+                f"не понадобились {c['skipped']}, "
+                f"в среднем {c['ms_avg']:.0f} мс, макс. {c['ms_max']:.0f} мс"
+            )
+    intents = rag.intent_stats()
+    if any(sum(st.values()) for st in intents.values()):
+        lines.append("<b>Намерения</b>")
+        for name, st in sorted(intents.items()):
+            lines.append(
+                f"<b>{html.escape(name)}</b>: по правилам {st['rules']}, по сходству {st['vector']}, "
+                f"пропущено {st['skipped']}"
+            )
+    await message.reply("\n".join(lines))
+
+@dp.message(Command("llm_stats"))
+# RU: Модели: запросы, победы (в т.ч. хеджем), переходы на запасные, задержки
+async def cmd_llm_stats(message: types.Message):
+    if not _is_admin(message):
+        await message.reply("Команда доступна только администраторам бота")
+        return
+    st = llm_router.stats()
+    if not st:
+        await message.reply("Запросов к моделям ещё не было")
+        return
+    lines = ["<b>Модели</b>"]
+    for model in llm_router.models() + sorted(set(st) - set(llm_router.models())):
+        m = st.get(model)
+        if m is None:
+            continue
+        p50 = f"{m['p50_s']:.1f}" if m["p50_s"] is not None else "—"
+        p95 = f"{m['p95_s']:.1f}" if m["p95_s"] is not None else "—"
+        lines.append(
+            f"<code>{html.escape(model)}</code>: побед {m['wins']}/{m['requests']} ({m['win_rate']:.0%}), "
+            f"хедж {m['hedge_wins']}/{m['hedges']}, запасной {m['fallbacks']}, ошибок {m['errors']}, "
+            f"p50 {p50} с, p95 {p95} с, сэкономлено ~{m['saved_s']:.1f} с"
+        )
+    await message.reply("\n".join(lines))
+
+@dp.message(Command("llm_queue"))
+# RU: Очередь к модели: занятые слоты, глубина очередей, ожидание, отказы
+async def cmd_llm_queue(message: types.Message):
+    if not _is_admin(message):
+        await message.reply("Команда доступна только администраторам бота")
+        return
+    st = llm_scheduler.stats()
+    lines = [
+        "<b>Очередь к модели</b>",
+        f"Выполняется: <b>{st['running']}</b> из {st['limit']}, в очереди: <b>{st['depth']}</b> (максимум {st['max_depth']})",
+    ]
+    for cls, title in ((llm_scheduler.DM, "Лички"), (llm_scheduler.GROUP, "Группы")):
+        q = st[cls]
+        lines.append(
+            f"{title}: ждут {q['depth']} в {q['chats']} чатах, ожидание p50 {q['wait_p50']:.1f} с, p95 {q['wait_p95']:.1f} с"
+        )
+    lines.append(
+        f"Принято: {st['admitted']} (через очередь {st['queued']}), "
+        f"отказов: переполнение {st['shed_full']}, долгое ожидание {st['shed_wait']}"
+    )
+    co = coalesce.stats()
+    lines.append(f"Склейка в группах: обращений {co['triggers']}, запросов {co['batches']}, склеено {co['merged']}")
+    await message.reply("\n".join(lines))
+
+@dp.message(Command("ratelimit"))
+# RU: Лимиты частоты: пропущено/отклонено, живые ведра, частые нарушители
+async def cmd_ratelimit(message: types.Message):
+    if not _is_admin(message):
+        await message.reply("Команда доступна только администраторам бота")
+        return
+    st = ratelimit.stats()
+    lines = [
+        "<b>Лимиты частоты</b>",
+        f"Пропущено: <b>{st['allowed']}</b>, отклонено: по пользователю <b>{st['rejected_user']}</b>, "
+        f"по чату <b>{st['rejected_chat']}</b>",
+        f"Вёдер в памяти: {st['buckets']} (истекло {st['expired']})",
+    ]
+    for (scope, ident), n in st["top"]:
+        lines.append(f"{'👤' if scope == ratelimit.USER else '💬'} <code>{ident}</code>: {n}")
+    await message.reply("\n".join(lines))
+
 @dp.message(Command("player"))
  # RU: Команда /player — получить данные игрока по нику (или @username)
 async def cmd_player(message: types.Message):
@@ -229,6 +497,98 @@ async def cmd_player(message: types.Message):
     except Exception as e:
         await msg.edit_text(f"❌ Ошибка при запросе: {utils._shorten(str(e), 300)}")
 
+class _StageTimer:
+    """RU: Замеры стадий auto_reply; параллельные стадии пересекаются, итог — по стене."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    async def _timed(self, name: str, coro):
+        t = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.stages[name] = time.perf_counter() - t
+
+    def task(self, name: str, coro) -> asyncio.Task:
+        """RU: Запускает стадию в фоне (спекулятивно)."""
+        return asyncio.create_task(self._timed(name, coro))
+
+    async def run(self, name: str, coro):
+        """RU: Выполняет стадию на месте."""
+        return await self._timed(name, coro)
+
+    def log(self, outcome: str) -> None:
+        parts = " ".join(f"{name}={sec * 1000:.0f}ms" for name, sec in self.stages.items())
+        logging.info("auto_reply %s in %.0fms: %s", outcome, (time.perf_counter() - self.t0) * 1000, parts)
+
+
+def _cancel(*tasks: asyncio.Task | None) -> None:
+    """RU: Отменяет незавершённые спекулятивные стадии (ошибки завершённых забираем, чтобы не шумели)."""
+    for task in tasks:
+        if task is None:
+            continue
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()
+
+
+_BACKGROUND: set[asyncio.Task] = set()
+
+
+async def _drop_placeholder(placeholder_task: asyncio.Task, batch: coalesce.Batch) -> None:
+    """RU: Удаляет заглушку обращения, вошедшего в чужую пачку, когда лидер ответил."""
+    try:
+        msg = await placeholder_task
+        await batch.done.wait()
+        await msg.delete()
+    except Exception:
+        logging.exception("Coalesce: failed to remove placeholder")
+
+
+async def _typing(chat_id: int) -> None:
+    try:
+        await bot.send_chat_action(chat_id=chat_id, action="typing")
+    except Exception:
+        pass
+
+
+async def _download_image(message: types.Message) -> tuple[bytes, str]:
+    """RU: Скачивает фото/картинку-документ из сообщения: (байты, mime)."""
+    if message.photo:
+        file_id = message.photo[-1].file_id
+        mime = "image/jpeg"
+    else:
+        file_id = message.document.file_id
+        mime = (message.document.mime_type or "image/jpeg")
+    fobj = await bot.get_file(file_id)
+    file_path = getattr(fobj, "file_path", None)
+    if not file_path:
+        raise RuntimeError("missing file_path")
+    url = f"https://api.telegram.org/file/bot{config.BOT_TOKEN}/{file_path}"
+    resp = await http_pool.request("telegram", "GET", url, timeout=20.0)
+    resp.raise_for_status()
+    return resp.content, mime
+
+
+async def _rate_limit(message: types.Message, cost: float, quiet: bool = False,
+                      user: bool = True, chat: bool = True) -> bool:
+    """RU: Проверяет лимит частоты пользователя и/или чата; при первом отказе подряд — предупреждает (кроме quiet)."""
+    user_id = getattr(message.from_user, "id", None) if user else None
+    decision = ratelimit.check(user_id, message.chat.id, cost, chat=chat)
+    if decision.allowed:
+        return True
+    logging.info("Rate limit (%s) for user %s in chat %s, retry in %.0fs",
+                 decision.scope, user_id, message.chat.id, decision.retry_in)
+    if decision.notify and not quiet:
+        try:
+            await message.reply(config.RATE_LIMIT_TEXT.format(seconds=max(1, round(decision.retry_in))))
+        except Exception:
+            logging.exception("Rate limit: failed to notify")
+    return False
+
 @dp.message()
 async def auto_reply(message: types.Message):
     """RU: Автоответ ИИ — отвечает, когда сообщение адресовано боту."""
@@ -238,8 +598,16 @@ async def auto_reply(message: types.Message):
     has_image = has_photo or has_image_doc
     has_voice = bool(getattr(message, "voice", None)) or bool(getattr(message, "audio", None) and str(getattr(message.audio, "mime_type", "")).startswith("audio/"))
 
-    # Voice transcription (runs even if bot is not addressed)
+    # RU: Лимит частоты — до скачивания голосового, подписки и сборки контекста
+    limited = False
+    in_dm = str(getattr(message.chat, "type", "")).lower().endswith("private")
     if has_voice:
+        # RU: В группе голосовое может быть и не боту — молча пропускаем распознавание и
+        # списываем только с пользователя; ведро чата — после should_answer
+        limited = not await _rate_limit(message, config.RATE_LIMIT_VOICE_COST, quiet=not in_dm, chat=in_dm)
+
+    # Voice transcription (runs even if bot is not addressed)
+    if has_voice and not limited:
         try:
             try:
                 await bot.send_chat_action(chat_id=message.chat.id, action="typing")
@@ -252,11 +620,9 @@ async def auto_reply(message: types.Message):
             if not file_path:
                 raise RuntimeError("missing voice file_path")
             url = f"https://api.telegram.org/file/bot{config.BOT_TOKEN}/{file_path}"
-            timeout = httpx.Timeout(30.0, connect=10.0, read=30.0)
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                resp = await client.get(url)
-                resp.raise_for_status()
-                audio_bytes = resp.content
+            resp = await http_pool.request("telegram", "GET", url)
+            resp.raise_for_status()
+            audio_bytes = resp.content
             prompt = await handlers_helpers.transcribe_voice_gemini(audio_bytes, mime)
         except Exception:
             logging.exception("voice transcription flow failed")
@@ -284,77 +650,125 @@ async def auto_reply(message: types.Message):
         logging.info("Пропущено (но сохранено) сообщение без упоминания бриджика или ответа на бриджик (группа)")
         utils.save_incoming_message(message, prompt)
         return
+
+    # RU: Голосовое уже списало жетоны перед распознаванием (в группе — только пользователя)
+    if has_voice:
+        allowed = in_dm or await _rate_limit(message, config.RATE_LIMIT_VOICE_COST, user=False)
+    else:
+        allowed = await _rate_limit(message, config.RATE_LIMIT_IMAGE_COST if has_image else 1)
+    if not allowed:
+        utils.save_incoming_message(message, prompt)
+        return
     
     id = message.from_user.id
-    if not await is_subscribed(id):
-        await message.reply("Подпишитесь на @MineBridgeOfficial, чтобы пользоваться бриджиком")
+    username = (message.from_user.username or f"{message.from_user.first_name}")
+    not_subscribed_text = "Подпишитесь на @MineBridgeOfficial, чтобы пользоваться бриджиком"
+    timer = _StageTimer()
+
+    # RU: Дальше — конвейер: проверка подписки, заглушка, контекст и картинка стартуют
+    # одновременно; если подписки нет, спекулятивные стадии отменяются
+    subscribed = _cached_subscription(id)
+    if subscribed is False:
+        await message.reply(not_subscribed_text)
         utils.save_incoming_message(message, prompt)
         return
+    sub_task = timer.task("subscribe", is_subscribed(id)) if subscribed is None else None
+    if not has_voice:
+        typing = asyncio.create_task(_typing(message.chat.id))
+        _BACKGROUND.add(typing)
+        typing.add_done_callback(_BACKGROUND.discard)
+
+    if has_image:
+        placeholder = "🖼️ <b>Распознаю изображение...</b>"
+    elif has_voice:
+        placeholder = "🎙️ <b>Распознаю голосовое...</b>"
+    else:
+        placeholder = "⏳ <b>Думаю...</b>"
+    placeholder_task = timer.task("placeholder", message.reply(placeholder))
+
+    # RU: Частый вопрос с готовым ответом из базы знаний — отвечаем без модели и без контекста
+    faq_answer = None
+    if not has_image and not message.reply_to_message:
+        faq_answer = await faq.match(prompt)
+    ctx_task = image_task = None
+    if config.RAG_ENABLED and faq_answer is None:
+        ctx_task = timer.task("context", rag.build_context(prompt, username, is_group=is_group))
+    if has_image:
+        image_task = timer.task("image", _download_image(message))
+
+    # RU: Всплеск обращений в группе: пока идёт ответ по чату, новые копятся в одну пачку.
+    # В пачку попадают только подписчики, поэтому подписку дожидаемся здесь (заглушка и
+    # контекст уже в пути); неподписанному ответит общая проверка ниже
+    batch = None
+    if is_group and config.COALESCE_ENABLED and not has_image and not faq_answer \
+            and (sub_task is None or await sub_task):
+        batch, leader = await timer.run("coalesce", coalesce.join(message, prompt))
+        if not leader:
+            # RU: Ответ придёт одним сообщением лидера — заглушка этого обращения больше не нужна
+            _cancel(sub_task, ctx_task)
+            await _drop_placeholder(placeholder_task, batch)
+            timer.log("coalesced")
+            return
+        if len(batch.items) > 1:
+            prompt = batch.prompt()
+            _cancel(ctx_task)
+            ctx_task = None
+            if config.RAG_ENABLED:
+                ctx_task = timer.task("context", rag.build_context(prompt, username, is_group=is_group))
+    merged = batch is not None and len(batch.items) > 1
 
+    outcome = "answered"
+    msg = None
     try:
-        try:
-            await bot.send_chat_action(chat_id=message.chat.id, action="typing")
-        except Exception:
-            pass
-        msg = None
-        if has_image:
-            msg = await message.reply("🖼️ <b>Распознаю изображение...</b>")
-        elif has_voice:
-            msg = await message.reply("🎙️ <b>Распознаю голосовое...</b>")
-        else:
-            msg = await message.reply("⏳ <b>Думаю...</b>")
-        username = (message.from_user.username or f"{message.from_user.first_name}")
-        conv_key = utils.make_key(message)
-
         sys_prompt = utils.load_system_prompt_for_chat(message.chat)
         sys_prompt += "\n\nПоддерживаются теги [[photo:...]] и [[sticker:...]] (file_id/alias)."
         sys_prompt += "\n\nВажно: Используй HTML-разметку для форматирования ответа (<b>, <i>, <code>, <s>, <u>, <pre>). MarkDown НЕЛЬЗЯ! Все ссылки вставляй сразу в текст <a href=""></a>"
+        conv_key = utils.make_key(message)
+
+        if sub_task is not None and not await sub_task:
+            _cancel(ctx_task, image_task)
+            outcome = "not subscribed"
+            msg = await placeholder_task
+            await msg.edit_text(not_subscribed_text)
+            utils.save_incoming_message(message, prompt)
+            return
+        msg = await placeholder_task
+
+        if faq_answer:
+            outcome = "faq"
+            logging.info("FAQ hit for %r", prompt[:80])
+            handlers_helpers.remember_exchange(prompt, conv_key, message, faq_answer)
+            await msgs.long_text(msg, message, faq_answer)
+            return
 
         rag_ctx = ""
-        try:
-            # Получаем RAG контекст (если включён)
-            if config.RAG_ENABLED:
-                rag_ctx = await rag.build_full_context(prompt, username)
-        except Exception:
-            logging.exception("RAG: failed to build context")
+        ctx = None
+        if ctx_task is not None:
+            try:
+                ctx = await ctx_task
+                rag_ctx = ctx.text
+            except Exception:
+                logging.exception("RAG: failed to build context")
+
+        # RU: Кэш ответов — только для самостоятельных текстовых вопросов без статуса/данных игрока;
+        # ответ учитывает историю и имя автора, поэтому ключ включает чат и пользователя
+        cache_key = None
+        if ctx is not None and ctx.q_emb is not None and not ctx.dynamic and not has_image \
+                and not message.reply_to_message and not merged:
+            cache_key = (ctx.q_emb, answer_cache.prompt_version(sys_prompt), ctx.kb_version, (message.chat.id, id))
+            cached = answer_cache.lookup(*cache_key)
+            if cached is not None:
+                outcome = "answer cache"
+                logging.info("Answer cache hit for %r (cached question %r)", prompt[:80], cached.question[:80])
+                handlers_helpers.remember_exchange(prompt, conv_key, message, cached.answer)
+                await msgs.long_text(msg, message, cached.answer)
+                return
 
         # call OpenAI: vision for images, plain for text
         if has_image:
             try:
-                if message.photo:
-                    file_id = message.photo[-1].file_id
-                    mime = "image/jpeg"
-                else:
-                    file_id = message.document.file_id
-                    mime = (message.document.mime_type or "image/jpeg")
-                async def _download_image() -> bytes:
-                    fobj = await bot.get_file(file_id)
-                    file_path = getattr(fobj, "file_path", None)
-                    if not file_path:
-                        raise RuntimeError("missing file_path")
-                    url = f"https://api.telegram.org/file/bot{config.BOT_TOKEN}/{file_path}"
-                    timeout = httpx.Timeout(20.0, connect=10.0, read=20.0)
-                    async with httpx.AsyncClient(timeout=timeout) as client:
-                        resp = await client.get(url)
-                        resp.raise_for_status()
-                        return resp.content
-
-                # Run image download and (optionally) RAG in parallel
-                tasks = [asyncio.create_task(_download_image())]
-                if config.RAG_ENABLED and not rag_ctx:
-                    tasks.append(asyncio.create_task(rag.build_full_context(prompt, username)))
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                image_bytes = results[0]
-                if isinstance(image_bytes, Exception):
-                    raise image_bytes
-                if len(results) > 1:
-                    rag_res = results[1]
-                    if isinstance(rag_res, Exception):
-                        logging.exception("RAG: failed to build context")
-                    else:
-                        rag_ctx = rag_res
-
-                answer = await handlers_helpers.complete_openai(
+                image_bytes, mime = await image_task
+                answer = await timer.run("llm", handlers_helpers.complete_openai(
                     prompt,
                     username,
                     conv_key,
@@ -363,24 +777,49 @@ async def auto_reply(message: types.Message):
                     message,
                     image_bytes=image_bytes,
                     mime_type=mime
-                )
+                ))
+            except llm_scheduler.Busy:
+                raise
             except Exception:
                 logging.exception("vision flow failed")
                 answer = "Не удалось обработать изображение. Попробуй ещё раз прислать фото или добавь подпись."
         else:
-            answer = await handlers_helpers.complete_openai(
+            stream = None
+            if config.STREAM_REPLIES:
+                interval = config.STREAM_EDIT_INTERVAL_GROUP if is_group else config.STREAM_EDIT_INTERVAL
+                stream = msgs.StreamEditor(msg, message, interval)
+            answer = await timer.run("llm", handlers_helpers.complete_openai(
                 prompt,
                 username,
                 conv_key,
                 sys_prompt,
                 rag_ctx,
-                message
-            )
-
-        await msgs.long_text(msg, message, answer)
+                message,
+                on_delta=stream.update if stream else None,
+                batch_items=batch.items if merged else None
+            ))
+            if cache_key is not None and answer:
+                answer_cache.store(*cache_key, prompt, answer)
+            if stream is not None:
+                await timer.run("send", stream.finish(answer))
+                return
+
+        await timer.run("send", msgs.long_text(msg, message, answer))
+    except llm_scheduler.Busy:
+        outcome = "busy"
+        try:
+            await msg.edit_text(config.LLM_BUSY_TEXT)
+        except Exception:
+            pass
     except Exception as e:
+        outcome = "failed"
         logging.exception("Ошибка в auto_reply")
         try:
             await msg.edit_text(f"<b>Что-то пошло не так</b> ⚠️\n{str(e)}")
         except Exception:
             pass
+    finally:
+        _cancel(sub_task, ctx_task, image_task)
+        if batch is not None:
+            batch.finish()
+        timer.log(outcome)
@@ -1,11 +1,13 @@
 # handlers_helpers.py
 import logging
-from typing import Tuple
+from typing import Awaitable, Callable, Tuple
 
-from bot_init import *
 import utils
 from openai import RateLimitError, APIError
 import html_edit
+import llm_router
+import llm_scheduler
+import resilience
 from aiogram.enums import ChatType
 import base64
 import google.generativeai as genai
@@ -23,14 +25,23 @@ async def complete_openai(
     message=None,
     *,
     image_bytes: bytes | None = None,
-    mime_type: str | None = None
+    mime_type: str | None = None,
+    on_delta: Callable[[str], Awaitable[None]] | None = None,
+    batch_items: list | None = None
 ) -> str:
     """Unified completion for text-only and vision inputs.
 
     - If image_bytes is provided (with image/* mime), sends a vision message (text + image_url).
     - Otherwise sends a plain text message.
+    - If on_delta is provided, the response is streamed and on_delta receives
+      the accumulated raw text after every chunk (e.g. msgs.StreamEditor.update).
+    - Model choice, hedging and fallbacks are handled by llm_router.complete.
+    - Waits for a llm_scheduler slot first; raises llm_scheduler.Busy when the queue is full.
+    - batch_items: (message, text) pairs of a coalesced group batch; the merged prompt
+      is not shortened as a whole and each trigger is logged under its own author.
     """
-    prompt = utils._shorten(prompt)
+    if batch_items is None:
+        prompt = utils._shorten(prompt)
 
     chat_id = conv_key[0]
     use_thread = False
@@ -42,10 +53,38 @@ async def complete_openai(
     except Exception:
         pass
 
+    # RU: Ждём слот планировщика до записи в историю — при Busy вопрос в ней не повиснет
+    async with llm_scheduler.slot(chat_id, use_thread):
+        return await _complete_in_slot(
+            prompt, name, conv_key, sys_prompt, rag_ctx, message, use_thread,
+            image_bytes=image_bytes, mime_type=mime_type, on_delta=on_delta, batch_items=batch_items,
+        )
+
+
+async def _complete_in_slot(
+    prompt: str,
+    name: str,
+    conv_key: HistoryKey,
+    sys_prompt: str,
+    rag_ctx: str | None,
+    message,
+    use_thread: bool,
+    *,
+    image_bytes: bytes | None = None,
+    mime_type: str | None = None,
+    on_delta: Callable[[str], Awaitable[None]] | None = None,
+    batch_items: list | None = None
+) -> str:
+    """RU: Тело complete_openai, выполняется в слоте llm_scheduler."""
+    chat_id = conv_key[0]
     if use_thread and message is not None:
         # Чат
         input_with_ctx = await utils.build_input_from_chat_thread(message, prompt, name)
-        utils.save_incoming_message(message, prompt)
+        if batch_items:
+            for item_msg, item_text in batch_items:
+                utils.save_incoming_message(item_msg, item_text)
+        else:
+            utils.save_incoming_message(message, prompt)
     else:
         # Личка
         input_with_ctx = utils.build_input_with_history(conv_key, prompt, name)
@@ -80,24 +119,41 @@ async def complete_openai(
 
     messages.append({"role": "user", "content": user_content})
 
-    while True:
-        try:
-            resp = await openai_client.chat.completions.create(
-                model="x-ai/grok-4-fast",
-                messages=messages,
-                temperature=1,
-            )
-            text = (resp.choices[0].message.content or "").strip()
-            text = html_edit.remove(text)
-            if text:
-                if not use_thread:
-                    utils.remember_assistant(conv_key, text)
-                else:
-                    utils.save_outgoing_message(chat_id, text)
-            return text
-        except (RateLimitError, APIError):
-            logging.exception("OpenAI completion rate limit/API error")
-            return None
+    try:
+        text = await llm_router.complete(messages, on_delta)
+    except resilience.CircuitOpen as e:
+        logging.warning("OpenAI completion skipped: %s", e)
+        return None
+    except (RateLimitError, APIError):
+        logging.exception("OpenAI completion rate limit/API error")
+        return None
+    text = html_edit.remove(text)
+    if text:
+        if not use_thread:
+            utils.remember_assistant(conv_key, text)
+        else:
+            utils.save_outgoing_message(chat_id, text)
+    return text
+
+
+def remember_exchange(prompt: str, conv_key: HistoryKey, message, answer: str) -> None:
+    """RU: Записывает вопрос и готовый ответ в историю так же, как complete_openai.
+
+    Нужен, когда ответ взят не из модели (кэш ответов), чтобы история не рвалась.
+    """
+    prompt = utils._shorten(prompt)
+    use_thread = False
+    try:
+        chat_type = getattr(message.chat, "type", None)
+        use_thread = chat_type in (ChatType.GROUP, ChatType.SUPERGROUP)
+    except Exception:
+        pass
+    if use_thread:
+        utils.save_incoming_message(message, prompt)
+        utils.save_outgoing_message(conv_key[0], answer)
+    else:
+        utils.remember_user(conv_key, prompt)
+        utils.remember_assistant(conv_key, answer)
 
 
 async def transcribe_voice_gemini(audio_bytes: bytes, mime_type: str | None = None) -> str | None:
@@ -115,13 +171,13 @@ async def transcribe_voice_gemini(audio_bytes: bytes, mime_type: str | None = No
             "Отдай только распознанный текст без пояснений."
 "Не пиши этот промт в ответ."
         )
-        # Prefer async call if available
-        if hasattr(model, "generate_content_async"):
-            resp = await model.generate_content_async([
-                {"mime_type": mt, "data": audio_bytes},
-                prompt,
-            ], generation_config={"temperature": 0.7})
-        else:
+        async def _generate():
+            # Prefer async call if available
+            if hasattr(model, "generate_content_async"):
+                return await model.generate_content_async([
+                    {"mime_type": mt, "data": audio_bytes},
+                    prompt,
+                ], generation_config={"temperature": 0.7})
             # Fallback to sync API in a thread if async is not available
             import asyncio
             loop = asyncio.get_running_loop()
@@ -130,9 +186,14 @@ async def transcribe_voice_gemini(audio_bytes: bytes, mime_type: str | None = No
                     {"mime_type": mt, "data": audio_bytes},
                     prompt,
                 ], generation_config={"temperature": 0.7})
-            resp = await loop.run_in_executor(None, _sync_call)
+            return await loop.run_in_executor(None, _sync_call)
+
+        resp = await resilience.call("gemini", _generate)
         text = (getattr(resp, "text", None) or "").strip()
         return f"Голосовое сообщение: {text}"
+    except resilience.CircuitOpen as e:
+        logging.warning("Gemini ASR skipped: %s", e)
+        return None
     except Exception:
         logging.exception("Gemini ASR failed")
         return None
@@ -12,7 +12,11 @@ ALLOWED_TAGS = {
 SAFE_SCHEMES = {"http", "https"}
 
 class WhitelistHTMLSanitizer(HTMLParser):
-    """RU: Санитайзер HTML, пропускающий только разрешённые теги Telegram."""
+    """RU: Прежний санитайзер на HTMLParser (только целые строки).
+
+    Ответы бота чистит TelegramHTMLSanitizer; этот класс оставлен для
+    сравнения в bench_html.py.
+    """
     def __init__(self):
         super().__init__(convert_charrefs=False)
         self.out = []
@@ -87,17 +91,128 @@ def _is_safe_href(url: str) -> bool:
     except Exception:
         return False
 
+_TOKEN_RE = re.compile(
+    r"<(/?)([a-zA-Z][a-zA-Z0-9-]*)((?:[\s/][^<>]*)?)>"        # тег
+    r"|<!--.*?-->|<![^<>]*>"                              # комментарий / doctype
+    r"|&(#[0-9]{1,7}|#[xX][0-9a-fA-F]{1,6}|[a-zA-Z][a-zA-Z0-9]{0,31});",  # сущность
+    re.S,
+)
+_TAG_START_RE = re.compile(r"<(?:[/!a-zA-Z]|$)")
+_PARTIAL_ENTITY_RE = re.compile(r"&(?:#[xX]?[0-9a-fA-F]{0,7}|[a-zA-Z][a-zA-Z0-9]{0,31})?")
+_HREF_RE = re.compile(r"""\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.I)
+_MAX_HELD = 512  # RU: дольше этого незакрытый "<..." считаем текстом, а не тегом
+
+def _escape(text: str) -> str:
+    """RU: Экранирует текст для HTML Telegram (&, <, >)."""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+class TelegramHTMLSanitizer:
+    """RU: Потоковый санитайзер HTML для Telegram: feed(кусок) -> готовый HTML.
+
+    Пропускает только теги из ALLOWED_TAGS (у <a> — только безопасный href),
+    остальное экранирует. Недописанный в конце куска тег или сущность ждут
+    следующего куска; стек открытых тегов переживает границы кусков, и в любой
+    момент можно закрыть их (closing_tags) и переоткрыть дальше (open_markup).
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._stack: list[tuple[str, str]] = []  # RU: (тег, открывающая разметка)
+
+    def feed(self, chunk: str) -> str:
+        """RU: Принимает очередной кусок, возвращает безопасный HTML, готовый к выводу."""
+        text = self._pending + (chunk or "")
+        hold = self._hold_from(text)
+        out: list[str] = []
+        pos = 0
+        for m in _TOKEN_RE.finditer(text, 0, hold):
+            if m.start() > pos:
+                out.append(_escape(text[pos:m.start()]))
+            out.append(self._token(m))
+            pos = m.end()
+        if hold > pos:
+            out.append(_escape(text[pos:hold]))
+        self._pending = text[hold:]
+        return "".join(out)
+
+    def flush(self) -> str:
+        """RU: Выводит остаток (недописанный тег — как текст) и закрывает все теги."""
+        out = _escape(self._pending) + self.closing_tags()
+        self._pending = ""
+        self._stack.clear()
+        return out
+
+    def closing_tags(self) -> str:
+        """RU: Закрывающие теги для всех открытых сейчас тегов (стек не меняется)."""
+        return "".join(f"</{tag}>" for tag, _ in reversed(self._stack))
+
+    def open_markup(self) -> str:
+        """RU: Открывающая разметка открытых тегов — чтобы продолжить текст в новом сообщении."""
+        return "".join(markup for _, markup in self._stack)
+
+    @staticmethod
+    def _hold_from(text: str) -> int:
+        """RU: С какого места хвост может оказаться началом тега или сущности."""
+        lt = text.rfind("<")
+        if lt != -1 and ">" not in text[lt:] and len(text) - lt <= _MAX_HELD and _TAG_START_RE.match(text, lt):
+            return lt
+        amp = text.rfind("&")
+        if amp != -1 and _PARTIAL_ENTITY_RE.fullmatch(text, amp):
+            return amp
+        return len(text)
+
+    def _token(self, m: re.Match) -> str:
+        """RU: Разметка для одного тега, комментария или сущности."""
+        if m.group(4) is not None:
+            # RU: Сущность: раскодируем и экранируем заново (неизвестные останутся текстом)
+            return _escape(html.unescape(m.group(0)))
+        name = m.group(2)
+        if name is None:
+            return ""  # RU: комментарий / doctype
+        name = name.lower()
+        if name == "br":
+            return "\n"
+        if name not in ALLOWED_TAGS:
+            return ""
+        if m.group(1):
+            return self._close(name)
+        attrs = m.group(3) or ""
+        if attrs.rstrip().endswith("/"):
+            return ""  # RU: пустой самозакрывающийся тег форматирования ничего не значит
+        if name == "a":
+            href = _HREF_RE.search(attrs)
+            url = html.unescape(next((g for g in href.groups() if g is not None), "")) if href else ""
+            if not _is_safe_href(url):
+                return ""  # RU: ссылку без безопасного href выводим обычным текстом
+            markup = f'<a href="{html.escape(url, quote=True)}">'
+        else:
+            markup = f"<{name}>"
+        self._stack.append((name, markup))
+        return markup
+
+    def _close(self, name: str) -> str:
+        """RU: Закрывает ближайший открытый тег name и всё, что открыто внутри него."""
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i][0] == name:
+                closed = self._stack[i:]
+                del self._stack[i:]
+                return "".join(f"</{tag}>" for tag, _ in reversed(closed))
+        return ""  # RU: закрывающий тег без пары отбрасываем
+
+def close_partial(text: str) -> tuple[str, str]:
+    """RU: Санитизирует незаконченный HTML (кусок потокового ответа).
+
+    Недописанный тег или сущность в конце отбрасываются, открытые теги
+    закрываются. Возвращает (безопасный HTML, разметку открытых тегов) —
+    второе нужно, чтобы продолжить текст в следующем сообщении.
+    """
+    sanitizer = TelegramHTMLSanitizer()
+    out = sanitizer.feed(text or "")
+    return out + sanitizer.closing_tags(), sanitizer.open_markup()
+
 def remove(text: str) -> str:
     """RU: Удаляет небезопасные теги и нормализует HTML-форматирование."""
     if not text:
         return ""
-
-    # 1) Нормализуем сущности
-    text = html.unescape(text)
-
-    # 2) Прогоняем через HTML-саницайзер c whitelist
-    parser = WhitelistHTMLSanitizer()
-    parser.feed(text)
-    sanitized = parser.get_html()
-
-    return sanitized.strip()
+    sanitizer = TelegramHTMLSanitizer()
+    return (sanitizer.feed(text) + sanitizer.flush()).strip()
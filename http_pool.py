@@ -0,0 +1,126 @@
+# http_pool.py
+# RU: Общий HTTP-слой: долгоживущие пулы соединений по апстримам (Jina, mcsrvstat,
+# MineBridge API, Telegram, Pixabay...), лимиты, таймауты и метрики задержек/ошибок.
+import logging
+import time
+from collections import deque
+
+import httpx
+
+import config
+
+try:
+    import h2  # noqa: F401 — RU: HTTP/2 в httpx работает, только если установлен пакет h2
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+_CLIENTS: dict[str, httpx.AsyncClient] = {}
+_STATS: dict[str, dict] = {}
+_LATENCIES: dict[str, deque] = {}
+
+
+def _options(name: str) -> dict:
+    """RU: Настройки апстрима из config.HTTP_UPSTREAMS (с подстановкой значений по умолчанию)."""
+    return {**config.HTTP_UPSTREAMS["default"], **config.HTTP_UPSTREAMS.get(name, {})}
+
+
+def _make_client(name: str) -> httpx.AsyncClient:
+    """RU: Создаёт пул соединений для апстрима."""
+    opts = _options(name)
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(opts["timeout"], connect=opts["connect"]),
+        limits=httpx.Limits(
+            max_connections=opts["max_connections"],
+            max_keepalive_connections=opts["keepalive"],
+            keepalive_expiry=opts["keepalive_expiry"],
+        ),
+        http2=_HTTP2 and opts["http2"],
+        follow_redirects=opts["follow_redirects"],
+    )
+
+
+def client(name: str) -> httpx.AsyncClient:
+    """RU: Пул соединений апстрима; создаётся при первом обращении, если не открыт заранее."""
+    c = _CLIENTS.get(name)
+    if c is None or c.is_closed:
+        c = _CLIENTS[name] = _make_client(name)
+    return c
+
+
+async def open_clients() -> None:
+    """RU: Открывает пулы для всех апстримов из конфига (вызывается в on_startup)."""
+    for name in config.HTTP_UPSTREAMS:
+        if name != "default":
+            client(name)
+    logging.info("HTTP: %d upstream pools ready (http2=%s)", len(_CLIENTS), _HTTP2)
+
+
+async def close_clients() -> None:
+    """RU: Закрывает все пулы (вызывается в shutdown)."""
+    for name, c in list(_CLIENTS.items()):
+        try:
+            await c.aclose()
+        except Exception:
+            logging.exception("HTTP: failed to close %s pool", name)
+    _CLIENTS.clear()
+
+
+def _record(name: str, seconds: float, status: int | None = None, error: str | None = None) -> None:
+    """RU: Учитывает запрос в метриках апстрима."""
+    st = _STATS.setdefault(name, {"requests": 0, "errors": 0, "http_errors": 0, "total_s": 0.0, "max_s": 0.0, "last_error": None})
+    st["requests"] += 1
+    st["total_s"] += seconds
+    st["max_s"] = max(st["max_s"], seconds)
+    if error is not None:
+        st["errors"] += 1
+        st["last_error"] = error
+    elif status is not None and status >= 400:
+        st["http_errors"] += 1
+        st["last_error"] = f"HTTP {status}"
+    _LATENCIES.setdefault(name, deque(maxlen=config.HTTP_LATENCY_WINDOW)).append(seconds)
+
+
+async def request(name: str, method: str, url: str, **kwargs) -> httpx.Response:
+    """RU: Запрос через пул апстрима name; время и исход попадают в метрики.
+
+    kwargs передаются в httpx.AsyncClient.request (headers, json, params, timeout...).
+    """
+    t0 = time.perf_counter()
+    try:
+        resp = await client(name).request(method, url, **kwargs)
+    except Exception as e:
+        _record(name, time.perf_counter() - t0, error=type(e).__name__)
+        raise
+    _record(name, time.perf_counter() - t0, status=resp.status_code)
+    return resp
+
+
+def quantile(values, q: float) -> float | None:
+    """RU: q-перцентиль (0..1) ряда замеров (ближайший по рангу) или None для пустого ряда."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def percentile(name: str, q: float) -> float | None:
+    """RU: q-перцентиль (0..1) задержки апстрима по последним HTTP_LATENCY_WINDOW запросам, сек."""
+    return quantile(_LATENCIES.get(name, ()), q)
+
+
+def stats() -> dict:
+    """RU: Метрики по апстримам: число запросов, ошибки, средняя/p50/p95/макс. задержка (мс)."""
+    out = {}
+    for name, st in _STATS.items():
+        out[name] = {
+            "requests": st["requests"],
+            "errors": st["errors"],
+            "http_errors": st["http_errors"],
+            "avg_ms": st["total_s"] * 1000 / max(1, st["requests"]),
+            "p50_ms": (percentile(name, 0.5) or 0.0) * 1000,
+            "p95_ms": (percentile(name, 0.95) or 0.0) * 1000,
+            "max_ms": st["max_s"] * 1000,
+            "last_error": st["last_error"],
+        }
+    return out
@@ -0,0 +1,70 @@
+# intent.py
+# RU: Дешёвый локальный классификатор намерений: какие динамические источники
+# (статус сервера, данные игрока) нужны для ответа на вопрос.
+import re
+
+import numpy as np
+
+import bm25
+
+STATUS = "status"
+PLAYER = "player"
+
+# RU: Правила по ключевым словам (текст уже в нижнем регистре, ё -> е)
+RULES: dict[str, list[re.Pattern]] = {
+    STATUS: [re.compile(p) for p in (
+        r"\bонлайн\w*",
+        r"\bстатус\w*",
+        r"\b(ip|айпи|ай пи)\b",
+        r"\bсервер\w*\s+(сейчас\s+)?(работает|лежит|упал|включ\w*|выключ\w*|доступ\w*|жив\w*)",
+        r"\b(лежит|упал|не работает|вырубил\w*)\s+(ли\s+)?сервер",
+        r"\bсколько\s+(сейчас\s+)?(игроков|человек|народу|людей)",
+        r"\bкто\s+(сейчас\s+)?(играет|онлайн|на сервере)",
+        r"\b(какая|какой)\s+(сейчас\s+)?верси\w*",
+        r"\bверси\w*\s+(сервера|майнкрафта|игры)",
+        r"\bне\s+(могу\s+)?(зайти|заходит|подключ\w*|пускает)",
+        r"\bmotd\b",
+    )],
+    PLAYER: [re.compile(p) for p in (
+        r"\bмо(й|я|е|и|его|ей|ю|им)\s+(\w+\s+)?(аккаунт\w*|акк\w*|профил\w*|ник\w*|проходк\w*|мостик\w*|баланс\w*|звезд\w*|стат\w*|рол\w*|подписк\w*|данн\w*)",
+        r"\b(у меня|мне|я)\b.*\b(проходк\w*|мостик\w*|баланс\w*|звезд\w*|аккаунт\w*|профил\w*)",
+        r"\bбаланс\w*",
+        r"\bкто\s+я\b",
+        r"\b(обо|про)\s+(мне|меня)\b",
+        r"\bкогда\s+(у меня\s+)?(закончится|истекает|истечет|кончится)\b",
+    )],
+}
+
+# RU: Эталонные фразы для проверки по сходству эмбеддингов (когда правила молчат)
+PROTOTYPES: dict[str, list[str]] = {
+    STATUS: [
+        "работает ли сейчас сервер",
+        "сколько игроков сейчас на сервере",
+        "сервер лежит, не могу подключиться",
+        "какой айпи и версия у сервера",
+    ],
+    PLAYER: [
+        "сколько у меня мостиков на балансе",
+        "когда заканчивается моя проходка",
+        "покажи информацию о моём аккаунте",
+        "какие у меня роли и звёзды",
+    ],
+}
+
+
+def normalize(text: str) -> str:
+    """RU: Нижний регистр, ё -> е, схлопнутые пробелы."""
+    return " ".join(bm25.fold(text).split())
+
+
+def match_rules(text: str) -> set[str]:
+    """RU: Намерения, для которых сработало хотя бы одно правило."""
+    text = normalize(text)
+    return {name for name, patterns in RULES.items() if any(p.search(text) for p in patterns)}
+
+
+def match_vector(q_emb: np.ndarray, protos: dict[str, np.ndarray], threshold: float) -> set[str]:
+    """RU: Намерения, к эталонным фразам которых запрос ближе порога (косинус)."""
+    q = np.asarray(q_emb, dtype="float32")
+    q = q / max(float(np.linalg.norm(q)), 1e-12)
+    return {name for name, P in protos.items() if len(P) and float(np.max(P @ q)) >= threshold}
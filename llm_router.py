@@ -0,0 +1,221 @@
+# llm_router.py
+# RU: Маршрутизация запросов к модели: основная модель и запасные по порядку,
+# хеджирование (дублирующий запрос к следующей модели, если основная не ответила
+# за p95 своей задержки) и метрики побед/сэкономленного времени по моделям.
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from bot_init import openai_client
+import config
+import http_pool
+import resilience
+
+_LATENCIES: dict[tuple[str, bool], deque] = {}
+_CUT: dict[tuple[str, bool], deque] = {}  # RU: сколько успели проработать отменённые проигравшие, сек
+_STATS: dict[str, dict] = {}
+
+
+def models() -> list[str]:
+    """RU: Основная модель и запасные в порядке обращения."""
+    return [config.LLM_MODEL, *config.LLM_FALLBACK_MODELS]
+
+
+def _stats(model: str) -> dict:
+    return _STATS.setdefault(model, {
+        "requests": 0, "errors": 0, "wins": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0, "saved_s": 0.0,
+    })
+
+
+def _window(model: str, stream: bool) -> deque:
+    """RU: Последние задержки модели (для потока — до первого куска текста), сек."""
+    return _LATENCIES.setdefault((model, stream), deque(maxlen=config.HTTP_LATENCY_WINDOW))
+
+
+def hedge_delay(model: str, stream: bool) -> float:
+    """RU: Через сколько секунд без ответа модели отправлять дублирующий запрос.
+
+    LLM_HEDGE_QUANTILE-перцентиль собственных задержек модели; пока замеров мало —
+    LLM_HEDGE_DEFAULT. Не меньше LLM_HEDGE_MIN_DELAY.
+    """
+    window = _window(model, stream)
+    if len(window) < config.LLM_HEDGE_MIN_SAMPLES:
+        return config.LLM_HEDGE_DEFAULT
+    return max(config.LLM_HEDGE_MIN_DELAY, http_pool.quantile(window, config.LLM_HEDGE_QUANTILE))
+
+
+def _cut_window(model: str, stream: bool) -> deque:
+    """RU: Время работы отменённых попыток модели — для них известно лишь, что ответ был бы позже."""
+    return _CUT.setdefault((model, stream), deque(maxlen=config.HTTP_LATENCY_WINDOW))
+
+
+def _expected_extra(model: str, stream: bool, elapsed: float) -> float:
+    """RU: Оценка, сколько ещё ждали бы модель, не ответившую за elapsed сек.
+
+    Средний остаток задержки при условии, что она больше elapsed, по Каплану — Майеру:
+    завершённые запросы — наблюдения, отменённые хеджем — цензурированные (иначе
+    самые медленные запросы выпадали бы из оценки и она стремилась бы к нулю).
+    Хвост дальше последнего замера не учитывается, так что оценка скорее занижена.
+    """
+    samples = sorted([(x, True) for x in _window(model, stream)] + [(x, False) for x in _cut_window(model, stream)])
+    survival, at_elapsed, area, prev = 1.0, None, 0.0, elapsed
+    for i, (t, finished) in enumerate(samples):
+        if t > elapsed:
+            if at_elapsed is None:
+                at_elapsed = survival
+            area += survival * (t - prev)
+            prev = t
+        if finished:
+            survival *= 1 - 1 / (len(samples) - i)
+    return area / at_elapsed if at_elapsed else 0.0
+
+
+class _Attempt:
+    """RU: Один запрос к модели. ready завершается первым текстом (поток) или ответом целиком."""
+
+    def __init__(self, model: str, messages: list, stream: bool, started: float):
+        self.model = model
+        self.messages = messages
+        self.stream = stream
+        self.started = started
+        self.text = ""
+        self.on_delta: Callable[[str], Awaitable[None]] | None = None
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task = asyncio.create_task(resilience.call(f"openrouter:{model}", self._run, retries=0))
+        self.task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        """RU: Ошибка до первого текста — сигнал гонке, что попытка выбыла."""
+        if self.ready.done():
+            return
+        if task.cancelled():
+            self.ready.cancel()
+        elif task.exception() is not None:
+            self.ready.set_exception(task.exception())
+        else:
+            self.ready.set_result(None)
+
+    def _mark_ready(self) -> None:
+        if not self.ready.done():
+            _window(self.model, self.stream).append(time.monotonic() - self.started)
+            self.ready.set_result(None)
+
+    async def _run(self) -> str:
+        if not self.stream:
+            resp = await openai_client.chat.completions.create(
+                model=self.model,
+                messages=self.messages,
+                temperature=1,
+            )
+            self.text = (resp.choices[0].message.content or "").strip()
+            self._mark_ready()
+            return self.text
+        stream = await openai_client.chat.completions.create(
+            model=self.model,
+            messages=self.messages,
+            temperature=1,
+            stream=True,
+        )
+        # RU: async with закрывает соединение и при отмене проигравшей попытки
+        async with stream:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                self.text += delta
+                self._mark_ready()
+                if self.on_delta is not None:
+                    try:
+                        await self.on_delta(self.text)
+                    except Exception:
+                        logging.exception("stream: on_delta callback failed")
+        return self.text.strip()
+
+
+async def complete(messages: list, on_delta: Callable[[str], Awaitable[None]] | None = None) -> str:
+    """RU: Ответ модели с хеджированием и переходом на запасные модели.
+
+    Если текущая попытка не дала ответа (в потоке — первого текста) за hedge_delay,
+    параллельно запускается следующая модель (не больше LLM_MAX_PARALLEL попыток
+    одновременно); ошибка попытки сразу запускает следующую. Побеждает первая
+    ответившая, остальные отменяются. Ошибка после начала ответа не перехватывается.
+    Если отказали все модели — пробрасывается последняя ошибка.
+    """
+    stream = on_delta is not None
+    queue = models()
+    t0 = time.monotonic()
+    attempts: list[_Attempt] = []
+    running: list[_Attempt] = []
+    last_error: BaseException | None = None
+
+    def launch(reason: str | None) -> None:
+        a = _Attempt(queue[len(attempts)], messages, stream, time.monotonic())
+        _stats(a.model)["requests"] += 1
+        if reason is not None:
+            _stats(a.model)[reason] += 1
+            logging.info("LLM: %s -> %s after %.2fs", reason, a.model, time.monotonic() - t0)
+        attempts.append(a)
+        running.append(a)
+
+    launch(None)
+    winner = None
+    while winner is None:
+        timeout = None
+        if config.LLM_HEDGE and len(attempts) < len(queue) and len(running) < config.LLM_MAX_PARALLEL:
+            latest = running[-1]
+            timeout = max(0.0, latest.started + hedge_delay(latest.model, stream) - time.monotonic())
+        done, _ = await asyncio.wait([a.ready for a in running], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            launch("hedges")
+            continue
+        for a in [a for a in running if a.ready.done()]:
+            if a.ready.cancelled() or a.ready.exception() is not None:
+                last_error = a.ready.exception() if not a.ready.cancelled() else asyncio.CancelledError()
+                _stats(a.model)["errors"] += 1
+                logging.warning("LLM: %s failed: %r", a.model, last_error)
+                running.remove(a)
+            elif winner is None:
+                winner = a
+        if winner is None and not running:
+            if len(attempts) == len(queue):
+                raise last_error
+            launch("fallbacks")
+
+    elapsed = time.monotonic() - t0
+    for a in running:
+        if a is not winner:
+            a.task.cancel()
+            ran = time.monotonic() - a.started
+            # RU: Запущенная раньше проигравшая ждала бы ещё — оцениваем выигрыш по её истории
+            if a.started < winner.started:
+                _stats(winner.model)["saved_s"] += _expected_extra(a.model, stream, ran)
+            _cut_window(a.model, stream).append(ran)
+    st = _stats(winner.model)
+    st["wins"] += 1
+    if winner is not attempts[0] and attempts[0] in running:
+        st["hedge_wins"] += 1
+    logging.info("LLM: answer from %s in %.2fs (%d attempts)", winner.model, elapsed, len(attempts))
+    if stream:
+        winner.on_delta = on_delta
+        if winner.text:
+            try:
+                await on_delta(winner.text)
+            except Exception:
+                logging.exception("stream: on_delta callback failed")
+    return await winner.task
+
+
+def stats() -> dict:
+    """RU: По моделям: запросы, ошибки, победы (в т.ч. хеджем), p50/p95 задержки, сэкономлено (оценка)."""
+    out = {}
+    for model, st in _STATS.items():
+        lat = [*_window(model, False), *_window(model, True)]
+        out[model] = {
+            **st,
+            "win_rate": st["wins"] / st["requests"] if st["requests"] else 0.0,
+            "p50_s": http_pool.quantile(lat, 0.5),
+            "p95_s": http_pool.quantile(lat, 0.95),
+        }
+    return out
@@ -0,0 +1,143 @@
+# llm_scheduler.py
+# RU: Планировщик запросов к модели: общий лимит одновременных запросов, очередь
+# с круговой очерёдностью по чатам (один шумный чат не вытесняет остальные),
+# приоритет личных сообщений над группами и отказ «занято» при переполнении/долгом ожидании.
+import asyncio
+import contextlib
+import logging
+import time
+from collections import OrderedDict, deque
+
+import config
+import http_pool
+
+DM = "dm"
+GROUP = "group"
+
+
+class Busy(RuntimeError):
+    """RU: Очередь переполнена или ожидание превысило лимит — запрос к модели не выполнялся."""
+
+
+# RU: класс -> (чат -> очередь ожидающих); порядок чатов в OrderedDict и есть круговая очерёдность
+_QUEUES: dict[str, "OrderedDict[int, deque[asyncio.Future]]"] = {DM: OrderedDict(), GROUP: OrderedDict()}
+_RUNNING = 0
+_WAITS: dict[str, deque] = {}
+_STATS = {"admitted": 0, "queued": 0, "shed_full": 0, "shed_wait": 0, "max_depth": 0}
+
+
+def depth(cls: str | None = None) -> int:
+    """RU: Сколько запросов ждёт в очереди (всего или по классу dm/group)."""
+    classes = [cls] if cls else list(_QUEUES)
+    return sum(len(q) for c in classes for q in _QUEUES[c].values())
+
+
+def _wait_limit(cls: str) -> float:
+    return config.LLM_QUEUE_WAIT_DM if cls == DM else config.LLM_QUEUE_WAIT_GROUP
+
+
+def _record_wait(cls: str, seconds: float) -> None:
+    _WAITS.setdefault(cls, deque(maxlen=config.LLM_QUEUE_WAIT_WINDOW)).append(seconds)
+
+
+def _dispatch() -> None:
+    """RU: Отдаёт освободившиеся слоты: сначала личкам, внутри класса — следующему чату по кругу."""
+    global _RUNNING
+    while _RUNNING < config.LLM_MAX_CONCURRENT:
+        for cls in (DM, GROUP):
+            chats = _QUEUES[cls]
+            if chats:
+                break
+        else:
+            return
+        chat_id, waiters = next(iter(chats.items()))
+        fut = waiters.popleft()
+        if waiters:
+            chats.move_to_end(chat_id)  # RU: чат уходит в конец круга
+        else:
+            del chats[chat_id]
+        if fut.done():
+            continue
+        _RUNNING += 1
+        fut.set_result(None)
+
+
+def _remove(cls: str, chat_id: int, fut: asyncio.Future) -> None:
+    waiters = _QUEUES[cls].get(chat_id)
+    if waiters is None:
+        return
+    try:
+        waiters.remove(fut)
+    except ValueError:
+        return
+    if not waiters:
+        del _QUEUES[cls][chat_id]
+
+
+async def _acquire(chat_id: int, cls: str) -> None:
+    global _RUNNING
+    t0 = time.monotonic()
+    if _RUNNING < config.LLM_MAX_CONCURRENT and not depth():
+        _RUNNING += 1
+        _STATS["admitted"] += 1
+        _record_wait(cls, 0.0)
+        return
+    waiters = _QUEUES[cls].get(chat_id)
+    if depth() >= config.LLM_QUEUE_MAX or (waiters and len(waiters) >= config.LLM_QUEUE_PER_CHAT):
+        _STATS["shed_full"] += 1
+        logging.warning("LLM queue: busy for chat %s (%s), depth %d", chat_id, cls, depth())
+        raise Busy("queue is full")
+    fut = asyncio.get_running_loop().create_future()
+    _QUEUES[cls].setdefault(chat_id, deque()).append(fut)
+    _STATS["queued"] += 1
+    _STATS["max_depth"] = max(_STATS["max_depth"], depth())
+    try:
+        await asyncio.wait_for(asyncio.shield(fut), _wait_limit(cls))
+    except asyncio.TimeoutError:
+        _remove(cls, chat_id, fut)
+        if fut.done() and not fut.cancelled():
+            # RU: Слот выдан одновременно с таймаутом — возвращаем его следующему
+            _release()
+        _STATS["shed_wait"] += 1
+        logging.warning("LLM queue: chat %s (%s) waited %.1fs, giving up", chat_id, cls, time.monotonic() - t0)
+        raise Busy("queue wait exceeded")
+    except asyncio.CancelledError:
+        _remove(cls, chat_id, fut)
+        if fut.done() and not fut.cancelled():
+            _release()
+        else:
+            fut.cancel()
+        raise
+    _STATS["admitted"] += 1
+    _record_wait(cls, time.monotonic() - t0)
+
+
+def _release() -> None:
+    global _RUNNING
+    _RUNNING -= 1
+    _dispatch()
+
+
+@contextlib.asynccontextmanager
+async def slot(chat_id: int, is_group: bool):
+    """RU: Слот для запроса к модели; ждёт в очереди чата или бросает Busy."""
+    cls = GROUP if is_group else DM
+    await _acquire(chat_id, cls)
+    try:
+        yield
+    finally:
+        _release()
+
+
+def stats() -> dict:
+    """RU: Выполняется сейчас, глубина очередей, ожидание p50/p95 (сек) и отказы."""
+    out = {"running": _RUNNING, "limit": config.LLM_MAX_CONCURRENT, "depth": depth(), **_STATS}
+    for cls in (DM, GROUP):
+        waits = _WAITS.get(cls, ())
+        out[cls] = {
+            "depth": depth(cls),
+            "chats": len(_QUEUES[cls]),
+            "wait_p50": http_pool.quantile(waits, 0.5) or 0.0,
+            "wait_p95": http_pool.quantile(waits, 0.95) or 0.0,
+        }
+    return out
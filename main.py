@@ -5,7 +5,7 @@ import logging
 import traceback
 
 from bot_init import bot, dp
-import config, rag, mc, utils, handlers, handlers_helpers # испорт всего-всего
+import config, rag, mc, utils, handlers, handlers_helpers, http_pool # испорт всего-всего
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -16,13 +16,34 @@ async def on_startup():
         logging.info(f"Bot username: @{(me.username or '').lower()}")
     except Exception:
         logging.exception("Failed to get bot username on startup")
+    try:
+        await http_pool.open_clients()
+    except Exception:
+        logging.exception("HTTP: failed to open upstream pools")
+    try:
+        rag.load_query_cache()
+    except Exception:
+        logging.exception("RAG: failed to load query cache")
     try:
         if hasattr(rag, "_ensure_rag_index"):
             await rag._ensure_rag_index()
     except Exception:
         logging.exception("RAG: failed to ensure index on startup")
+    try:
+        rag.start_kb_watcher()
+    except Exception:
+        logging.exception("RAG: failed to start kb watcher")
 
 async def shutdown():
+    try:
+        await rag.stop_kb_watcher()
+    except Exception:
+        logging.exception("RAG: failed to stop kb watcher")
+    try:
+        rag.save_query_cache()
+    except Exception:
+        logging.exception("RAG: failed to save query cache")
+
     try:
         # если у openai-клиента есть aclose/close — корректно закроем
         from bot_init import openai_client  # если openai_client объявлен в bot_init
@@ -41,6 +62,11 @@ async def shutdown():
     except Exception:
         logging.exception("Error closing openai client")
 
+    try:
+        await http_pool.close_clients()
+    except Exception:
+        logging.exception("HTTP: failed to close upstream pools")
+
     try:
         await bot.session.close()
     except Exception:
@@ -54,7 +80,8 @@ async def main():
     logging.info("Handlers imported; starting polling")
 
     try:
-        await dp.start_polling(bot)
+        # RU: chat_member не приходит по умолчанию — запрашиваем все типы, на которые есть хендлеры
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     except Exception as e:
         logging.exception("Fatal polling error: %s", e)
         traceback.print_exc()
@@ -6,15 +6,14 @@ from typing import Optional, Dict, Any
 from urllib.parse import quote_plus
 import time
 import config
+import http_pool
+import resilience
 import json
 
 # простое в памяти кэширование: key -> (ts, value)
 _MB_CACHE: Dict[str, tuple[float, Optional[Dict[str, Any]]]] = {}
 _MB_CACHE_TTL = 20.0  # seconds, настраиваемо
 
-# параметры повторов/таймаутов (подобно mc.py)
-_HTTP_TIMEOUT = 10.0
-
 logger = logging.getLogger(__name__)
 
 
@@ -32,16 +31,22 @@ async def _fetch_json_from_api(nick: str) -> Optional[Dict[str, Any]]:
     nick_esc = quote_plus(nick, safe="")  # RU: гарантируем URL-безопасность ника
     url = f"https://{host}/api/name/{nick_esc}"
 
+    async def _get() -> httpx.Response:
+        r = await http_pool.request("minebridge", "GET", url)
+        r.raise_for_status()
+        return r
+
     try:
-        async with httpx.AsyncClient(timeout=_HTTP_TIMEOUT) as client:
-            r = await client.get(url)
-            r.raise_for_status()
-            try:
-                return r.json()
-            except Exception:
-                # RU: JSON может быть некорректным — логируем и возвращаем None
-                logger.exception("mb_api: failed to parse JSON for nick %s", nick)
-                return None
+        r = await resilience.call("minebridge", _get)
+        try:
+            return r.json()
+        except Exception:
+            # RU: JSON может быть некорректным — логируем и возвращаем None
+            logger.exception("mb_api: failed to parse JSON for nick %s", nick)
+            return None
+    except resilience.CircuitOpen as e:
+        logger.warning("mb_api: skipped for %s: %s", nick, e)
+        return None
     except httpx.HTTPStatusError as e:
         status = getattr(e.response, "status_code", None)
         body = (getattr(e.response, "text", "") or "")[:500]
@@ -5,6 +5,8 @@ import httpx
 import re
 
 import config
+import http_pool
+import resilience
 import utils
 
 _MC_STATUS_CACHE = {}
@@ -18,23 +20,25 @@ async def fetch_status() -> dict:
 
     url = f"https://api.mcsrvstat.us/3/{config.MC_SERVER_HOST}"
 
-    while True:
-        try:
-            async with httpx.AsyncClient(timeout=10) as s:
-                r = await s.get(url)
-                r.raise_for_status()
-                data = r.json()
-                _MC_STATUS_CACHE[config.MC_SERVER_HOST] = (now, data)
-                return data
-            
-        except httpx.HTTPStatusError as e:
-            body = (e.response.text or "")[:300]
-            logging.exception(f"MC API HTTP {e.response.status_code}: {body}")
-            return {}
-        
-        except Exception as e:
-            logging.exception(f"MC API request failed: {e}")
-            return {}
+    async def _get() -> dict:
+        r = await http_pool.request("mcsrvstat", "GET", url)
+        r.raise_for_status()
+        return r.json()
+
+    try:
+        data = await resilience.call("mcsrvstat", _get)
+        _MC_STATUS_CACHE[config.MC_SERVER_HOST] = (now, data)
+        return data
+    except resilience.CircuitOpen as e:
+        logging.warning(f"MC API skipped: {e}")
+        return {}
+    except httpx.HTTPStatusError as e:
+        body = (e.response.text or "")[:300]
+        logging.exception(f"MC API HTTP {e.response.status_code}: {body}")
+        return {}
+    except Exception as e:
+        logging.exception(f"MC API request failed: {e}")
+        return {}
 
 def format_status_text(payload: dict) -> str:
     """RU: Формирует человекочитаемое описание статуса Minecraft-сервера."""
@@ -8,11 +8,14 @@ import re
 import uuid
 from urllib.parse import urlparse, unquote
 import random
+import time
 
 import httpx
 
 from config import PIXABAY_API_KEY
 import config
+import html_edit
+import http_pool
 
 
 PHOTO_TAG_RE = re.compile(r"\[\[photo:([^\]]+)\]\]", re.IGNORECASE)
@@ -24,11 +27,12 @@ _IMAGE_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
     "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
 }
-_IMAGE_TIMEOUT = httpx.Timeout(15.0, connect=10.0, read=15.0)
 _ALLOWED_IMAGE_EXTS = {".jpg", ".png", ".gif", ".webp"}
 _IMAGE_RESULT_ATTEMPTS = 3
 _PIXABAY_API_URL = "https://pixabay.com/api/"
 _PIXABAY_LANG = "ru"
+_PARTIAL_MEDIA_RE = re.compile(r"\[\[[^\]]*\]?$")
+_STREAM_PAGE = 3900  # RU: символов исходного текста на сообщение при потоковом выводе (запас до 4096)
 
 
 
@@ -88,7 +92,7 @@ def _build_image_filename(query: str, url: str, content_type: str | None) -> str
     return f"{base}_{uuid.uuid4().hex[:8]}{ext}"
 
 
-async def _fetch_pixabay_hits(client: httpx.AsyncClient, query: str) -> list[dict]:
+async def _fetch_pixabay_hits(query: str) -> list[dict]:
     """RU: Запрашивает список результатов с Pixabay по текстовому запросу."""
     api_key = (PIXABAY_API_KEY or "").strip()
     if not api_key:
@@ -105,7 +109,7 @@ async def _fetch_pixabay_hits(client: httpx.AsyncClient, query: str) -> list[dic
         "order": "popular",
     }
     try:
-        resp = await client.get(_PIXABAY_API_URL, params=params)
+        resp = await http_pool.request("pixabay", "GET", _PIXABAY_API_URL, params=params, headers=_IMAGE_HEADERS)
         resp.raise_for_status()
     except httpx.HTTPStatusError as exc:
         logging.warning("image search results failed for %s: %s", query, exc)
@@ -138,49 +142,48 @@ async def _search_image_online(query: str) -> BufferedInputFile | None:
         logging.warning("image search skipped for %s: missing PIXABAY_API_KEY", q)
         return None
     try:
-        async with httpx.AsyncClient(headers=_IMAGE_HEADERS, timeout=_IMAGE_TIMEOUT, follow_redirects=True) as client:
-            for attempt in range(_IMAGE_RESULT_ATTEMPTS):
-                hits = await _fetch_pixabay_hits(client, q)
-                if not hits:
-                    if attempt < _IMAGE_RESULT_ATTEMPTS - 1:
-                        await asyncio.sleep(0.5 + attempt * 0.5)
-                        continue
-                    return None
-                random.shuffle(hits)
-                for item in hits:
-                    image_url = (
-                        item.get("largeImageURL")
-                        or item.get("fullHDURL")
-                        or item.get("imageURL")
-                        or item.get("webformatURL")
-                        or item.get("previewURL")
-                    )
-                    if not image_url:
-                        continue
-                    declared_size = item.get("imageSize")
-                    if declared_size:
-                        try:
-                            if int(declared_size) > _MAX_IMAGE_BYTES:
-                                logging.debug("image search: skip %s (declared size %s bytes)", image_url, declared_size)
-                                continue
-                        except (TypeError, ValueError):
-                            pass
+        for attempt in range(_IMAGE_RESULT_ATTEMPTS):
+            hits = await _fetch_pixabay_hits(q)
+            if not hits:
+                if attempt < _IMAGE_RESULT_ATTEMPTS - 1:
+                    await asyncio.sleep(0.5 + attempt * 0.5)
+                    continue
+                return None
+            random.shuffle(hits)
+            for item in hits:
+                image_url = (
+                    item.get("largeImageURL")
+                    or item.get("fullHDURL")
+                    or item.get("imageURL")
+                    or item.get("webformatURL")
+                    or item.get("previewURL")
+                )
+                if not image_url:
+                    continue
+                declared_size = item.get("imageSize")
+                if declared_size:
                     try:
-                        img_resp = await client.get(image_url, headers=_IMAGE_HEADERS)
-                        img_resp.raise_for_status()
-                        content = img_resp.content
-                        if not content:
+                        if int(declared_size) > _MAX_IMAGE_BYTES:
+                            logging.debug("image search: skip %s (declared size %s bytes)", image_url, declared_size)
                             continue
-                        if len(content) > _MAX_IMAGE_BYTES:
-                            logging.debug("image search: skip %s (downloaded %d bytes)", image_url, len(content))
-                            continue
-                        filename = _build_image_filename(q, image_url, img_resp.headers.get("Content-Type"))
-                        return BufferedInputFile(content, filename=filename)
-                    except Exception as exc:
-                        logging.debug("image search download failed for %s: %s", image_url, exc)
+                    except (TypeError, ValueError):
+                        pass
+                try:
+                    img_resp = await http_pool.request("images", "GET", image_url, headers=_IMAGE_HEADERS)
+                    img_resp.raise_for_status()
+                    content = img_resp.content
+                    if not content:
                         continue
-                if attempt < _IMAGE_RESULT_ATTEMPTS - 1:
-                    await asyncio.sleep(0.5 + attempt * 0.5)
+                    if len(content) > _MAX_IMAGE_BYTES:
+                        logging.debug("image search: skip %s (downloaded %d bytes)", image_url, len(content))
+                        continue
+                    filename = _build_image_filename(q, image_url, img_resp.headers.get("Content-Type"))
+                    return BufferedInputFile(content, filename=filename)
+                except Exception as exc:
+                    logging.debug("image search download failed for %s: %s", image_url, exc)
+                    continue
+            if attempt < _IMAGE_RESULT_ATTEMPTS - 1:
+                await asyncio.sleep(0.5 + attempt * 0.5)
         return None
     except Exception:
         logging.exception("image search failed for query: %s", q)
@@ -284,3 +287,105 @@ async def long_text(msg: types.Message, user_msg: types.Message, text: str):
             await msg.delete()
         except Exception:
             pass
+
+
+def _split_point(text: str, start: int, limit: int) -> int:
+    """RU: Где закончить страницу потокового ответа: по переносу строки или пробелу, не внутри тега."""
+    end = start + limit
+    cut = text.rfind("\n", start, end)
+    if cut <= start + limit // 2:
+        cut = text.rfind(" ", start, end)
+    if cut <= start + limit // 2:
+        cut = end
+    lt, gt = text.rfind("<", start, cut), text.rfind(">", start, cut)
+    if lt > gt:
+        cut = lt
+    media = text.rfind("[[", start, cut)
+    if media != -1 and text.find("]]", media, cut) == -1:
+        cut = media
+    return cut if cut > start else end
+
+
+def _visible(text: str) -> tuple[str, str]:
+    """RU: Что показать во время генерации: без медиа-тегов, с закрытыми тегами HTML."""
+    text = _PARTIAL_MEDIA_RE.sub("", MEDIA_TAG_RE.sub("", text))
+    return html_edit.close_partial(text)
+
+
+class StreamEditor:
+    """RU: Показывает ответ модели по мере генерации, правя сообщение-заглушку.
+
+    Правки идут не чаще interval секунд (лимиты Telegram); первый видимый текст
+    показывается сразу. Когда страница переполняется, она фиксируется и текст
+    продолжается в новом сообщении с переоткрытыми тегами. Медиа-теги
+    отправляются в finish(), вместе с окончательным текстом.
+    """
+
+    def __init__(self, msg: types.Message, user_msg: types.Message, interval: float):
+        self.msg = msg
+        self.user_msg = user_msg
+        self.interval = interval
+        self.raw = ""
+        self.page_start = 0
+        self.reopen = ""      # RU: открывающие теги, перенесённые с прошлой страницы
+        self.shown = ""
+        self.last_edit = 0.0
+        self.first_visible: float | None = None
+        self.started = time.monotonic()
+        self._task: asyncio.Task | None = None
+
+    async def update(self, text: str) -> None:
+        """RU: Новый накопленный текст ответа; правка запускается в фоне, если пора."""
+        self.raw = text
+        if self._task is not None and not self._task.done():
+            return
+        if self.shown and time.monotonic() - self.last_edit < self.interval:
+            return
+        self._task = asyncio.create_task(self._render())
+
+    async def _edit(self, text: str) -> None:
+        """RU: Правит текущее сообщение; ошибки (например, «not modified») не критичны."""
+        try:
+            await self.msg.edit_text(text)
+            self.shown = text
+        except Exception as e:
+            logging.debug("stream: edit failed: %s", e)
+
+    async def _render(self) -> None:
+        """RU: Фиксирует переполненные страницы и показывает текущий хвост ответа."""
+        raw = self.raw
+        while len(raw) - self.page_start > _STREAM_PAGE:
+            cut = _split_point(raw, self.page_start, _STREAM_PAGE)
+            page, reopen = _visible(self.reopen + raw[self.page_start:cut])
+            if page.strip():
+                await self._edit(page)
+                try:
+                    self.msg = await self.user_msg.answer("⏳")
+                    self.shown = ""
+                except Exception:
+                    logging.exception("stream: failed to start a new message")
+                    return
+            self.page_start, self.reopen = cut, reopen
+        text, _ = _visible(self.reopen + raw[self.page_start:])
+        if text.strip() and text != self.shown:
+            await self._edit(text)
+            if self.first_visible is None:
+                self.first_visible = time.monotonic()
+                logging.info("stream: first text visible after %.2fs", self.first_visible - self.started)
+        self.last_edit = time.monotonic()
+
+    async def finish(self, answer: str | None) -> None:
+        """RU: Окончательный ответ: текст текущей страницы и медиа-теги через long_text."""
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception:
+                logging.exception("stream: last edit failed")
+        if self.page_start == 0 or not answer:
+            await long_text(self.msg, self.user_msg, answer)
+            return
+        # RU: Часть ответа уже зафиксирована на прошлых страницах — дошлём остаток и их медиа
+        done = self.raw[:self.page_start]
+        media = "".join(m.group(0) for m in MEDIA_TAG_RE.finditer(done))
+        rest = html_edit.remove(self.reopen + self.raw[self.page_start:])
+        await long_text(self.msg, self.user_msg, rest + media)
@@ -1,44 +1,256 @@
 # rag.py
 import json
+import os
 import asyncio
+import hashlib
+import shutil
+import time
 from pathlib import Path
+from typing import Awaitable, Callable, NamedTuple
+from collections.abc import Sequence
+from collections import OrderedDict
+import re
 import numpy as np
 import logging
 import httpx
-from datetime import *
+from datetime import datetime
 import config
 import utils
 import mc
 from mb_api import fetch_player_by_nick
+from vecstore import VecStore, ChunkTable
+import vecstore
+import ann
+import bm25
+import chunker
+import intent
+import http_pool
+import resilience
 
-RAG_CHUNKS = []   # [{id, file, text, mtime}]
-RAG_VECS = None
+try:
+    from watchfiles import awatch  # RU: inotify/FSEvents, если пакет установлен
+except ImportError:
+    awatch = None
+
+RAG_CHUNKS = []   # [{id, file, text, mtime, hash, fhash}] или ChunkTable (зеркало RAG_SNAPSHOT)
+RAG_VECS: VecStore | None = None
 RAG_LOADED = False
-RAG_LOCK = asyncio.Lock()
+RAG_LOCK = asyncio.Lock()   # RU: сериализует загрузку/сборку индекса; search её не берёт
+
+CURRENT_FILE = "CURRENT"    # RU: указатель на актуальную версию индекса в RAG_INDEX_DIR
+
+# RU: Колбэк прогресса сборки: (этап scan|embed|save, сделано, всего)
+Progress = Callable[[str, int, int], Awaitable[None]]
+
+
+class RagSnapshot(NamedTuple):
+    """RU: Неизменяемый снимок индекса, который читает search без блокировок."""
+    chunks: Sequence
+    vecs: VecStore | None
+    index: object = None  # RU: бэкенд поиска из ann (brute / ivf)
+    lexical: bm25.BM25Index | None = None
+    files: dict = {}      # RU: путь -> mtime просканированных файлов базы (и тех, что не дали чанков)
+    version: int = 0
+
+
+class RagContext(NamedTuple):
+    """RU: Собранный контекст для модели и сведения о нём (для кэша ответов)."""
+    text: str
+    dynamic: bool = False               # RU: ответ зависит от статуса сервера или данных игрока (запрошены, даже если не успели)
+    q_emb: np.ndarray | None = None     # RU: эмбеддинг запроса, если успел к дедлайну
+    kb_version: int = 0                 # RU: версия индекса, по которой искали
+
+
+RAG_SNAPSHOT = RagSnapshot((), None)
+_WATCH_TASK: asyncio.Task | None = None
+
+# RU: Очередь запросов на эмбеддинг поисковых фраз (микро-батчинг)
+_QUERY_PENDING: list[tuple[str, asyncio.Future]] = []
+_QUERY_TIMER: asyncio.Task | None = None
+_BG_TASKS: set[asyncio.Task] = set()
+
+# RU: LRU-кэш эмбеддингов поисковых фраз: нормализованный текст -> float32-вектор
+_QCACHE: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_QCACHE_BYTES = 0
+_QCACHE_STATS = {"hits": 0, "misses": 0, "evicted": 0}
+_QUERY_NORM_RE = re.compile(r"[^\w\s]+")
+
+# RU: Статистика источников контекста: имя -> счётчики и время ответа
+_CTX_STATS: dict[str, dict] = {}
+
+# RU: Эмбеддинги эталонных фраз намерений (считаются один раз) и счётчики решений
+_INTENT_PROTOS: dict[str, np.ndarray] | None = None
+_INTENT_STATS = {name: {"rules": 0, "vector": 0, "skipped": 0} for name in intent.PROTOTYPES}
+
+def _spawn(coro) -> asyncio.Task:
+    """RU: Создаёт фоновую задачу и держит ссылку на неё до завершения."""
+    task = asyncio.create_task(coro)
+    _BG_TASKS.add(task)
+    task.add_done_callback(_BG_TASKS.discard)
+    return task
+
+def _build_snapshot(chunks, vecs: VecStore | None, version: int, files: dict | None = None) -> RagSnapshot:
+    """RU: Готовит снимок индекса: поисковые бэкенды и карту файлов (тяжело — вызывать в потоке).
+
+    files — подпись базы, по которой собирали индекс; без неё (загрузка с диска) берётся из чанков.
+    """
+    chunks = chunks if isinstance(chunks, ChunkTable) else tuple(chunks)
+    if files is None:
+        files = {c["file"]: c.get("mtime", 0.0) for c in chunks}
+    index = None
+    if vecs is not None and len(vecs):
+        index = ann.make_index(
+            vecs,
+            backend=config.RAG_ANN_BACKEND,
+            min_chunks=config.RAG_ANN_MIN_CHUNKS,
+            nlist=config.RAG_IVF_NLIST,
+            nprobe=config.RAG_IVF_NPROBE,
+        )
+    lexical = bm25.BM25Index([c.get("text") or "" for c in chunks]) if config.RAG_HYBRID else None
+    return RagSnapshot(chunks, vecs, index, lexical, files, version)
+
+def _publish_snapshot(snap: RagSnapshot) -> None:
+    """RU: Атомарно подменяет снимок индекса (одно присваивание ссылки в event loop)."""
+    global RAG_SNAPSHOT, RAG_CHUNKS, RAG_VECS
+    RAG_SNAPSHOT = snap
+    RAG_CHUNKS, RAG_VECS = snap.chunks, snap.vecs
+
+async def _report(progress: Progress | None, stage: str, done: int = 0, total: int = 0) -> None:
+    """RU: Сообщает прогресс сборки; ошибки колбэка не мешают сборке."""
+    if progress is None:
+        return
+    try:
+        await progress(stage, done, total)
+    except Exception:
+        logging.exception("RAG: progress callback failed")
+
+class RagIndexError(RuntimeError):
+    """RU: Индекс не удалось собрать целиком (эмбеддинги не получены или не совпали по числу)."""
+
+
+async def _request_embeddings(texts: list[str]) -> list[list[float]]:
+    """RU: Один запрос эмбеддингов к Jina API; ошибки пробрасываются."""
+    r = await http_pool.request(
+        "jina",
+        "POST",
+        "https://api.jina.ai/v1/embeddings",
+        headers={
+            "Authorization": f"Bearer {config.JINA_KEY}",
+            "Accept": "application/json",
+        },
+        json={"model": config.RAG_EMB_MODEL, "input": texts},
+    )
+    r.raise_for_status()
+    payload = r.json()
+    return [item["embedding"] for item in payload["data"]]
 
 async def _embed_batch(texts: list[str]) -> list[list[float]]:
-    """RU: Запрашивает эмбеддинги для пакета строк через Jina API."""
-    while True:
+    """RU: Запрашивает эмбеддинги для пакета строк через Jina API ([] при ошибке)."""
+    try:
+        return await resilience.call("jina", lambda: _request_embeddings(texts))
+    except resilience.CircuitOpen as e:
+        logging.warning("RAG: Jina skipped: %s", e)
+        return []
+    except httpx.HTTPStatusError as e:
+        body = (e.response.text or "")[:500]
+        logging.exception("RAG: Jina HTTP %s, body: %s", e.response.status_code, body)
+        return []
+    except Exception:
+        logging.exception("RAG: Jina embeddings request failed")
+        return []
+
+async def _embed_with_retry(texts: list[str]) -> list[list[float]]:
+    """RU: Эмбеддинги пакета с повторами по общей политике resilience (is_retryable, Retry-After, backoff).
+
+    В отличие от ответа пользователю, сборка индекса дожидается и открытого
+    предохранителя, и долгого Retry-After; после RAG_EMB_RETRIES попыток — RagIndexError.
+    """
+    for attempt in range(config.RAG_EMB_RETRIES):
+        try:
+            vecs = await resilience.call("jina", lambda: _request_embeddings(texts), retries=0)
+            if len(vecs) != len(texts):
+                raise RagIndexError(f"Jina returned {len(vecs)} embeddings for {len(texts)} texts")
+            return vecs
+        except resilience.CircuitOpen as e:
+            delay = e.retry_in
+            error = str(e)
+        except RagIndexError as e:
+            delay = None
+            error = repr(e)
+        except Exception as e:
+            if not resilience.is_retryable(e):
+                if isinstance(e, httpx.HTTPStatusError):
+                    body = (e.response.text or "")[:500]
+                    raise RagIndexError(f"Jina HTTP {e.response.status_code}: {body}") from e
+                raise
+            delay = resilience.retry_after(e)
+            error = f"HTTP {e.response.status_code}" if isinstance(e, httpx.HTTPStatusError) else repr(e)
+        if attempt == config.RAG_EMB_RETRIES - 1:
+            raise RagIndexError(f"embedding batch failed after {config.RAG_EMB_RETRIES} attempts: {error}")
+        if delay is None:
+            delay = resilience.backoff(attempt, config.RAG_EMB_BACKOFF, config.RAG_EMB_BACKOFF_MAX)
+        resilience.breaker("jina").stats["retries"] += 1
+        logging.warning("RAG: embedding batch failed (%s), retry %d in %.1fs", error, attempt + 1, delay)
+        await asyncio.sleep(delay)
+
+def _checkpoint_dir() -> Path:
+    return config.RAG_INDEX_DIR / "partial"
+
+def _load_checkpoints() -> dict[str, np.ndarray]:
+    """RU: Векторы из незавершённой прошлой сборки: хэш чанка -> вектор."""
+    out: dict[str, np.ndarray] = {}
+    d = _checkpoint_dir()
+    if not d.exists():
+        return out
+    for p in d.glob("*.npz"):
         try:
-            async with httpx.AsyncClient(timeout=60) as s:
-                r = await s.post(
-                    "https://api.jina.ai/v1/embeddings",
-                    headers={
-                        "Authorization": f"Bearer {config.JINA_KEY}",
-                        "Accept": "application/json",
-                    },
-                    json={"model": config.RAG_EMB_MODEL, "input": texts},
-                )
-                r.raise_for_status()
-                payload = r.json()
-                return [item["embedding"] for item in payload["data"]]
-        except httpx.HTTPStatusError as e:
-            body = (e.response.text or "")[:500]
-            logging.exception("RAG: Jina HTTP %s, body: %s", e.response.status_code, body)
-            return []
+            with np.load(p, allow_pickle=False) as data:
+                if str(data["model"]) != config.RAG_EMB_MODEL:
+                    continue
+                out.update(zip((str(h) for h in data["hashes"]), data["vecs"]))
         except Exception:
-            logging.exception("RAG: Jina embeddings request failed")
-            return []
+            logging.warning("RAG: skipping broken checkpoint %s", p.name)
+    return out
+
+def _save_checkpoint(hashes: list[str], vecs: list[list[float]]) -> None:
+    """RU: Сохраняет готовый пакет эмбеддингов, чтобы прерванная сборка продолжилась с него."""
+    d = _checkpoint_dir()
+    d.mkdir(parents=True, exist_ok=True)
+    name = _text_hash("".join(hashes))
+    tmp = d / f"{name}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, model=np.array(config.RAG_EMB_MODEL), hashes=np.array(hashes), vecs=np.array(vecs, dtype="float32"))
+    os.replace(tmp, d / f"{name}.npz")
+
+async def _embed_texts(texts: list[str], hashes: list[str], progress: Progress | None = None) -> np.ndarray:
+    """RU: Эмбеддинги для сборки индекса: параллельные пакеты, повторы и чекпоинты.
+
+    Не более RAG_EMB_CONCURRENCY пакетов одновременно; уже посчитанные в прерванной
+    сборке чанки берутся из чекпоинтов. Любой непосчитанный пакет — RagIndexError.
+    """
+    done = _load_checkpoints()
+    todo = [i for i, h in enumerate(hashes) if h not in done]
+    if len(todo) < len(texts):
+        logging.info("RAG: resuming build, %d embeddings from checkpoints", len(texts) - len(todo))
+    sem = asyncio.Semaphore(config.RAG_EMB_CONCURRENCY)
+
+    async def run(batch: list[int]) -> None:
+        async with sem:
+            vecs = await _embed_with_retry([texts[i] for i in batch])
+        batch_hashes = [hashes[i] for i in batch]
+        await asyncio.to_thread(_save_checkpoint, batch_hashes, vecs)
+        done.update(zip(batch_hashes, (np.asarray(v, dtype="float32") for v in vecs)))
+        await _report(progress, "embed", sum(h in done for h in hashes), len(hashes))
+
+    batches = [todo[i:i + config.RAG_EMB_BATCH] for i in range(0, len(todo), config.RAG_EMB_BATCH)]
+    results = await asyncio.gather(*(run(b) for b in batches), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        raise RagIndexError(f"{len(errors)}/{len(batches)} embedding batches failed: {errors[0]}") from errors[0]
+    missing = [h for h in hashes if h not in done]
+    if missing:
+        raise RagIndexError(f"{len(missing)} chunks have no embedding")
+    return np.array([done[h] for h in hashes], dtype="float32").reshape(len(hashes), -1)
 
 def read_text_file(p: Path) -> str:
     """RU: Читает файл базы знаний и нормализует текст в UTF-8 с LF."""
@@ -52,154 +264,789 @@ def read_text_file(p: Path) -> str:
         return ""
     
 
-def split_chunks(text: str, size: int, ov: int) -> list[str]:
-    """RU: Делит исходный текст на перекрывающиеся фрагменты для векторного индекса."""
-    text = text.strip()
-    if not text:
-        return []
-    out, i = [], 0
-    while i < len(text):
-        out.append(text[i:i+size])
-        i += max(1, size - ov)
-    return [c for c in out if c.strip()]
-
-async def _ensure_rag_index():
-    """RU: Загружает кэш индекса или пересобирает его при изменении данных."""
-    global RAG_CHUNKS, RAG_VECS, RAG_LOADED
+def split_chunks(text: str) -> list[str]:
+    """RU: Делит текст файла базы знаний на чанки выбранным в config способом."""
+    if config.RAG_CHUNKER == "fixed":
+        return chunker.split_fixed(text, config.RAG_CHUNK_SIZE, config.RAG_CHUNK_OVERLAP)
+    return chunker.split_markdown(text, config.RAG_CHUNK_TOKENS, config.RAG_CHUNK_OVERLAP_TOKENS)
+
+def _text_hash(text: str) -> str:
+    """RU: Полный SHA-1 текста — адрес содержимого для переиспользования векторов."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _list_kb_files() -> list[Path]:
+    """RU: Возвращает список .txt/.md файлов базы знаний."""
+    kb_files = []
+    if config.KB_DIR.exists():
+        for p in config.KB_DIR.rglob("*"):
+            if p.is_file() and p.suffix.lower() in {".txt", ".md"}:
+                kb_files.append(p)
+    return sorted(kb_files)
+
+def _read_current() -> dict | None:
+    """RU: Читает штамп актуальной версии индекса (CURRENT) или None."""
+    path = config.RAG_INDEX_DIR / CURRENT_FILE
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+def _save_index(chunks: list[dict], store: VecStore) -> int:
+    """RU: Записывает индекс новой версией и атомарно переключает на неё CURRENT.
+
+    Файлы пишутся в каталог vN.tmp, который переименовывается в vN; затем штамп
+    CURRENT заменяется через os.replace. Старые mmap продолжают читать прежнюю
+    версию — полузаписанных данных никто не видит. Возвращает номер версии.
+    """
+    d = config.RAG_INDEX_DIR
+    cur = _read_current()
+    version = (cur["version"] if cur else 0) + 1
+    final, tmp = d / f"v{version}", d / f"v{version}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    store.save(tmp)
+    ChunkTable.save(chunks, tmp)
+    shutil.rmtree(final, ignore_errors=True)
+    os.replace(tmp, final)
+    stamp = {
+        "version": version,
+        "dir": final.name,
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+        "chunks": len(chunks),
+        "dtype": store.dtype,
+        "model": config.RAG_EMB_MODEL,
+    }
+    (d / (CURRENT_FILE + ".tmp")).write_text(json.dumps(stamp, ensure_ascii=False), encoding="utf-8")
+    os.replace(d / (CURRENT_FILE + ".tmp"), d / CURRENT_FILE)
+    # RU: Храним предыдущую версию — её ещё может читать старый снимок
+    for old in d.glob("v*"):
+        if old.is_dir() and old.name not in (final.name, f"v{version - 1}"):
+            shutil.rmtree(old, ignore_errors=True)
+    return version
+
+def _open_index() -> RagSnapshot | None:
+    """RU: Открывает актуальную версию индекса (mmap) и готовит снимок.
+
+    Индексы старых форматов (плоские index.* из RAG_INDEX_DIR или chunks.json/vecs.npy)
+    переносятся в версионный формат.
+    """
+    d = config.RAG_INDEX_DIR
+    cur = _read_current()
+    if cur is None:
+        if vecstore.exists(d):
+            _save_index(list(ChunkTable.load(d)), VecStore.load(d, mmap=False))
+            for name in (vecstore.CODES_FILE, vecstore.SCALES_FILE, vecstore.META_FILE, vecstore.OFFSETS_FILE):
+                (d / name).unlink(missing_ok=True)
+            logging.info("RAG: migrated flat index to versioned layout")
+        elif (d / "chunks.json").exists() and (d / "vecs.npy").exists():
+            chunks = json.loads((d / "chunks.json").read_text(encoding="utf-8"))
+            _save_index(chunks, VecStore.from_float32(np.load(d / "vecs.npy"), config.RAG_VEC_DTYPE))
+            logging.info("RAG: migrated chunks.json/vecs.npy to %s index", config.RAG_VEC_DTYPE)
+        else:
+            return None
+        cur = _read_current()
+    vd = d / cur["dir"]
+    return _build_snapshot(ChunkTable.load(vd), VecStore.load(vd), cur["version"])
+
+def _kb_signature(kb_files: list[Path]) -> dict[str, float]:
+    """RU: Снимок состояния базы знаний: путь -> mtime."""
+    sig = {}
+    for p in kb_files:
+        try:
+            sig[str(p)] = p.stat().st_mtime
+        except OSError:
+            continue
+    return sig
+
+def _kb_changed(sig: dict[str, float]) -> bool:
+    """RU: Сравнивает снимок файлов с метаданными загруженного индекса."""
+    indexed = RAG_SNAPSHOT.files
+    if indexed.keys() != sig.keys():
+        return True
+    return any(abs(indexed[f] - m) >= 1e-6 for f, m in sig.items())
+
+def _plan_rebuild(kb_files: list[Path], old: RagSnapshot):
+    """RU: Читает и нарезает базу знаний, решая, какие чанки нужно эмбеддить заново."""
+    # RU: Старые строки матрицы по хэшу текста
+    old_rows: dict[str, int] = {}
+    old_files: dict[str, str] = {}
+    cur = _read_current()
+    same_model = cur is not None and str(cur.get("model")) == config.RAG_EMB_MODEL
+    if old.vecs is not None and not same_model:
+        logging.info("RAG: index was built with another embedding model, re-embedding all chunks")
+    elif old.vecs is not None and len(old.vecs) == len(old.chunks):
+        for i, c in enumerate(old.chunks):
+            old_rows.setdefault(c.get("hash") or _text_hash(c.get("text") or ""), i)
+            if c.get("fhash"):
+                old_files.setdefault(c["file"], c["fhash"])
+
+    all_chunks = []
+    new_pos: list[int] = []
+    files_same = 0
+    sig: dict[str, float] = {}
+    for p in kb_files:
+        txt = read_text_file(p)
+        fhash = _text_hash(txt)
+        m = sig[str(p)] = p.stat().st_mtime
+        if old_files.get(str(p)) == fhash:
+            files_same += 1
+        parts = split_chunks(chunker.split_front_matter(txt)[1])
+        for i, ch in enumerate(parts):
+            cid = f"{utils.hash(str(p))}:{i}"
+            h = _text_hash(ch)
+            all_chunks.append({"id": cid, "file": str(p), "text": ch, "mtime": m, "hash": h, "fhash": fhash})
+            if h not in old_rows:
+                new_pos.append(len(all_chunks) - 1)
+    unchanged = not new_pos and len(old.chunks) == len(all_chunks) and all(a == b for a, b in zip(old.chunks, all_chunks))
+    return all_chunks, new_pos, old_rows, files_same, unchanged, sig
+
+def _assemble_index(all_chunks: list[dict], new_pos: list[int], new_vecs: np.ndarray,
+                    old_rows: dict[str, int], old_vecs: VecStore | None, sig: dict[str, float]) -> RagSnapshot:
+    """RU: Собирает матрицу из новых и переиспользованных векторов, пишет версию и готовит снимок."""
+    dim = new_vecs.shape[1] if len(new_vecs) else old_vecs.dim
+    V = np.zeros((len(all_chunks), dim), dtype="float32")
+    if len(new_vecs):
+        norms = np.linalg.norm(new_vecs, axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        V[new_pos] = new_vecs / norms
+    new_set = set(new_pos)
+    reuse_pos = [j for j in range(len(all_chunks)) if j not in new_set]
+    if reuse_pos:
+        V[reuse_pos] = old_vecs.rows([old_rows[all_chunks[j]["hash"]] for j in reuse_pos])
+
+    if len(V) != len(all_chunks):
+        raise RagIndexError(f"{len(V)} vectors for {len(all_chunks)} chunks")
+    version = _save_index(all_chunks, VecStore.from_float32(V, config.RAG_VEC_DTYPE))
+    shutil.rmtree(_checkpoint_dir(), ignore_errors=True)
+    vd = config.RAG_INDEX_DIR / f"v{version}"
+    return _build_snapshot(ChunkTable.load(vd), VecStore.load(vd), version, sig)
+
+async def _rebuild_incremental(kb_files: list[Path], progress: Progress | None = None) -> dict:
+    """RU: Собирает теневой индекс, эмбеддя только новые/изменённые чанки, и подменяет текущий.
+
+    Файлы сравниваются по хэшу содержимого, чанки — по хэшу текста; строки
+    текущего индекса переиспользуются для всего, что не менялось. Чтение,
+    сборка и запись идут в потоках, поиск всё это время работает по старому снимку.
+    Возвращает статистику {reused, added, removed, chunks, version}; если эмбеддинги
+    получить не удалось — RagIndexError, текущий индекс при этом не меняется.
+    """
+    global RAG_LOADED
+    old = RAG_SNAPSHOT
+    await _report(progress, "scan")
+    all_chunks, new_pos, old_rows, files_same, unchanged, sig = await asyncio.to_thread(_plan_rebuild, kb_files, old)
+    new_texts = [all_chunks[j]["text"] for j in new_pos]
+    new_hashes = {c["hash"] for c in all_chunks}
+    removed = len(set(old_rows) - new_hashes)
+
+    new_vecs = np.zeros((0, 0), dtype="float32")
+    if new_texts:
+        await _report(progress, "embed", 0, len(new_texts))
+        new_vecs = await _embed_texts(new_texts, [all_chunks[j]["hash"] for j in new_pos], progress)
+        if old_rows and new_vecs.shape[1] != old.vecs.dim:
+            # RU: Размерность эмбеддингов сменилась — старые строки несовместимы, эмбеддим всё
+            # (уже полученные векторы возьмутся из чекпоинтов)
+            logging.warning("RAG: embedding dim %d != index dim %d, re-embedding all chunks",
+                            new_vecs.shape[1], old.vecs.dim)
+            old_rows = {}
+            new_pos = list(range(len(all_chunks)))
+            new_texts = [c["text"] for c in all_chunks]
+            new_vecs = await _embed_texts(new_texts, [c["hash"] for c in all_chunks], progress)
+
+    stats = {
+        "reused": len(all_chunks) - len(new_texts),
+        "added": len(new_texts),
+        "removed": removed,
+        "chunks": len(all_chunks),
+        "version": old.version,
+    }
+
+    if unchanged:
+        # RU: Запоминаем подпись, иначе файл без чанков (или только mtime) будет «меняться» вечно
+        _publish_snapshot(old._replace(files=sig))
+        RAG_LOADED = True
+        logging.info("RAG: index v%d is up to date (%d chunks)", old.version, len(all_chunks))
+        return stats
+
+    if not all_chunks:
+        _publish_snapshot(RagSnapshot((), None, files=sig, version=old.version))
+        RAG_LOADED = True
+        logging.warning("RAG: no chunks produced (empty kb?)")
+        return stats
+
+    await _report(progress, "save", len(all_chunks), len(all_chunks))
+    snap = await asyncio.to_thread(_assemble_index, all_chunks, new_pos, new_vecs, old_rows, old.vecs, sig)
+    _publish_snapshot(snap)
+    RAG_LOADED = True
+    stats["version"] = snap.version
+    logging.info(
+        "RAG: index v%d: %d chunks from %d files (%d unchanged): reused %d, added %d, removed %d",
+        snap.version, stats["chunks"], len(kb_files), files_same, stats["reused"], stats["added"], stats["removed"],
+    )
+    return stats
+
+async def _ensure_rag_index(force: bool = False, progress: Progress | None = None) -> dict | None:
+    """RU: Загружает кэш индекса и инкрементально обновляет его при изменении данных.
+
+    force=True пропускает быструю проверку по mtime и сверяет базу по содержимому.
+    Возвращает статистику переиндексации или None, если индекс актуален.
+    """
+    global RAG_LOADED
     async with RAG_LOCK:
         config.RAG_INDEX_DIR.mkdir(parents=True, exist_ok=True)
-        meta_path = config.RAG_INDEX_DIR / "chunks.json"
-        vecs_path = config.RAG_INDEX_DIR / "vecs.npy"
 
-        if meta_path.exists() and vecs_path.exists() and not RAG_LOADED:
+        if not RAG_LOADED:
             try:
-                RAG_CHUNKS = json.loads(meta_path.read_text(encoding="utf-8"))
-                RAG_VECS = np.load(vecs_path)
-                RAG_LOADED = True
-                logging.info("RAG: loaded cache with %d chunks", len(RAG_CHUNKS))
+                snap = await asyncio.to_thread(_open_index)
+                if snap is not None:
+                    _publish_snapshot(snap)
+                    RAG_LOADED = True
+                    logging.info("RAG: loaded index v%d with %d chunks (%s)", snap.version, len(snap.chunks), snap.vecs.dtype)
             except Exception:
                 logging.exception("RAG: failed to load cache, rebuilding")
 
-        kb_files = []
-        if config.KB_DIR.exists():
-            for p in config.KB_DIR.rglob("*"):
-                if p.is_file() and p.suffix.lower() in {".txt", ".md"}:
-                    kb_files.append(p)
+        kb_files = await asyncio.to_thread(_list_kb_files)
+        sig = await asyncio.to_thread(_kb_signature, kb_files)
+        need_rebuild = force or (not RAG_LOADED) or _kb_changed(sig)
 
-        known_paths = {c["file"] for c in RAG_CHUNKS}
-        kb_paths = {str(p) for p in kb_files}
+        if not need_rebuild:
+            return None
 
-        need_rebuild = (not RAG_LOADED) or (known_paths != kb_paths)
+        logging.info("RAG: updating index...")  # RU: Инкрементальное обновление индекса
+        return await _rebuild_incremental(kb_files, progress)
 
-        if not need_rebuild:
-            # RU: Проверяем время модификации файлов
-            for p in kb_files:
-                m = p.stat().st_mtime
-                if not any(c["file"] == str(p) and abs(c.get("mtime", 0.0) - m) < 1e-6 for c in RAG_CHUNKS):
-                    need_rebuild = True
-                    break
+async def _watch_kb_polling(interval: float) -> None:
+    """RU: Периодически сравнивает mtime файлов базы знаний с индексом."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            sig = await asyncio.to_thread(lambda: _kb_signature(_list_kb_files()))
+            if _kb_changed(sig):
+                logging.info("RAG: kb change detected, updating index")
+                await _ensure_rag_index()
+        except Exception:
+            logging.exception("RAG: kb watcher iteration failed")
 
-        if not need_rebuild:
-            return
-
-        logging.info("RAG: (re)building index...")  # RU: Пересборка индекса
-        all_chunks = []
-        all_texts = []
-        for p in kb_files:
-            txt = read_text_file(p)
-            parts = split_chunks(txt, config.RAG_CHUNK_SIZE, config.RAG_CHUNK_OVERLAP)
-            m = p.stat().st_mtime
-            for i, ch in enumerate(parts):
-                cid = f"{utils.hash(str(p))}:{i}"
-                all_chunks.append({"id": cid, "file": str(p), "text": ch, "mtime": m})
-                all_texts.append(ch)
+async def _watch_kb_inotify() -> None:
+    """RU: Ждёт событий файловой системы через watchfiles и обновляет индекс."""
+    async for _changes in awatch(config.KB_DIR, debounce=config.RAG_WATCH_DEBOUNCE_MS):
+        try:
+            logging.info("RAG: kb change detected, updating index")
+            await _ensure_rag_index()
+        except Exception:
+            logging.exception("RAG: kb watcher iteration failed")
+
+def start_kb_watcher() -> asyncio.Task | None:
+    """RU: Запускает фоновую задачу, следящую за изменениями базы знаний."""
+    global _WATCH_TASK
+    if not config.RAG_ENABLED:
+        return None
+    if _WATCH_TASK is not None and not _WATCH_TASK.done():
+        return _WATCH_TASK
+    if awatch is not None and config.KB_DIR.exists():
+        _WATCH_TASK = asyncio.create_task(_watch_kb_inotify())
+        logging.info("RAG: kb watcher started (watchfiles)")
+    else:
+        _WATCH_TASK = asyncio.create_task(_watch_kb_polling(config.RAG_WATCH_INTERVAL))
+        logging.info("RAG: kb watcher started (polling every %ss)", config.RAG_WATCH_INTERVAL)
+    return _WATCH_TASK
 
+async def stop_kb_watcher() -> None:
+    """RU: Останавливает фоновую задачу наблюдения за базой знаний."""
+    global _WATCH_TASK
+    task, _WATCH_TASK = _WATCH_TASK, None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logging.exception("RAG: kb watcher crashed")
+
+async def _send_query_batch(batch: list[tuple[str, asyncio.Future]]) -> None:
+    """RU: Отправляет пачку поисковых фраз одним запросом и раздаёт векторы ожидающим."""
+    # RU: Отменённые ожидания (контекст уже не нужен) в запрос не берём
+    batch = [(t, fut) for t, fut in batch if not fut.done()]
+    if not batch:
+        return
+    texts = list(dict.fromkeys(t for t, _ in batch))
+    try:
+        vecs = await _embed_batch(texts)
+    except Exception as e:
         vecs = []
-        for i in range(0, len(all_texts), config.RAG_EMB_BATCH):
-            batch = all_texts[i:i+config.RAG_EMB_BATCH]
-            vecs.extend(await _embed_batch(batch))
-
-        if vecs:
-            V = np.array(vecs, dtype="float32")
-            norms = np.linalg.norm(V, axis=1, keepdims=True)
-            norms[norms == 0.0] = 1.0
-            V /= norms
-            RAG_CHUNKS = all_chunks
-            RAG_VECS = V
-            meta_path.write_text(json.dumps(RAG_CHUNKS, ensure_ascii=False, indent=2), encoding="utf-8")
-            np.save(vecs_path, RAG_VECS)
-            RAG_LOADED = True
-            logging.info("RAG: built %d chunks from %d files", len(RAG_CHUNKS), len(kb_files))
-        else:
-            RAG_CHUNKS, RAG_VECS, RAG_LOADED = [], None, True
-            logging.warning("RAG: no chunks produced (empty kb?)")
+        logging.exception("RAG: query batch failed: %s", e)
+    by_text = dict(zip(texts, vecs)) if len(vecs) == len(texts) else {}
+    for text, fut in batch:
+        if not fut.done():
+            fut.set_result(by_text.get(text))
+
+async def _query_timer() -> None:
+    """RU: Ждёт окно склейки и отправляет всё, что накопилось в очереди."""
+    global _QUERY_PENDING, _QUERY_TIMER
+    await asyncio.sleep(config.RAG_QUERY_BATCH_WINDOW)
+    _QUERY_TIMER = None
+    while _QUERY_PENDING:
+        batch = _QUERY_PENDING[:config.RAG_EMB_BATCH]
+        _QUERY_PENDING = _QUERY_PENDING[config.RAG_EMB_BATCH:]
+        _spawn(_send_query_batch(batch))
+
+def _normalize_query(text: str) -> str:
+    """RU: Приводит поисковую фразу к ключу кэша: регистр, ё, пунктуация, пробелы."""
+    return " ".join(_QUERY_NORM_RE.sub(" ", bm25.fold(text)).split())
+
+def _qcache_get(key: str) -> np.ndarray | None:
+    """RU: Достаёт вектор из LRU-кэша и обновляет его позицию."""
+    vec = _QCACHE.get(key)
+    if vec is None:
+        _QCACHE_STATS["misses"] += 1
+        return None
+    _QCACHE.move_to_end(key)
+    _QCACHE_STATS["hits"] += 1
+    return vec
+
+def _qcache_put(key: str, emb) -> np.ndarray:
+    """RU: Кладёт нормированный вектор в кэш, вытесняя старые записи сверх лимита памяти."""
+    global _QCACHE_BYTES
+    vec = np.asarray(emb, dtype="float32").reshape(-1)
+    vec = vec / max(float(np.linalg.norm(vec)), 1e-12)
+    vec.flags.writeable = False
+    old = _QCACHE.pop(key, None)
+    if old is not None:
+        _QCACHE_BYTES -= old.nbytes
+    _QCACHE[key] = vec
+    _QCACHE_BYTES += vec.nbytes
+    while _QCACHE and _QCACHE_BYTES > config.RAG_QUERY_CACHE_MAX_BYTES:
+        _, dropped = _QCACHE.popitem(last=False)
+        _QCACHE_BYTES -= dropped.nbytes
+        _QCACHE_STATS["evicted"] += 1
+    return vec
+
+def query_cache_stats() -> dict:
+    """RU: Статистика кэша эмбеддингов запросов: размер, память, попадания/промахи/вытеснения."""
+    return {"size": len(_QCACHE), "bytes": _QCACHE_BYTES, **_QCACHE_STATS}
+
+def save_query_cache() -> None:
+    """RU: Сохраняет кэш эмбеддингов запросов в .rag_cache (порядок LRU сохраняется)."""
+    if not _QCACHE:
+        return
+    try:
+        config.RAG_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+        path = config.RAG_INDEX_DIR / "query_cache.npz"
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                model=np.array(config.RAG_EMB_MODEL),
+                keys=np.array(list(_QCACHE.keys())),
+                vecs=np.stack(list(_QCACHE.values())),
+            )
+        logging.info("RAG: saved %d cached query embeddings", len(_QCACHE))
+    except Exception:
+        logging.exception("RAG: failed to save query cache")
+
+def load_query_cache() -> None:
+    """RU: Загружает сохранённый кэш эмбеддингов запросов (если модель совпадает)."""
+    path = config.RAG_INDEX_DIR / "query_cache.npz"
+    if not path.exists():
+        return
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["model"]) != config.RAG_EMB_MODEL:
+                logging.info("RAG: query cache is for another model, skipping")
+                return
+            for key, vec in zip(data["keys"], data["vecs"]):
+                _qcache_put(str(key), vec)
+        logging.info("RAG: loaded %d cached query embeddings", len(_QCACHE))
+    except Exception:
+        logging.exception("RAG: failed to load query cache")
+
+async def _embed_query(text: str) -> np.ndarray | None:
+    """RU: Эмбеддинг поисковой фразы через общий микро-батч.
+
+    Запросы, пришедшие в течение RAG_QUERY_BATCH_WINDOW (но не больше
+    RAG_EMB_BATCH), уходят в Jina одним запросом; повторы берутся из LRU-кэша.
+    None — эмбеддинг не получен.
+    """
+    global _QUERY_PENDING, _QUERY_TIMER
+    key = _normalize_query(text)
+    cached = _qcache_get(key)
+    if cached is not None:
+        return cached
+    fut = asyncio.get_running_loop().create_future()
+    _QUERY_PENDING.append((text, fut))
+    if len(_QUERY_PENDING) >= config.RAG_EMB_BATCH:
+        batch = _QUERY_PENDING[:config.RAG_EMB_BATCH]
+        _QUERY_PENDING = _QUERY_PENDING[config.RAG_EMB_BATCH:]
+        _spawn(_send_query_batch(batch))
+    elif _QUERY_TIMER is None:
+        _QUERY_TIMER = _spawn(_query_timer())
+    emb = await fut
+    if emb is None:
+        return None
+    return _qcache_put(key, emb)
+
+def _vector_rank(snap: RagSnapshot, q_embs: list, k: int) -> list[list[tuple[int, float]]]:
+    """RU: Векторное ранжирование: [(номер чанка, косинус)] для каждого эмбеддинга запроса."""
+    out: list[list[tuple[int, float]]] = [[] for _ in q_embs]
+    rows = [i for i, e in enumerate(q_embs) if e is not None]
+    if not rows or snap.index is None:
+        return out
+    Q = np.array([q_embs[i] for i in rows], dtype="float32")
+    Q /= np.maximum(np.linalg.norm(Q, axis=1, keepdims=True), 1e-12)
+    I, S = snap.index.search(Q, k)
+    for r, idx, sims in zip(rows, I, S):
+        out[r] = [(int(i), float(sc)) for i, sc in zip(idx, sims) if i >= 0]
+    return out
+
+async def _embed_queries_by_deadline(queries: list[str]) -> list:
+    """RU: Эмбеддинги запросов, успевшие к RAG_EMB_DEADLINE; опоздавшие — None.
+
+    Опоздавшие запросы не отменяются: их результат всё равно попадёт в кэш.
+    Отмена самого поиска отменяет и запросы эмбеддингов.
+    """
+    tasks = [_spawn(_embed_query(q)) for q in queries]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=config.RAG_EMB_DEADLINE)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    return [t.result() if t in done and t.exception() is None else None for t in tasks]
 
 async def search(query: str, k: int = config.RAG_TOP_K):
-    """RU: Возвращает top-k наиболее релевантных фрагментов из базы знаний."""
+    """RU: Возвращает top-k наиболее релевантных фрагментов из базы знаний.
+
+    Читает только текущий снимок индекса: без блокировок и обращений к диску.
+    Актуальность индекса поддерживает фоновый наблюдатель (start_kb_watcher).
+    """
+    return (await search_many([query], k=k))[0]
+
+async def _retrieve(queries: list[str], k: int) -> tuple[RagSnapshot, list[list[tuple[int, float]]]]:
+    """RU: Гибридный поиск по снимку: по каждому запросу top-k [(номер чанка, вес)].
+
+    Векторные и BM25-результаты сливаются через reciprocal-rank fusion (вес — RRF).
+    Если эмбеддинг не успел к RAG_EMB_DEADLINE или упал, отдаются только BM25-результаты.
+    """
+    snap = RAG_SNAPSHOT
+    if len(snap.chunks) == 0:
+        return snap, [[] for _ in queries]
+    depth = k * config.RAG_HYBRID_DEPTH if snap.lexical is not None else k
+    lexical = [snap.lexical.search(q, depth) if snap.lexical is not None else [] for q in queries]
+    q_embs = await _embed_queries_by_deadline(queries)
+    missed = sum(e is None for e in q_embs)
+    if missed:
+        logging.warning("RAG: no query embedding for %d/%d queries, using lexical results", missed, len(queries))
+    vector = _vector_rank(snap, q_embs, depth)
+
+    out = []
+    for vec_hits, lex_hits in zip(vector, lexical):
+        if vec_hits and lex_hits:
+            out.append(bm25.rrf([[i for i, _ in vec_hits], [i for i, _ in lex_hits]], k, config.RAG_RRF_K))
+        else:
+            out.append((vec_hits or lex_hits)[:k])
+    return snap, out
+
+async def search_many(queries: list[str], k: int = config.RAG_TOP_K) -> list[list[tuple[dict, float]]]:
+    """RU: Пакетный поиск: по списку top-k фрагментов на каждый запрос (в том же порядке)."""
+    if not config.RAG_ENABLED or not queries:
+        return [[] for _ in queries]
+    snap, hits = await _retrieve(queries, k)
+    return [[(snap.chunks[i], sc) for i, sc in row] for row in hits]
+
+def _mmr(snap: RagSnapshot, hits: list[tuple[int, float]], k: int, lam: float) -> list[tuple[int, float]]:
+    """RU: Maximal marginal relevance: релевантные, но непохожие друг на друга чанки.
+
+    Релевантность — нормированный итоговый вес поиска, похожесть — косинус
+    между векторами чанков из снимка.
+    """
+    if len(hits) <= 1 or snap.vecs is None or len(snap.vecs) == 0:
+        return hits[:k]
+    rel = np.array([sc for _, sc in hits], dtype="float32")
+    span = float(rel.max() - rel.min())
+    rel = (rel - rel.min()) / span if span > 0 else np.ones_like(rel)
+    V = snap.vecs.rows(np.array([i for i, _ in hits]))
+    V /= np.maximum(np.linalg.norm(V, axis=1, keepdims=True), 1e-12)
+    sim = V @ V.T
+    chosen = [0]
+    closest = sim[0].copy()
+    left = np.ones(len(hits), dtype=bool)
+    left[0] = False
+    while len(chosen) < k and left.any():
+        gain = np.where(left, lam * rel - (1.0 - lam) * closest, -np.inf)
+        j = int(np.argmax(gain))
+        chosen.append(j)
+        left[j] = False
+        closest = np.maximum(closest, sim[j])
+    return [hits[j] for j in chosen]
+
+async def search_context(query: str, k: int = config.RAG_TOP_K) -> list[tuple[dict, float]]:
+    """RU: Фрагменты для контекста модели: широкий гибридный поиск + отбор MMR без дублей."""
     if not config.RAG_ENABLED:
         return []
-    await _ensure_rag_index()
-    global RAG_VECS, RAG_CHUNKS
-    if RAG_VECS is None or len(RAG_CHUNKS) == 0:
-        return []
-    q_emb = (await _embed_batch([query]))[0]
-    q = np.array([q_emb], dtype="float32")
-    q /= max(np.linalg.norm(q), 1e-12)
-    sims = (RAG_VECS @ q.T).reshape(-1)
-    top_idx = np.argsort(-sims)[:k]
-    return [(RAG_CHUNKS[i], float(sims[i])) for i in top_idx]
+    snap, hits = await _retrieve([query], k * config.RAG_MMR_FETCH)
+    return [(snap.chunks[i], sc) for i, sc in _mmr(snap, hits[0], k, config.RAG_MMR_LAMBDA)]
 
-async def build_full_context(
+_OVERLAP_MIN = 20  # RU: символов — более короткие совпадения краёв не считаем перекрытием
+_CUT_RE = re.compile(r"[.!?…]\s|\n")
+
+def _overlap_len(left: str, right: str) -> int:
+    """RU: Длина самого длинного суффикса left, совпадающего с началом right."""
+    probe = right[:_OVERLAP_MIN]
+    if len(probe) < _OVERLAP_MIN:
+        return 0
+    pos = left.find(probe, max(0, len(left) - len(right)))
+    while pos != -1:
+        if right.startswith(left[pos:]):
+            return len(left) - pos
+        pos = left.find(probe, pos + 1)
+    return 0
+
+def _split_heading(text: str) -> tuple[str, str]:
+    """RU: Отделяет строку пути заголовков ("# A > B"), которую markdown-чанкер ставит в начало."""
+    if text.startswith("# "):
+        head, _, body = text.partition("\n")
+        return head + "\n", body
+    return "", text
+
+def _chunk_pos(ch: dict) -> tuple[str, int] | None:
+    """RU: (файл, порядковый номер чанка в файле) из id вида "<hash>:<i>"."""
+    try:
+        return ch["file"], int(str(ch.get("id", "")).rsplit(":", 1)[1])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+def _trim_to_tokens(text: str, budget: int) -> str:
+    """RU: Обрезает текст под бюджет токенов по границе предложения или строки."""
+    if chunker.approx_tokens(text) <= budget:
+        return text
+    cut = text[: max(0, budget * 3)]
+    ends = [m.end() for m in _CUT_RE.finditer(cut)]
+    if not ends or ends[-1] < len(cut) // 3:
+        return ""
+    return cut[: ends[-1]].rstrip()
+
+def pack_snippets(results: list[tuple[dict, float]], max_tokens: int) -> list[str]:
+    """RU: Укладывает фрагменты в бюджет токенов в порядке релевантности.
+
+    У соседних чанков одного файла вырезается общий кусок (перекрытие нарезки),
+    последний не влезающий фрагмент обрезается по границе предложения (если от
+    него остаётся только заголовок — фрагмент пропускается).
+    """
+    seen: dict[tuple[str, int], str] = {}
+    parts: list[str] = []
+    left = max_tokens
+    for ch, _sc in results:
+        text = (ch.get("text") or "").strip()
+        pos = _chunk_pos(ch)
+        if not text or left <= 0:
+            continue
+        if pos is not None:
+            file, n = pos
+            prev, nxt = seen.get((file, n - 1)), seen.get((file, n + 1))
+            seen[pos] = text
+            if prev is not None:
+                head, body = _split_heading(text)
+                rest = body[_overlap_len(prev, body):].lstrip("\n")
+                text = head + rest if rest.strip() else ""
+            if nxt is not None and text:
+                cut = _overlap_len(text, _split_heading(nxt)[1])
+                text = text[: len(text) - cut].rstrip()
+                if not _split_heading(text)[1].strip():
+                    text = ""
+        text = _trim_to_tokens(text.strip(), left)
+        if not _split_heading(text)[1].strip():
+            continue  # RU: от обрезанного фрагмента остался один заголовок — бюджет на него не тратим
+        parts.append(text)
+        left -= chunker.approx_tokens(text) + 1
+    return parts
+
+def _source_deadline(name: str) -> float:
+    """RU: Дедлайн источника контекста (сек от начала сборки), не больше общего бюджета."""
+    return min(config.RAG_SOURCE_DEADLINES.get(name, config.RAG_CONTEXT_BUDGET), config.RAG_CONTEXT_BUDGET)
+
+# RU: Результат источника, который проверка намерения решила не запрашивать
+_SKIPPED = object()
+
+def _record_source(name: str, outcome: str, ms: float) -> None:
+    """RU: Учитывает исход и время ответа источника в _CTX_STATS (у пропущенных — только счёт)."""
+    st = _CTX_STATS.setdefault(name, {"ok": 0, "late": 0, "error": 0, "skipped": 0, "ms_total": 0.0, "ms_max": 0.0})
+    st[outcome] += 1
+    if outcome == "skipped":
+        return
+    st["ms_total"] += ms
+    st["ms_max"] = max(st["ms_max"], ms)
+
+def _drain_late(name: str):
+    """RU: Колбэк для опоздавшей задачи: забирает исключение, чтобы оно не потерялось."""
+    def _done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning("RAG: late context source %s failed: %r", name, task.exception())
+    return _done
+
+async def _collect_sources(sources: dict[str, Awaitable]) -> dict:
+    """RU: Запускает источники контекста параллельно и ждёт каждый не дольше его дедлайна.
+
+    Возвращает {имя: результат} только для успевших источников. Опоздавшие не
+    отменяются (mc/mb_api допишут свои кэши для следующих сообщений), но в ответ
+    не попадают; упавшие логируются и тоже пропускаются. Если отменили саму
+    сборку (контекст больше не нужен), отменяются и все ещё идущие источники.
+    """
+    start = time.monotonic()
+    pending = {name: _spawn(coro) for name, coro in sources.items()}
+    try:
+        return await _wait_sources(pending, start)
+    except asyncio.CancelledError:
+        for task in pending.values():
+            task.cancel()
+        raise
+
+async def _wait_sources(pending: dict[str, asyncio.Task], start: float) -> dict:
+    """RU: Цикл ожидания _collect_sources; успевшие и опоздавшие удаляются из pending."""
+    results: dict = {}
+    timings: list[str] = []
+    while pending:
+        now = time.monotonic() - start
+        wait_for = max(0.0, min(_source_deadline(n) for n in pending) - now)
+        done, _ = await asyncio.wait(pending.values(), timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+        elapsed = time.monotonic() - start
+        ms = elapsed * 1000
+        for name, task in list(pending.items()):
+            if task in done:
+                del pending[name]
+                if task.exception() is not None:
+                    logging.error("RAG: context source %s failed", name, exc_info=task.exception())
+                    _record_source(name, "error", ms)
+                    timings.append(f"{name}=error({ms:.0f}ms)")
+                elif task.result() is _SKIPPED:
+                    results[name] = None
+                    _record_source(name, "skipped", ms)
+                    timings.append(f"{name}=skipped")
+                else:
+                    results[name] = task.result()
+                    _record_source(name, "ok", ms)
+                    timings.append(f"{name}={ms:.0f}ms")
+            elif elapsed >= _source_deadline(name):
+                del pending[name]
+                task.add_done_callback(_drain_late(name))
+                _record_source(name, "late", ms)
+                timings.append(f"{name}=late({ms:.0f}ms)")
+                logging.warning("RAG: context source %s missed its %.2fs deadline, dropped", name, _source_deadline(name))
+    logging.info("RAG: context sources %s", " ".join(timings))
+    return results
+
+def context_stats() -> dict:
+    """RU: Статистика источников контекста: успешные/опоздавшие/ошибки/пропущенные, среднее и макс. время запросов."""
+    return {
+        name: {**st, "ms_avg": st["ms_total"] / max(1, st["ok"] + st["late"] + st["error"])}
+        for name, st in _CTX_STATS.items()
+    }
+
+async def _intent_protos() -> dict[str, np.ndarray] | None:
+    """RU: Нормированные эмбеддинги эталонных фраз намерений; None — пока не получены."""
+    global _INTENT_PROTOS
+    if _INTENT_PROTOS is None:
+        phrases = [(name, p) for name, ps in intent.PROTOTYPES.items() for p in ps]
+        embs = await asyncio.gather(*(_embed_query(p) for _, p in phrases))
+        if any(e is None for e in embs):
+            return None
+        protos: dict[str, list] = {}
+        for (name, _), e in zip(phrases, embs):
+            protos.setdefault(name, []).append(e / max(float(np.linalg.norm(e)), 1e-12))
+        _INTENT_PROTOS = {name: np.stack(vs) for name, vs in protos.items()}
+    return _INTENT_PROTOS
+
+async def _gated_source(name: str, prompt: str, fetch: Callable[[], Awaitable], requested: set[str]):
+    """RU: Источник, который запрашивается, только если запрос близок к эталонам намерения.
+
+    Эмбеддинг запроса тот же, что и для поиска по базе знаний (общий батч и кэш).
+    Без эмбеддинга источник пропускается (результат _SKIPPED) — правила уже ничего
+    не нашли. Сработавшее намерение добавляется в requested.
+    """
+    q_emb, protos = await asyncio.gather(_embed_query(prompt), _intent_protos())
+    if q_emb is None or protos is None or name not in protos or \
+            not intent.match_vector(q_emb, {name: protos[name]}, config.RAG_INTENT_SIM):
+        _INTENT_STATS[name]["skipped"] += 1
+        return _SKIPPED
+    _INTENT_STATS[name]["vector"] += 1
+    requested.add(name)
+    return await fetch()
+
+def intent_stats() -> dict:
+    """RU: Сколько раз источники включались правилами, по сходству и сколько пропущено."""
+    return {name: dict(st) for name, st in _INTENT_STATS.items()}
+
+async def build_context(
     prompt: str,
     username: str | None = None,
     k: int = config.RAG_TOP_K,
-    max_chars: int = 2000,
-) -> str:
-    """RU: Собирает динамический контекст сервера, данные игрока и фрагменты RAG."""
+    max_tokens: int | None = None,
+    is_group: bool = False,
+) -> RagContext:
+    """RU: Собирает динамический контекст сервера, данные игрока и фрагменты RAG.
+
+    Статус и данные игрока запрашиваются, только если вопрос о них (модуль intent).
+    Источники опрашиваются параллельно в пределах RAG_CONTEXT_BUDGET; что не
+    успело к своему дедлайну (RAG_SOURCE_DEADLINES), в контекст не попадает.
+    """
     sections: list[str] = []
+    kb_version = RAG_SNAPSHOT.version
 
-    # Start independent requests in parallel
-    status_task = asyncio.create_task(mc.fetch_status())
-    search_task = asyncio.create_task(search(prompt, k=k))
-    player_task = asyncio.create_task(fetch_player_by_nick(username)) if username else None
+    # RU: Статус и данные игрока нужны редко — спрашиваем их, только если вопрос о них
+    sources: dict[str, Awaitable] = {"kb": search_context(prompt, k=k)}
+    fetchers: dict[str, Callable[[], Awaitable]] = {intent.STATUS: mc.fetch_status}
+    if username:
+        fetchers[intent.PLAYER] = lambda: fetch_player_by_nick(username)
+    wanted = intent.match_rules(prompt) if config.RAG_INTENT_GATING else set(fetchers)
+    requested: set[str] = set()
+    for name, fetch in fetchers.items():
+        if name in wanted:
+            _INTENT_STATS[name]["rules"] += 1
+            requested.add(name)
+            sources[name] = fetch()
+        elif config.RAG_INTENT_EMBED:
+            sources[name] = _gated_source(name, prompt, fetch, requested)
+        else:
+            _INTENT_STATS[name]["skipped"] += 1
+    got = await _collect_sources(sources)
 
-    # RU: Динамический контекст сервера
-    try:
-        payload = await status_task
-        server_ctx = mc.format_status_text(payload)
-        if server_ctx:
-            sections.append(f"Пиши про статус, только когда просят\n{server_ctx}\n")
-    except Exception:
-        logging.exception("RAG: failed to fetch server status")
+    # RU: Ответ зависит от статуса/данных игрока, если они были нужны — даже когда не успели
+    # или упали (иначе ответ без них попадёт в кэш); неясный итог проверки по сходству — тоже
+    dynamic = any(name in requested or (name in sources and name not in got) for name in fetchers)
 
-    # RU: Динамический контекст игрока
-    if username:
+    # RU: Динамический контекст сервера
+    if got.get("status") is not None:
         try:
-            player_info = await player_task
-            if player_info:
-                sections.append(f"Игрок (из MineBridge API):\nИспользуй данные аккаунта, только когда просят\n{json.dumps(player_info, ensure_ascii=False)}\n")
+            server_ctx = mc.format_status_text(got["status"])
+            if server_ctx:
+                sections.append(f"Пиши про статус, только когда просят\n{server_ctx}\n")
         except Exception:
-            logging.exception("RAG: failed to fetch player info")
-            
+            logging.exception("RAG: failed to format server status")
+
+    # RU: Динамический контекст игрока
+    player_info = got.get("player")
+    if player_info:
+        sections.append(f"Игрок (из MineBridge API):\nИспользуй данные аккаунта, только когда просят\n{json.dumps(player_info, ensure_ascii=False)}\n")
+
     sections.append(f"Текущая дата: {datetime.now()}")
 
     # RU: База знаний через семантический поиск
-    results = await search_task
+    results = got.get("kb")
     if results:
-        total = 0
-        kb_parts: list[str] = []
-        for ch, _sc in results:
-            snippet = (ch.get("text") or "").strip()
-            if not snippet:
-                continue
-            if total + len(snippet) > max_chars:
-                snippet = snippet[: max(0, max_chars - total)]
-            if snippet:
-                kb_parts.append(snippet)
-                total += len(snippet)
-            if total >= max_chars:
-                break
+        if max_tokens is None:
+            max_tokens = config.RAG_CONTEXT_TOKENS_GROUP if is_group else config.RAG_CONTEXT_TOKENS_DM
+        kb_parts = pack_snippets(results, max_tokens)
         if kb_parts:
-            sections.append("\n".join(kb_parts))
+            sections.append("\n\n".join(kb_parts))
 
-    return "\n\n".join([s for s in sections if s])
+    # RU: Эмбеддинг запроса уже посчитан поиском — берём его из кэша, без нового запроса
+    q_emb = _QCACHE.get(_normalize_query(prompt))
+    return RagContext("\n\n".join([s for s in sections if s]), dynamic, q_emb, kb_version)
+
+async def build_full_context(
+    prompt: str,
+    username: str | None = None,
+    k: int = config.RAG_TOP_K,
+    max_tokens: int | None = None,
+    is_group: bool = False,
+) -> str:
+    """RU: Текст контекста для модели (см. build_context)."""
+    return (await build_context(prompt, username, k, max_tokens, is_group)).text
@@ -0,0 +1,109 @@
+# ratelimit.py
+# RU: Ограничение частоты обращений к ИИ (token bucket) по пользователю и по чату.
+# Проверяется в auto_reply до подписки, скачивания файлов и сборки контекста.
+import time
+from collections import Counter, OrderedDict
+from typing import NamedTuple
+
+import config
+
+USER = "user"
+CHAT = "chat"
+
+
+class Decision(NamedTuple):
+    """RU: Результат проверки лимита."""
+    allowed: bool
+    retry_in: float      # RU: сек до появления нужного числа жетонов (0, если разрешено)
+    scope: str | None    # RU: какой лимит сработал: user/chat
+    notify: bool         # RU: первый отказ подряд — стоит сказать пользователю, дальше молчим
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "rejected")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+        self.rejected = False
+
+
+# RU: (scope, id) -> ведро; порядок — по последнему обращению, в начале самые давние
+_BUCKETS: "OrderedDict[tuple[str, int], _Bucket]" = OrderedDict()
+_REJECTS: Counter = Counter()
+_TOP: Counter = Counter()
+_TOP_MAX = 1000
+_STATS = {"allowed": 0, "expired": 0}
+
+
+def _limits(scope: str) -> tuple[float, float]:
+    """RU: (ёмкость, жетонов в секунду) для user/chat."""
+    if scope == USER:
+        return config.RATE_LIMIT_USER_BURST, config.RATE_LIMIT_USER_RATE
+    return config.RATE_LIMIT_CHAT_BURST, config.RATE_LIMIT_CHAT_RATE
+
+
+def _expire(now: float) -> None:
+    """RU: Удаляет ведра, к которым не обращались RATE_LIMIT_IDLE_TTL сек (они уже полные)."""
+    while _BUCKETS:
+        key, bucket = next(iter(_BUCKETS.items()))
+        if now - bucket.updated < config.RATE_LIMIT_IDLE_TTL:
+            break
+        del _BUCKETS[key]
+        _STATS["expired"] += 1
+
+
+def _bucket(scope: str, ident: int, now: float) -> _Bucket:
+    """RU: Ведро с начисленными за простой жетонами; переносится в конец порядка."""
+    burst, rate = _limits(scope)
+    key = (scope, ident)
+    bucket = _BUCKETS.get(key)
+    if bucket is None:
+        bucket = _BUCKETS[key] = _Bucket(burst, now)
+    else:
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+        _BUCKETS.move_to_end(key)
+    return bucket
+
+
+def check(user_id: int | None, chat_id: int, cost: float = 1.0, chat: bool = True) -> Decision:
+    """RU: Списывает cost жетонов из ведра пользователя и ведра чата, если хватает в обоих.
+
+    user_id=None — только ведро чата, chat=False — только ведро пользователя.
+    """
+    if not config.RATE_LIMIT_ENABLED:
+        return Decision(True, 0.0, None, False)
+    now = time.monotonic()
+    _expire(now)
+    buckets = [(CHAT, _bucket(CHAT, chat_id, now))] if chat else []
+    if user_id is not None:
+        buckets.insert(0, (USER, _bucket(USER, user_id, now)))
+    for scope, bucket in buckets:
+        if bucket.tokens < cost:
+            rate = _limits(scope)[1]
+            notify = not bucket.rejected
+            bucket.rejected = True
+            _REJECTS[scope] += 1
+            _TOP[(scope, user_id if scope == USER else chat_id)] += 1
+            if len(_TOP) > _TOP_MAX:
+                keep = _TOP.most_common(_TOP_MAX // 10)
+                _TOP.clear()
+                _TOP.update(dict(keep))
+            return Decision(False, (cost - bucket.tokens) / rate if rate > 0 else float("inf"), scope, notify)
+    for _, bucket in buckets:
+        bucket.tokens -= cost
+        bucket.rejected = False
+    _STATS["allowed"] += 1
+    return Decision(True, 0.0, None, False)
+
+
+def stats(top: int = 5) -> dict:
+    """RU: Пропущено/отклонено (по user/chat), живых вёдер и самые частые нарушители."""
+    return {
+        **_STATS,
+        "rejected_user": _REJECTS[USER],
+        "rejected_chat": _REJECTS[CHAT],
+        "buckets": len(_BUCKETS),
+        "top": _TOP.most_common(top),
+    }
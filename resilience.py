@@ -0,0 +1,223 @@
+# resilience.py
+# RU: Защита от сбоев апстримов (OpenRouter, Jina, Gemini, mcsrvstat, MineBridge API):
+# предохранитель (circuit breaker) на каждый апстрим и повторы с экспоненциальной
+# паузой и джиттером для временных ошибок.
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, TypeVar
+
+import httpx
+import openai
+
+import config
+
+try:
+    from google.api_core import exceptions as _gexc
+    _GOOGLE_RETRYABLE: tuple = (
+        _gexc.TooManyRequests,
+        _gexc.InternalServerError,
+        _gexc.ServiceUnavailable,
+        _gexc.DeadlineExceeded,
+    )
+except ImportError:
+    _GOOGLE_RETRYABLE = ()
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(RuntimeError):
+    """RU: Апстрим признан недоступным — запрос не отправлялся."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name}: circuit open, retry in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+def _options(name: str) -> dict:
+    """RU: Настройки апстрима из config.CIRCUIT_BREAKERS (с подстановкой значений по умолчанию).
+
+    Для имён вида "openrouter:<модель>" берутся настройки "openrouter", если своих нет.
+    """
+    own = config.CIRCUIT_BREAKERS.get(name)
+    if own is None:
+        own = config.CIRCUIT_BREAKERS.get(name.split(":", 1)[0], {})
+    return {**config.CIRCUIT_BREAKERS["default"], **own}
+
+
+class CircuitBreaker:
+    """RU: Предохранитель апстрима.
+
+    closed — запросы идут; после failures ошибок подряд — open: запросы сразу
+    отклоняются cooldown секунд; затем half_open — пропускается один пробный
+    запрос: успех закрывает предохранитель, ошибка снова открывает.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "retries": 0, "opened": 0}
+        self.last_error: str | None = None
+
+    def retry_in(self) -> float:
+        """RU: Сколько секунд осталось до пробного запроса (0 — можно пробовать)."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + _options(self.name)["cooldown"] - time.monotonic())
+
+    def allow(self) -> bool:
+        """RU: Можно ли отправить запрос сейчас (в half_open — только один пробный)."""
+        if self.state == OPEN and self.retry_in() <= 0:
+            self.state = HALF_OPEN
+            logging.info("circuit %s: half-open, probing", self.name)
+        if self.state == HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+        return self.state == CLOSED
+
+    def success(self) -> None:
+        if self.state != CLOSED:
+            logging.info("circuit %s: closed", self.name)
+        self.state = CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def failure(self, error: str) -> None:
+        self.failures += 1
+        self.stats["failures"] += 1
+        self.last_error = error
+        if self.state == HALF_OPEN or self.failures >= _options(self.name)["failures"]:
+            if self.state != OPEN:
+                self.stats["opened"] += 1
+                logging.warning("circuit %s: open after %s (%d failures)", self.name, error, self.failures)
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release(self) -> None:
+        """RU: Пробный запрос завершился ошибкой, не говорящей о здоровье апстрима (например, 4xx)."""
+        self.probing = False
+
+
+_BREAKERS: dict[str, CircuitBreaker] = {}
+
+
+def breaker(name: str) -> CircuitBreaker:
+    """RU: Предохранитель апстрима name (создаётся при первом обращении)."""
+    b = _BREAKERS.get(name)
+    if b is None:
+        b = _BREAKERS[name] = CircuitBreaker(name)
+    return b
+
+
+def _status(e: BaseException) -> int | None:
+    """RU: HTTP-статус ошибки httpx/openai, если он есть."""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code
+    return None
+
+
+def is_retryable(e: BaseException) -> bool:
+    """RU: Временная ошибка апстрима: сеть, таймаут, 429 или 5xx."""
+    status = _status(e)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(e, (
+        httpx.TransportError,
+        openai.APIConnectionError,  # RU: включая APITimeoutError
+        asyncio.TimeoutError,
+        *_GOOGLE_RETRYABLE,
+    ))
+
+
+def retry_after(e: BaseException) -> float | None:
+    """RU: Пауза из заголовка Retry-After ответа (секунды или HTTP-дата), если апстрим её прислал."""
+    resp = getattr(e, "response", None)
+    headers = getattr(resp, "headers", None)
+    if headers is None:
+        return None
+    value = (headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """RU: Экспоненциальная пауза с полным джиттером: random(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def call(name: str, fn: Callable[[], Awaitable[T]], *, retries: int | None = None) -> T:
+    """RU: Вызов апстрима через предохранитель с повторами временных ошибок.
+
+    fn — фабрика корутины (вызывается на каждую попытку). Открытый предохранитель
+    сразу даёт CircuitOpen; после исчерпания повторов пробрасывается последняя ошибка.
+    """
+    opts = _options(name)
+    retries = opts["retries"] if retries is None else retries
+    b = breaker(name)
+    for attempt in range(retries + 1):
+        if not b.allow():
+            b.stats["rejected"] += 1
+            raise CircuitOpen(name, b.retry_in())
+        b.stats["calls"] += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            b.release()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                # RU: Ошибка запроса (4xx, разбор ответа...) — апстрим жив, предохранитель не трогаем
+                b.release()
+                raise
+            b.failure(type(e).__name__ if _status(e) is None else f"HTTP {_status(e)}")
+            if attempt == retries or b.state == OPEN:
+                raise
+            delay = retry_after(e)
+            if delay is not None and delay > opts["backoff_max"]:
+                raise  # RU: апстрим просит подождать дольше, чем стоит держать пользователя
+            if delay is None:
+                delay = backoff(attempt, opts["backoff"], opts["backoff_max"])
+            b.stats["retries"] += 1
+            logging.warning("%s: %s, retry %d in %.2fs", name, b.last_error, attempt + 1, delay)
+            await asyncio.sleep(delay)
+        else:
+            b.success()
+            return result
+    raise AssertionError("unreachable")
+
+
+def health() -> dict:
+    """RU: Состояние предохранителей: статус, ошибки подряд, до пробного запроса, счётчики (failures — всего)."""
+    return {
+        name: {
+            "state": b.state,
+            "failures_in_row": b.failures,
+            "retry_in": b.retry_in(),
+            "last_error": b.last_error,
+            **b.stats,
+        }
+        for name, b in _BREAKERS.items()
+    }
@@ -0,0 +1,132 @@
+# vecstore.py
+# RU: Компактное хранилище RAG-индекса: квантованные векторы в mmap и метаданные
+# чанков в бинарном файле с таблицей смещений.
+import json
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+VEC_DTYPES = ("float32", "float16", "int8")
+
+# RU: Имена файлов индекса внутри config.RAG_INDEX_DIR
+CODES_FILE = "index.codes.npy"
+SCALES_FILE = "index.scales.npy"
+META_FILE = "index.meta.bin"
+OFFSETS_FILE = "index.meta.off.npy"
+
+_SCORE_BLOCK = 16384  # RU: строк за раз при подсчёте сходства (ограничивает временную память)
+
+
+class VecStore:
+    """RU: Матрица эмбеддингов в float32/float16/int8 с поштучным масштабом строк."""
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def from_float32(cls, V: np.ndarray, dtype: str = "int8") -> "VecStore":
+        """RU: Квантует нормированную float32-матрицу в выбранный формат."""
+        if dtype not in VEC_DTYPES:
+            raise ValueError(f"unsupported vector dtype: {dtype}")
+        V = np.asarray(V, dtype="float32")
+        if dtype == "int8":
+            amax = np.abs(V).max(axis=1) if len(V) else np.zeros(0, dtype="float32")
+            scales = (amax / 127.0).astype("float32")
+            scales[scales == 0.0] = 1.0
+            codes = np.clip(np.rint(V / scales[:, None]), -127, 127).astype("int8")
+        else:
+            codes = V.astype(dtype)
+            scales = np.ones(len(V), dtype="float32")
+        return cls(codes, scales)
+
+    @classmethod
+    def load(cls, directory: Path, mmap: bool = True) -> "VecStore":
+        """RU: Открывает векторы индекса; при mmap=True страницы делятся между процессами."""
+        mode = "r" if mmap else None
+        codes = np.load(directory / CODES_FILE, mmap_mode=mode)
+        scales = np.load(directory / SCALES_FILE, mmap_mode=mode)
+        return cls(codes, scales)
+
+    def save(self, directory: Path, suffix: str = "") -> None:
+        """RU: Записывает векторы и масштабы (suffix — для временных файлов)."""
+        with open(directory / (CODES_FILE + suffix), "wb") as f:
+            np.save(f, np.ascontiguousarray(self.codes))
+        with open(directory / (SCALES_FILE + suffix), "wb") as f:
+            np.save(f, np.ascontiguousarray(self.scales))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def dim(self) -> int:
+        return int(self.codes.shape[1]) if self.codes.ndim == 2 else 0
+
+    @property
+    def dtype(self) -> str:
+        return str(self.codes.dtype)
+
+    def rows(self, idx) -> np.ndarray:
+        """RU: Возвращает деквантованные float32-строки по индексам."""
+        return np.asarray(self.codes[idx], dtype="float32") * self.scales[idx, None]
+
+    def scores(self, Q: np.ndarray) -> np.ndarray:
+        """RU: Косинусное сходство (nq, N) для нормированных запросов Q (nq, dim)."""
+        Q = np.asarray(Q, dtype="float32")
+        out = np.empty((len(Q), len(self.codes)), dtype="float32")
+        for start in range(0, len(self.codes), _SCORE_BLOCK):
+            stop = start + _SCORE_BLOCK
+            block = np.asarray(self.codes[start:stop], dtype="float32")
+            out[:, start:stop] = (Q @ block.T) * self.scales[start:stop]
+        return out
+
+
+class ChunkTable(Sequence):
+    """RU: Метаданные чанков: JSON-записи подряд в одном файле + таблица смещений.
+
+    Записи декодируются лениво, по запросу — весь файл в память не разбирается.
+    """
+
+    def __init__(self, data, offsets: np.ndarray):
+        self._data = data
+        self._offsets = offsets
+
+    @classmethod
+    def load(cls, directory: Path) -> "ChunkTable":
+        """RU: Открывает таблицу чанков через mmap."""
+        offsets = np.load(directory / OFFSETS_FILE)
+        meta_path = directory / META_FILE
+        if meta_path.stat().st_size == 0:
+            return cls(b"", offsets)
+        return cls(np.memmap(meta_path, dtype=np.uint8, mode="r"), offsets)
+
+    @staticmethod
+    def save(chunks, directory: Path, suffix: str = "") -> None:
+        """RU: Сериализует список чанков в бинарный файл и таблицу смещений."""
+        offsets = [0]
+        with open(directory / (META_FILE + suffix), "wb") as f:
+            for c in chunks:
+                rec = json.dumps(c, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                f.write(rec)
+                offsets.append(offsets[-1] + len(rec))
+        with open(directory / (OFFSETS_FILE + suffix), "wb") as f:
+            np.save(f, np.array(offsets, dtype="uint64"))
+
+    def __len__(self) -> int:
+        return max(0, len(self._offsets) - 1)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start, stop = int(self._offsets[i]), int(self._offsets[i + 1])
+        return json.loads(bytes(self._data[start:stop]).decode("utf-8"))
+
+
+def exists(directory: Path) -> bool:
+    """RU: Есть ли в каталоге индекс в новом формате."""
+    return all((directory / name).exists() for name in (CODES_FILE, SCALES_FILE, META_FILE, OFFSETS_FILE))